@@ -0,0 +1,179 @@
+import asyncio
+import collections
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+
+from lib.codec import COMPACT, initial_line, negotiate
+
+
+#
+# 1つのプロセスで多数の対戦を同時に行うためのクライアントである．
+# players/random_player.pyなどのmainと同じ手順でサーバとやり取りするが，ソケットの代わりにasyncioのストリームを使う．
+# サーバの負荷試験などで，プロセスをたくさん起動する代わりに使う．
+#
+
+# 対戦の結果を表すメッセージである．
+OUTCOMES = ["you win", "you lose", "even"]
+
+
+#
+# サーバに接続し，playerで1回対戦する．結果のメッセージを返す．
+# codecsは使ってよい通信の形式の名前で，サーバが提示していればそれを使う．空ならJSONだけを使う．
+#
+async def play_session(host, port, player, codecs=(COMPACT.name,)):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        codec = negotiate((await reader.readline()).decode(), codecs)
+        writer.write((initial_line(player, codec) + '\n').encode())
+
+        while True:
+            info = (await reader.readline()).decode().rstrip()
+            if info == "your turn":
+                writer.write((codec.encode_action(player.decide()) + '\n').encode())
+                get_msg = await reader.readline()
+                player.update(codec.decode(get_msg.decode()), is_my_turn=True)
+            elif info == "waiting":
+                get_msg = await reader.readline()
+                player.update(codec.decode(get_msg.decode()), is_my_turn=False)
+            elif info in OUTCOMES:
+                return info
+            else:
+                raise RuntimeError("unknown information")
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+
+#
+# factory(seed)で作ったプレイヤーでseedsの数だけ対戦する．同時に接続する数はconcurrencyまでにする．
+# 結果のメッセージごとの回数を返す．例外が起きた対戦は"error"として数える．
+#
+async def run_sessions(host, port, factory, seeds, concurrency=100, codecs=(COMPACT.name,)):
+    semaphore = asyncio.Semaphore(concurrency)
+    results = collections.Counter()
+
+    async def session(seed):
+        async with semaphore:
+            try:
+                results[await play_session(host, port, factory(seed), codecs)] += 1
+            except (OSError, RuntimeError, ValueError):
+                results["error"] += 1
+
+    await asyncio.gather(*(session(seed) for seed in seeds))
+    return results
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'test':
+        import json
+        import unittest
+
+        from lib.engine import MAX_TURNS, Server
+        from players.ai_player import AIPlayer
+        from players.random_player import RandomPlayer
+
+        #
+        # テスト用の簡単なサーバ．接続を2つずつ組にして，source/server.rbのmainと同じ手順で対戦させる．
+        #
+        async def start_stand_in_server():
+            waiting = []
+
+            async def match(streams):
+                for _, writer in streams:
+                    writer.write(b"you are connected. please send me initial state.\n")
+                positions = [json.loads(await reader.readline()) for reader, _ in streams]
+                server = Server(*positions)
+                winner = -1
+                turns = 0
+                c = 0
+                while winner == -1 and turns < MAX_TURNS:
+                    streams[c][1].write(b"your turn\n")
+                    streams[1 - c][1].write(b"waiting\n")
+                    act = json.loads(await streams[c][0].readline())
+                    results = server.action(c, act)
+                    streams[c][1].write((json.dumps(results[0]) + '\n').encode())
+                    streams[1 - c][1].write((json.dumps(results[1]) + '\n').encode())
+                    if "outcome" in results[0]:
+                        winner = c if results[0]["outcome"] else 1 - c
+                    c = 1 - c
+                    turns += 1
+                if winner == -1:
+                    for _, writer in streams:
+                        writer.write(b"even\n")
+                else:
+                    streams[winner][1].write(b"you win\n")
+                    streams[1 - winner][1].write(b"you lose\n")
+                for _, writer in streams:
+                    await writer.drain()
+                    writer.close()
+
+            async def accept(reader, writer):
+                waiting.append((reader, writer))
+                if len(waiting) == 2:
+                    streams = waiting[:]
+                    waiting.clear()
+                    await match(streams)
+
+            return await asyncio.start_server(accept, '127.0.0.1', 0)
+
+        class AsyncClientTest(unittest.TestCase):
+
+            def run_against_stand_in(self, factory, sessions):
+                async def main():
+                    server = await start_stand_in_server()
+                    port = server.sockets[0].getsockname()[1]
+                    async with server:
+                        return await run_sessions('127.0.0.1', port, factory, range(sessions), 10)
+                return asyncio.run(main())
+
+            def test_random(self):
+                results = self.run_against_stand_in(RandomPlayer, 20)
+                self.assertEqual(20, sum(results.values()))
+                self.assertEqual(results["you win"], results["you lose"])
+                self.assertEqual(0, results["error"])
+
+            def test_ai(self):
+                results = self.run_against_stand_in(lambda seed: AIPlayer(seed) if seed % 2
+                                                    else RandomPlayer(seed), 10)
+                self.assertEqual(10, sum(results.values()))
+
+        unittest.main(argv=sys.argv[:1])
+    else:
+        import argparse
+
+        from lib.tournament import load_player
+
+        parser = argparse.ArgumentParser(description="Play many sessions from one process")
+        parser.add_argument(
+            "host",
+            metavar="H",
+            type=str,
+            help="Hostname of the server. E.g., localhost",
+        )
+        parser.add_argument(
+            "port",
+            metavar="P",
+            type=int,
+            help="Port of the server. E.g., 2000",
+        )
+        parser.add_argument("--player", type=str, default="players.random_player:RandomPlayer",
+                            help="Player class. E.g., players.ai_player:AIPlayer")
+        parser.add_argument("--sessions", type=int, default=100, help="Number of sessions")
+        parser.add_argument("--concurrency", type=int, default=100,
+                            help="Maximum number of simultaneous sessions")
+        parser.add_argument("--seed", type=int, default=0, help="First seed")
+        parser.add_argument("--codec", type=str, default="compact",
+                            help="Line format to use if the server offers it. E.g., json, compact")
+        args = parser.parse_args()
+
+        start = time.perf_counter()
+        results = asyncio.run(run_sessions(args.host, args.port, load_player(args.player),
+                                           range(args.seed, args.seed + args.sessions),
+                                           args.concurrency, (args.codec,)))
+        elapsed = time.perf_counter() - start
+        for outcome in OUTCOMES + ["error"]:
+            print(f"{outcome}: {results[outcome]}")
+        print(f"{sum(results.values())} sessions in {elapsed:.1f}s")
@@ -0,0 +1,862 @@
+import copy
+import os
+import sys
+
+sys.path.append(os.getcwd())
+
+from lib.player_base import (ATTACK_CELLS, ATTACK_MASKS, NEAR_CELLS, NEAR_MASKS, SHIP_TYPES, Player, PlayerShip,
+                              cells, lazy_table)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+#
+# 相手の艦がいる場所の予測(確率分布)を保持するクラスを定義している．
+# AIPlayerは通知された情報をこれらのクラスに渡し，攻撃先を問い合わせる．
+# どのクラスも同じメソッドを持つので，AIPlayerのbelief引数で入れ替えられる．
+# 配置を列挙して厳密に更新するExactBeliefはlib/tracker.pyにある．
+#
+#   reset(ship_type)                     撃沈された艦の予測を0にする．
+#   moved(ship_type, dx, dy)             相手の艦の移動を反映する．
+#   attacked(position, hit, near)        自分の攻撃の結果を反映する．
+#   enemy_attacked(position, alive)      相手の攻撃を反映する．aliveは残っている相手の艦種である．
+#   target(mask)                         maskのマスのうち，艦種の予測の合計が最も大きいマスのインデックスを返す．
+#   prediction(ship_type)                予測を5x5のリストで返す．表示用である．
+#
+
+# 艦種の順番はlib/player_base.pyのSHIP_TYPESである．NumpyBeliefの配列の0番目の軸もこの順になっている．
+
+
+# 周囲1マス(中心を除く)に加算する値の表．フィールド外のマスの数だけ値が大きくなる．
+NEAR_FACTORS = lazy_table(lambda cell: 1 / len(NEAR_CELLS[cell]))
+
+# 周囲1マス(中心を含む)に加算する値の表．
+AROUND_FACTORS = lazy_table(lambda cell: 1 / len(ATTACK_CELLS[cell]))
+
+
+# リストで予測を持つ実装である．AIPlayerがもともと持っていた処理を移したもの．
+class ListBelief:
+
+    def __init__(self):
+        self.maps = {ship_type: self.zeros() for ship_type in SHIP_TYPES}
+
+    def zeros(self):
+        return [[0] * Player.FIELD_SIZE for _ in range(Player.FIELD_SIZE)]
+
+    # 予測を複製する．複製を更新しても元の予測は変わらない．
+    def copy(self):
+        new = copy.copy(self)
+        new.maps = {ship_type: [row[:] for row in pred] for ship_type, pred in self.maps.items()}
+        return new
+
+    def reset(self, ship_type):
+        self.maps[ship_type] = self.zeros()
+
+    def moved(self, ship_type, dx, dy):
+        self.maps[ship_type] = self.move_predictions(self.maps[ship_type], dx, dy)
+
+    def attacked(self, position, hit, near):
+        x, y = position
+        # hitした場合は，hitした場所を1にして，それ以外を0にする．HPが1の艦は撃沈するので，resetで初期化される．
+        if hit is not None and PlayerShip.MAX_HPS[hit] > 1:
+            self.maps[hit] = self.zeros()
+            self.maps[hit][x][y] = 1
+        # hitしなかったら，そのマスは0にして正規化する．
+        else:
+            for pred in self.maps.values():
+                pred[x][y] = 0
+                self.normalize(pred)
+
+        # nearの場合，周囲1マスに足して，中心は0にする．
+        for n in near:
+            self.update_near_predictions(self.maps[n], position)
+
+        # nearとhitに含まれない場合，周囲のマスを0にする
+        for ship_type in SHIP_TYPES:
+            if ship_type not in near and hit != ship_type:
+                self.clear_around_predictions(self.maps[ship_type], position)
+                self.normalize(self.maps[ship_type])
+
+    # 相手が攻撃した場所の周囲1マス（中心も含む）に足す．
+    def enemy_attacked(self, position, alive):
+        for ship_type in alive:
+            self.update_around_predictions(self.maps[ship_type], position)
+
+    # 艦ごとの予測を足し合わせて，最も値が大きいマスを返す．同じ値なら行優先で先のマスを選ぶ．
+    def target(self, mask):
+        if len(SHIP_TYPES) != 3:
+            return self.target_any(mask)
+        pred_w, pred_c, pred_s = (self.maps[ship_type] for ship_type in SHIP_TYPES)
+        max = -1
+        to = None
+        for cell in cells(mask):
+            i, j = divmod(cell, Player.FIELD_SIZE)
+            p = pred_w[i][j] + pred_c[i][j] + pred_s[i][j]
+            if p > max:
+                max = p
+                to = cell
+        return to
+
+    # 艦が3隻でない規則の場合のtargetである．足す順番はtargetと同じにする．
+    def target_any(self, mask):
+        preds = [self.maps[ship_type] for ship_type in SHIP_TYPES]
+        max = -1
+        to = None
+        for cell in cells(mask):
+            i, j = divmod(cell, Player.FIELD_SIZE)
+            p = 0
+            for pred in preds:
+                p += pred[i][j]
+            if p > max:
+                max = p
+                to = cell
+        return to
+
+    def prediction(self, ship_type):
+        return self.maps[ship_type]
+
+    # 移動を反映させる
+    def move_predictions(self, pred, dx, dy):
+        new_pred = self.zeros()
+        for i in range(Player.FIELD_SIZE):
+            for j in range(Player.FIELD_SIZE):
+                ni, nj = i + dx, j + dy
+                if Player.in_field([ni, nj]):
+                    new_pred[ni][nj] = pred[i][j]
+        return new_pred
+
+    # 周囲のマスの数に基づいて，加算する値を決める．
+    # nearの場合，中心の1マスは計算しない．
+    def update_near_predictions(self, pred, position):
+        x, y = position
+        cell = x * Player.FIELD_SIZE + y
+        factor = NEAR_FACTORS[cell]
+        for n in cells(NEAR_MASKS[cell]):
+            i, j = divmod(n, Player.FIELD_SIZE)
+            pred[i][j] += factor
+        pred[x][y] = 0
+        self.divide_two(pred)
+
+    # 攻撃の場合，中心も含めて計算する．
+    def update_around_predictions(self, pred, position):
+        cell = position[0] * Player.FIELD_SIZE + position[1]
+        factor = AROUND_FACTORS[cell]
+        for n in cells(ATTACK_MASKS[cell]):
+            i, j = divmod(n, Player.FIELD_SIZE)
+            pred[i][j] += factor
+        self.divide_two(pred)
+
+    # 周囲9マスを0にする．
+    def clear_around_predictions(self, pred, position):
+        # 値が1のマスがあれば更新を行わない．
+        if any(pred[i][j] == 1 for i in range(Player.FIELD_SIZE) for j in range(Player.FIELD_SIZE)):
+            return
+        for n in cells(ATTACK_MASKS[position[0] * Player.FIELD_SIZE + position[1]]):
+            i, j = divmod(n, Player.FIELD_SIZE)
+            pred[i][j] = 0
+
+    # 確率分布を2で割るメソッド
+    def divide_two(self, pred):
+        # 初回は割る必要がないため，合計が約1であり，約2ではない場合は割らないようにする．
+        total = sum(sum(row) for row in pred)
+        # 1に近い値の場合は割らない．つまり，1との差が0.1よりも大きいならば割る．
+        if abs(total - 1) > 0.1:
+            for i in range(Player.FIELD_SIZE):
+                for j in range(Player.FIELD_SIZE):
+                    if pred[i][j] != 0:
+                        pred[i][j] /= 2
+
+    # 正規化を行う．ヒットしなかった場合に使用する．
+    def normalize(self, pred):
+        total = sum(sum(row) for row in pred)
+        if total > 0:
+            for i in range(Player.FIELD_SIZE):
+                for j in range(Player.FIELD_SIZE):
+                    pred[i][j] /= total
+
+
+#
+# 予測を艦種ごとに{マス: 値}の連想配列で持つ実装である．値が0のマスは持たない．
+# ListBeliefと同じ順番で浮動小数点の計算を行うので同じ攻撃先を選ぶが，更新の手間は盤面の広さではなく，
+# 値を持つマスと攻撃の周囲のマスの数で決まる．大きい盤面や，艦種の多い艦隊(lib/player_base.pyのconfigure)で使う．
+# 命中した艦の最大HPが1より大きければ，沈んでいなければそのマスにいると分かる．ListBeliefの'w'と'c'に当たる．
+#
+class SparseBelief:
+
+    def __init__(self):
+        self.maps = {ship_type: {} for ship_type in SHIP_TYPES}
+
+    def copy(self):
+        new = copy.copy(self)
+        new.maps = {ship_type: dict(pred) for ship_type, pred in self.maps.items()}
+        return new
+
+    def reset(self, ship_type):
+        self.maps[ship_type] = {}
+
+    def moved(self, ship_type, dx, dy):
+        size = Player.FIELD_SIZE
+        moved = {}
+        for cell, p in self.maps[ship_type].items():
+            x, y = divmod(cell, size)
+            x += dx
+            y += dy
+            if 0 <= x < size and 0 <= y < size:
+                moved[x * size + y] = p
+        self.maps[ship_type] = moved
+
+    def attacked(self, position, hit, near):
+        cell = position[0] * Player.FIELD_SIZE + position[1]
+        if hit is not None and PlayerShip.MAX_HPS[hit] > 1:
+            self.maps[hit] = {cell: 1}
+        else:
+            for pred in self.maps.values():
+                pred.pop(cell, None)
+                self.normalize(pred)
+
+        for n in near:
+            self.update_near(self.maps[n], cell)
+
+        for ship_type in SHIP_TYPES:
+            if ship_type not in near and hit != ship_type:
+                self.clear_around(self.maps[ship_type], cell)
+                self.normalize(self.maps[ship_type])
+
+    def enemy_attacked(self, position, alive):
+        cell = position[0] * Player.FIELD_SIZE + position[1]
+        factor = AROUND_FACTORS[cell]
+        for ship_type in alive:
+            pred = self.maps[ship_type]
+            for c in ATTACK_CELLS[cell]:
+                pred[c] = pred.get(c, 0) + factor
+            self.divide_two(pred)
+
+    def target(self, mask):
+        maps = [self.maps[ship_type] for ship_type in SHIP_TYPES]
+        max = -1
+        to = None
+        for cell in cells(mask):
+            p = 0
+            for pred in maps:
+                p += pred.get(cell, 0)
+            if p > max:
+                max = p
+                to = cell
+        return to
+
+    # 表示用に，ListBeliefと同じ形のリストに広げて返す．
+    def prediction(self, ship_type):
+        size = Player.FIELD_SIZE
+        pred = self.maps[ship_type]
+        return [[pred.get(x * size + y, 0) for y in range(size)] for x in range(size)]
+
+    def update_near(self, pred, cell):
+        factor = NEAR_FACTORS[cell]
+        for c in NEAR_CELLS[cell]:
+            pred[c] = pred.get(c, 0) + factor
+        pred.pop(cell, None)
+        self.divide_two(pred)
+
+    # 周囲9マスを0にする．値が1のマスがあれば更新を行わない．
+    def clear_around(self, pred, cell):
+        if any(p == 1 for p in pred.values()):
+            return
+        for c in ATTACK_CELLS[cell]:
+            pred.pop(c, None)
+
+    #
+    # 合計をListBeliefと同じ順番で計算する．行ごとに列の順に足し，行の合計を行の順に足す．
+    # 値が0のマスを飛ばしても，0を足す計算は結果を変えないので同じ値になる．
+    #
+    def total(self, pred):
+        size = Player.FIELD_SIZE
+        rows = {}
+        for cell in sorted(pred):
+            rows.setdefault(cell // size, []).append(pred[cell])
+        return sum(sum(rows[x]) for x in sorted(rows))
+
+    def divide_two(self, pred):
+        if abs(self.total(pred) - 1) > 0.1:
+            for cell in pred:
+                pred[cell] /= 2
+
+    def normalize(self, pred):
+        total = self.total(pred)
+        if total > 0:
+            for cell in pred:
+                pred[cell] /= total
+
+
+#
+# IncrementalBeliefの1つの艦種の予測である．値が0でないマスだけを{マス: 値}で持ち，マスの本当の値はvalues[cell] / divisorである．
+# 2で割る処理と正規化はdivisorを変えるだけで，マスの値は読む時に割る．totalはvaluesの合計で，変えたマスの分だけ足し引きする．
+# removedは前に合計を足し直してから引いた値の合計である．
+# certainは予測が値1のマス1つだけであること(ListBeliefの「値が1のマスがある」)を，bestはvaluesが最も大きいマスを表す．
+# bestはNoneなら分からないことを表し，使う時に求め直す．同じ値なら番号の小さいマスにする．
+#
+class RunningMap:
+
+    __slots__ = ('values', 'divisor', 'total', 'removed', 'certain', 'best')
+
+    # divisorがこの範囲を出たら，マスの値を割り直してdivisorを1に戻す．
+    REBASE = 2.0 ** 64
+
+    def __init__(self, values=None):
+        self.values = {} if values is None else values
+        self.divisor = 1
+        self.resum()
+        self.certain = False
+        self.best = None
+
+    def copy(self):
+        new = RunningMap(dict(self.values))
+        new.divisor = self.divisor
+        new.total = self.total
+        new.removed = self.removed
+        new.certain = self.certain
+        new.best = self.best
+        return new
+
+    def value(self, cell):
+        v = self.values.get(cell)
+        return 0 if v is None else v / self.divisor
+
+    # 値が1のマスcellだけにする．
+    def set_one(self, cell):
+        self.values = {cell: 1}
+        self.divisor = 1
+        self.total = 1
+        self.removed = 0
+        self.certain = True
+        self.best = cell
+
+    # マスcellに本当の値でpを足す．
+    def add(self, cell, p):
+        values = self.values
+        v = values.get(cell, 0) + p * self.divisor
+        values[cell] = v
+        self.total += p * self.divisor
+        self.certain = False
+        best = self.best
+        if best is not None and best != cell and (v > values[best] or v == values[best] and cell < best):
+            self.best = cell
+
+    def remove(self, cell):
+        v = self.values.pop(cell, None)
+        if v is not None:
+            self.total -= v
+            self.certain = False
+            if cell == self.best:
+                self.best = None
+            # 前に足し直してから引いた値より合計が小さくなると，引き算の誤差が大きくなるので足し直す．
+            self.removed += v
+            if self.total < self.removed:
+                self.resum()
+
+    def get_best(self):
+        if self.best is None and self.values:
+            best = None
+            for cell, v in self.values.items():
+                if best is None or v > self.values[best] or v == self.values[best] and cell < best:
+                    best = cell
+            self.best = best
+        return self.best
+
+    # ListBeliefのdivide_twoである．合計が約1でなければ2で割る．
+    def divide_two(self):
+        if abs(self.total / self.divisor - 1) > 0.1:
+            self.divisor *= 2
+            self.certain = False
+            if self.divisor > self.REBASE:
+                self.rebase()
+
+    # ListBeliefのnormalizeである．残ったマスが1つなら，その値は1になる．
+    def normalize(self):
+        if self.total > 0:
+            if len(self.values) == 1:
+                self.set_one(next(iter(self.values)))
+            else:
+                self.divisor = self.total
+                if not 1 / self.REBASE < self.divisor < self.REBASE:
+                    self.rebase()
+
+    # マスの値を本当の値にして，divisorを1に戻す．本当の値は変わらない．
+    def rebase(self):
+        d = self.divisor
+        self.values = {cell: v / d for cell, v in self.values.items()}
+        self.divisor = 1
+        self.resum()
+
+    # 合計を足し直す．
+    def resum(self):
+        self.total = sum(self.values.values())
+        self.removed = 0
+
+    # (dx, dy)だけ動かした予測を返す．盤面の外に出たマスは捨てる．値は本当の値にする．
+    def moved(self, dx, dy):
+        size = Player.FIELD_SIZE
+        d = self.divisor
+        values = {}
+        for cell, v in self.values.items():
+            x, y = divmod(cell, size)
+            x += dx
+            y += dy
+            if 0 <= x < size and 0 <= y < size:
+                values[x * size + y] = v / d
+        new = RunningMap(values)
+        new.certain = self.certain and len(values) == 1
+        return new
+
+
+#
+# 予測をRunningMapで持つ実装である．ListBeliefと同じ攻撃先を選ぶ．
+# ListBeliefは攻撃や移動のたびに予測全体の合計を求め，全体を割り，値が1のマスを探し，攻撃先を選ぶために全体を見る．
+# この実装では，合計，値が1のマスだけかどうか，最も値が大きいマスを艦種ごとに持ち，更新は変わったマスの分だけ行う．
+# 2で割る処理と正規化は割る数を覚えておくだけにし，値を読む時に割る．攻撃先は値を持つマスだけから選ぶ．
+# 割る順番がListBeliefと違うので値は最後の桁で違うことがあるが，固定したシードの対戦ではListBeliefと同じ行動を選ぶ．
+#
+class IncrementalBelief:
+
+    def __init__(self):
+        self.maps = {ship_type: RunningMap() for ship_type in SHIP_TYPES}
+
+    def copy(self):
+        new = copy.copy(self)
+        new.maps = {ship_type: pred.copy() for ship_type, pred in self.maps.items()}
+        return new
+
+    def reset(self, ship_type):
+        self.maps[ship_type] = RunningMap()
+
+    def moved(self, ship_type, dx, dy):
+        self.maps[ship_type] = self.maps[ship_type].moved(dx, dy)
+
+    def attacked(self, position, hit, near):
+        cell = position[0] * Player.FIELD_SIZE + position[1]
+        if hit is not None and PlayerShip.MAX_HPS[hit] > 1:
+            self.maps[hit].set_one(cell)
+        else:
+            for pred in self.maps.values():
+                pred.remove(cell)
+                pred.normalize()
+
+        for n in near:
+            pred = self.maps[n]
+            factor = NEAR_FACTORS[cell]
+            for c in NEAR_CELLS[cell]:
+                pred.add(c, factor)
+            pred.remove(cell)
+            pred.divide_two()
+
+        for ship_type in SHIP_TYPES:
+            if ship_type not in near and hit != ship_type:
+                pred = self.maps[ship_type]
+                # 値が1のマスがあれば周囲を0にしない．
+                if not pred.certain:
+                    for c in ATTACK_CELLS[cell]:
+                        pred.remove(c)
+                pred.normalize()
+
+    def enemy_attacked(self, position, alive):
+        cell = position[0] * Player.FIELD_SIZE + position[1]
+        factor = AROUND_FACTORS[cell]
+        for ship_type in alive:
+            pred = self.maps[ship_type]
+            for c in ATTACK_CELLS[cell]:
+                pred.add(c, factor)
+            pred.divide_two()
+
+    #
+    # maskのマスのうち，予測の合計が最も大きいマスを返す．同じ値なら番号の小さいマスを選ぶ．
+    # 値を持つマスがmaskになければ，どのマスも0なのでmaskの最初のマスを返す．
+    # 値を持つ予測が1つだけなら，その予測のbestが攻撃できればそれを返す．
+    #
+    def target(self, mask):
+        if not mask:
+            return None
+        maps = [pred for pred in (self.maps[ship_type] for ship_type in SHIP_TYPES) if pred.values]
+        if len(maps) == 1:
+            best = maps[0].get_best()
+            if mask >> best & 1:
+                return best
+        candidates = set()
+        for pred in maps:
+            candidates.update(pred.values)
+        max = 0
+        to = None
+        for cell in sorted(candidates):
+            if mask >> cell & 1:
+                p = 0
+                for pred in maps:
+                    p += pred.value(cell)
+                if p > max:
+                    max = p
+                    to = cell
+        if to is None:
+            return (mask & -mask).bit_length() - 1
+        return to
+
+    # 表示用に，ListBeliefと同じ形のリストに広げて返す．
+    def prediction(self, ship_type):
+        size = Player.FIELD_SIZE
+        pred = self.maps[ship_type]
+        return [[pred.value(x * size + y) for y in range(size)] for x in range(size)]
+
+
+#
+# 3つの予測を1つの(3, 5, 5)の配列で持つ実装である．numpyが必要．
+# 移動はスライス，正規化は配列の割り算，周囲のマスの更新は事前に作った表で行う．
+# ListBeliefと同じ順番で浮動小数点の計算を行うので，同じ攻撃先を選ぶ．
+#
+class NumpyBelief:
+
+    # 表はクラスで共有し，最初に作られた時にlib/tables.pyから読み込む．盤面の大きさが変わったら作り直す．
+    tables = None
+    size = None
+
+    def __init__(self):
+        if np is None:
+            raise ImportError('NumpyBelief requires numpy')
+        if NumpyBelief.size != Player.FIELD_SIZE:
+            from lib import tables
+            arrays = tables.get(tables.stencils_name())
+            NumpyBelief.tables = (arrays['near_stencils'], arrays['around_stencils'], NumpyBelief.build_slices())
+            NumpyBelief.size = Player.FIELD_SIZE
+        self.near_stencils, self.around_stencils, self.around_slices = NumpyBelief.tables
+        self.pred = np.zeros((len(SHIP_TYPES), Player.FIELD_SIZE, Player.FIELD_SIZE))
+        self.index = {ship_type: k for k, ship_type in enumerate(SHIP_TYPES)}
+        self.selectors = {}
+
+    # 表は共有し，予測の配列だけを複製する．
+    def copy(self):
+        new = copy.copy(self)
+        new.pred = self.pred.copy()
+        return new
+
+    # 各マスについて，加算する値の表を作る．
+    @staticmethod
+    def build_tables():
+        size = Player.FIELD_SIZE
+        n = size * size
+        near_stencils = np.zeros((n, size, size))
+        around_stencils = np.zeros((n, size, size))
+        for cell in range(n):
+            for m in cells(NEAR_MASKS[cell]):
+                near_stencils[cell].flat[m] = NEAR_FACTORS[cell]
+            for m in cells(ATTACK_MASKS[cell]):
+                around_stencils[cell].flat[m] = AROUND_FACTORS[cell]
+        return near_stencils, around_stencils
+
+    # 各マスについて，周囲9マスを表すスライスを作る．
+    @staticmethod
+    def build_slices():
+        size = Player.FIELD_SIZE
+        return [(slice(max(x - 1, 0), x + 2), slice(max(y - 1, 0), y + 2))
+                for x in range(size) for y in range(size)]
+
+    def reset(self, ship_type):
+        self.pred[self.index[ship_type]] = 0
+
+    # 移動した分だけスライスをずらして写す．フィールド外に出た値は捨てる．
+    def moved(self, ship_type, dx, dy):
+        size = Player.FIELD_SIZE
+        k = self.index[ship_type]
+        old = self.pred[k].copy()
+        self.pred[k] = 0
+        if abs(dx) < size and abs(dy) < size:
+            self.pred[k, max(dx, 0):size + min(dx, 0), max(dy, 0):size + min(dy, 0)] = \
+                old[max(-dx, 0):size + min(-dx, 0), max(-dy, 0):size + min(-dy, 0)]
+
+    def attacked(self, position, hit, near):
+        x, y = position
+        cell = x * Player.FIELD_SIZE + y
+        pred = self.pred
+        if hit is not None and PlayerShip.MAX_HPS[hit] > 1:
+            k = self.index[hit]
+            pred[k] = 0
+            pred[k, x, y] = 1
+        else:
+            pred[:, x, y] = 0
+            self.normalize(self.select(SHIP_TYPES))
+
+        for n in near:
+            k = self.index[n]
+            pred[k] += self.near_stencils[cell]
+            pred[k, x, y] = 0
+            self.divide_two(self.select(n))
+
+        others = self.select([ship_type for ship_type in SHIP_TYPES
+                              if ship_type not in near and hit != ship_type])
+        # 値が1のマスがある予測は周囲を0にしない．0を掛けるか1を掛けるかで選ぶ．
+        keep = ~(others & ~(pred == 1).any(axis=(1, 2)))
+        rows, columns = self.around_slices[cell]
+        pred[:, rows, columns] *= keep[:, None, None]
+        self.normalize(others)
+
+    def enemy_attacked(self, position, alive):
+        alive = self.select(alive)
+        self.pred += self.around_stencils[position[0] * Player.FIELD_SIZE + position[1]] \
+            * alive[:, None, None]
+        self.divide_two(alive)
+
+    #
+    # 攻撃できるマスだけを取り出して，艦種の予測の合計のargmaxをとる．argmaxは最初の最大値を返す．
+    # マスは小さい順なので，ListBeliefと同じマスを選ぶ．64マスを超える盤面でも使えるように，maskはシフトせずにマスに分ける．
+    #
+    def target(self, mask):
+        if not mask:
+            return None
+        attackable = np.fromiter(cells(mask), dtype=np.intp)
+        total = self.pred.sum(axis=0).ravel()
+        return int(attackable[total[attackable].argmax()])
+
+    def prediction(self, ship_type):
+        return self.pred[self.index[ship_type]].tolist()
+
+    # 艦種の集まりを，0番目の軸に対応する真偽値の配列にする．艦種の名前は連結せず，インデックスで選ぶ．
+    def select(self, ship_types):
+        key = tuple(ship_types)
+        selector = self.selectors.get(key)
+        if selector is None:
+            selector = np.zeros(len(SHIP_TYPES), dtype=bool)
+            selector[[self.index[ship_type] for ship_type in key]] = True
+            self.selectors[key] = selector
+        return selector
+
+    # 行ごとに足してから合計する．ListBeliefと同じ順番で足すので，合計は完全に一致する．
+    def totals(self):
+        return self.pred.sum(axis=2).sum(axis=1)
+
+    # 選んだ予測のうち，合計が1から0.1以上離れているものを半分にする．0.5を掛けても2で割っても同じ値になる．
+    def divide_two(self, selector):
+        half = selector & (np.abs(self.totals() - 1) > 0.1)
+        self.pred *= np.where(half, 0.5, 1.0)[:, None, None]
+
+    # 選んだ予測のうち，合計が正のものを合計で割る．
+    def normalize(self, selector):
+        totals = self.totals()
+        np.divide(self.pred, totals[:, None, None], out=self.pred,
+                  where=(selector & (totals > 0))[:, None, None])
+
+
+# 厳密なベイズ更新を行う実装である．lib/tracker.pyがこのモジュールを使うので，使う時に読み込む．
+def ExactBelief():
+    from lib.tracker import ExactBelief
+    return ExactBelief()
+
+
+# AIPlayerのbelief引数に名前で渡せる実装の一覧である．
+BELIEFS = {'list': ListBelief, 'numpy': NumpyBelief, 'exact': ExactBelief, 'sparse': SparseBelief,
+           'incremental': IncrementalBelief}
+
+
+if __name__ == '__main__':
+    import unittest
+
+    from lib.engine import play
+    from lib.player_base import configure
+    from players.ai_player import AIPlayer
+    from players.random_player import RandomPlayer
+
+    # 固定したシードで対戦させ，結果とAIPlayerのすべての行動を返す．
+    def play_games(belief):
+        class LoggingPlayer(AIPlayer):
+            def decide(self):
+                act = super().decide()
+                log.append(act)
+                return act
+
+        log = []
+        results = []
+        for seed in range(20):
+            results.append(play(LoggingPlayer(seed, belief=belief), RandomPlayer(seed + 100)))
+            results.append(play(LoggingPlayer(seed, belief=belief),
+                                LoggingPlayer(seed + 100, belief=belief), max_turns=200))
+        return results, log
+
+    class ListBeliefTest(unittest.TestCase):
+
+        # 3つの予測を連結せずに足し合わせることを確かめる．
+        def test_target(self):
+            b = ListBelief()
+            b.maps['w'][0][0] = 0.5
+            b.maps['c'][1][1] = 0.4
+            b.maps['s'][1][1] = 0.4
+            self.assertEqual(6, b.target((1 << 25) - 1))
+            self.assertEqual(0, b.target(1 | 1 << 2))
+            self.assertEqual(None, b.target(0))
+
+        def test_attacked(self):
+            b = ListBelief()
+            b.enemy_attacked([0, 0], ['w', 'c', 's'])
+            self.assertEqual(0.25, b.maps['w'][1][1])
+            b.attacked([1, 1], 'w', ['c'])
+            self.assertEqual(1, b.maps['w'][1][1])
+            self.assertEqual(0, b.maps['c'][1][1])
+            self.assertEqual(0, sum(sum(row) for row in b.maps['s']))
+
+        def test_moved(self):
+            b = ListBelief()
+            b.maps['w'][0][0] = 1
+            b.moved('w', 2, 1)
+            self.assertEqual(1, b.maps['w'][2][1])
+            b.moved('w', 3, 0)
+            self.assertEqual(0, sum(sum(row) for row in b.maps['w']))
+
+    class SparseBeliefTest(unittest.TestCase):
+
+        # ListBeliefと同じ攻撃先を選ぶことを，固定したシードの対戦で確かめる．
+        def test_same_decisions(self):
+            self.assertEqual(play_games('list'), play_games('sparse'))
+
+        def test_update(self):
+            b = SparseBelief()
+            b.enemy_attacked([0, 0], ['w', 'c', 's'])
+            self.assertEqual({0: 0.25, 1: 0.25, 5: 0.25, 6: 0.25}, b.maps['w'])
+            b.attacked([1, 1], 'w', ['c'])
+            self.assertEqual({6: 1}, b.maps['w'])
+            self.assertEqual(0, b.prediction('c')[1][1])
+            self.assertEqual({}, b.maps['s'])
+            b.moved('w', 3, 0)
+            self.assertEqual({21: 1}, b.maps['w'])
+            b.moved('w', 1, 0)
+            self.assertEqual({}, b.maps['w'])
+
+        def test_large_field(self):
+            # 大きい盤面でも，値を持つマスは攻撃の周囲(9マスと8マス)だけである．
+            configure(200, {'w': 3, 'c': 2, 's': 1, 'x': 2})
+            try:
+                b = SparseBelief()
+                b.enemy_attacked([100, 100], ['w', 'x'])
+                b.attacked([150, 150], 'x', ['w'])
+                self.assertEqual({150 * 200 + 150: 1}, b.maps['x'])
+                self.assertEqual(17, len(b.maps['w']))
+                self.assertEqual(99 * 200 + 99, b.target(ATTACK_MASKS[100 * 200 + 100]))
+                self.assertEqual(150 * 200 + 150, b.target(ATTACK_MASKS[150 * 200 + 150]))
+                winner, turns = play(AIPlayer(0, belief='sparse'), RandomPlayer(1), max_turns=200)
+                self.assertEqual(200, turns)
+            finally:
+                configure()
+
+    class IncrementalBeliefTest(unittest.TestCase):
+
+        # ListBeliefと同じ攻撃先を選ぶことを，固定したシードの対戦で確かめる．
+        def test_same_decisions(self):
+            self.assertEqual(play_games('list'), play_games('incremental'))
+
+        def test_update(self):
+            b = IncrementalBelief()
+            b.enemy_attacked([0, 0], ['w', 'c', 's'])
+            self.assertEqual(0.25, b.maps['w'].value(6))
+            self.assertEqual(1, b.maps['w'].total)
+            b.attacked([1, 1], 'w', ['c'])
+            self.assertTrue(b.maps['w'].certain)
+            self.assertEqual(1, b.prediction('w')[1][1])
+            self.assertEqual(0, b.prediction('c')[1][1])
+            self.assertEqual({}, b.maps['s'].values)
+            # 2で割る処理は割る数を変えるだけで，マスの値は読む時に割る．
+            b.enemy_attacked([4, 4], ['w'])
+            self.assertEqual(2, b.maps['w'].divisor)
+            self.assertEqual({6: 1, 18: 0.25, 19: 0.25, 23: 0.25, 24: 0.25}, b.maps['w'].values)
+            self.assertEqual(0.125, b.maps['w'].value(24))
+            self.assertFalse(b.maps['w'].certain)
+            b.moved('w', -1, 0)
+            self.assertEqual({1: 0.5, 13: 0.125, 14: 0.125, 18: 0.125, 19: 0.125}, b.maps['w'].values)
+            self.assertEqual(1, b.target((1 << 25) - 1))
+            self.assertEqual(13, b.target(1 << 13 | 1 << 14))
+            self.assertEqual(2, b.target(1 << 2 | 1 << 3))
+            self.assertEqual(None, b.target(0))
+
+        def test_best(self):
+            pred = RunningMap()
+            for cell, p in ((3, 0.25), (1, 0.25), (7, 0.5)):
+                pred.add(cell, p)
+            self.assertEqual(7, pred.get_best())
+            pred.remove(7)
+            self.assertIsNone(pred.best)
+            self.assertEqual(1, pred.get_best())
+            pred.add(3, 0.1)
+            self.assertEqual(3, pred.best)
+            # 正規化しても値の大小は変わらない．残りが1マスなら値は1になる．
+            pred.normalize()
+            self.assertAlmostEqual(0.35 / 0.6, pred.value(3))
+            pred.remove(1)
+            pred.normalize()
+            self.assertEqual((True, 1), (pred.certain, pred.value(3)))
+
+        def test_large_field(self):
+            # 大きい盤面でも，値を持つマスは攻撃の周囲だけで，攻撃先もそのマスから選ぶ．
+            configure(200, {'w': 3, 'c': 2, 's': 1, 'x': 2})
+            try:
+                b = IncrementalBelief()
+                b.enemy_attacked([100, 100], ['w', 'x'])
+                b.attacked([150, 150], 'x', ['w'])
+                self.assertEqual({150 * 200 + 150: 1}, b.maps['x'].values)
+                self.assertEqual(17, len(b.maps['w'].values))
+                self.assertEqual(99 * 200 + 99, b.target(ATTACK_MASKS[100 * 200 + 100]))
+                self.assertEqual(150 * 200 + 150, b.target(ATTACK_MASKS[150 * 200 + 150]))
+                self.assertEqual(0, b.target(1 | 1 << 40000 - 1))
+                winner, turns = play(AIPlayer(0, belief='incremental'), RandomPlayer(1), max_turns=200)
+                self.assertEqual(200, turns)
+            finally:
+                configure()
+
+    # ListBeliefと同じ攻撃先を選ぶことを，固定したシードの対戦で確かめる．
+    @unittest.skipIf(np is None, 'numpy is not installed')
+    class NumpyBeliefTest(unittest.TestCase):
+
+        def test_same_decisions(self):
+            self.assertEqual(play_games('list'), play_games('numpy'))
+
+        def test_moved(self):
+            b = NumpyBelief()
+            b.pred[0, 0, 0] = 1
+            b.moved('w', 2, 1)
+            self.assertEqual(1, b.pred[0, 2, 1])
+            b.moved('w', -2, 3)
+            self.assertEqual(1, b.pred[0, 0, 4])
+            b.moved('w', 0, 1)
+            self.assertEqual(0, b.pred[0].sum())
+
+        # 艦種が4つの艦隊でも，ListBeliefと同じ攻撃先を選ぶ．
+        def test_rules(self):
+            configure(7, {'w': 3, 'c': 2, 's': 1, 'x': 2})
+            try:
+                b = NumpyBelief()
+                b.enemy_attacked([3, 3], ['w', 'x'])
+                b.attacked([2, 2], 'x', ['w'])
+                self.assertEqual(1, b.pred[3, 2, 2])
+                self.assertEqual(1, b.pred[3].sum())
+                self.assertEqual(2 * 7 + 2, b.target((1 << 49) - 1))
+                self.assertEqual(play_games('list'), play_games('numpy'))
+            finally:
+                configure()
+
+        # 64マスを超える盤面でも攻撃先を選べる．
+        def test_large_field(self):
+            configure(10)
+            try:
+                b = NumpyBelief()
+                self.assertEqual(70, b.target(1 << 99 | 1 << 70))
+                b.enemy_attacked([9, 9], ['w'])
+                self.assertEqual(99, b.target(1 << 99 | 1 << 70))
+                winner, turns = play(AIPlayer(0, belief='numpy'), RandomPlayer(1), max_turns=200)
+                self.assertTrue(turns <= 200)
+            finally:
+                configure()
+
+        # 名前が他の艦種の名前を含んでいても，その艦種だけを選ぶ．
+        def test_select(self):
+            configure(5, {'w1': 1, 'w12': 2})
+            try:
+                b = NumpyBelief()
+                self.assertEqual([False, True], b.select(['w12']).tolist())
+                self.assertEqual([True, False], b.select(['w1']).tolist())
+                self.assertEqual([False, False], b.select([]).tolist())
+            finally:
+                configure()
+
+    unittest.main()
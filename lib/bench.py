@@ -0,0 +1,365 @@
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+
+sys.path.append(os.getcwd())
+
+from lib.belief import ListBelief
+from lib.engine import play
+from lib.player_base import Player, PlayerShip, configure
+from players.ai_player import AIPlayer
+from players.random_player import RandomPlayer
+
+
+#
+# プレイヤーの処理の速さを測るベンチマークである．
+# 個々のメソッド(1回あたりのマイクロ秒)と，対戦全体(1秒あたりのゲーム数)を測り，結果をJSONで保存する．
+# 保存した結果を基準として比較し，一定以上遅くなったものを回帰として報告する．
+#
+
+# 登録されたベンチマークである．名前から(関数，単位，大きいほど良いか)を引く．
+BENCHMARKS = {}
+
+# 回帰とみなす変化の割合の既定値である．
+THRESHOLD = 0.1
+
+
+#
+# ベンチマークを登録するデコレータである．関数はquickを受け取り，測った値を返す．
+# quickが真の場合は，繰り返しの回数を減らして短時間で終える．
+#
+def benchmark(name, unit='us', higher_is_better=False):
+    def register(function):
+        BENCHMARKS[name] = (function, unit, higher_is_better)
+        return function
+    return register
+
+
+# functionを1回呼ぶ時間をマイクロ秒で返す．他の処理の影響を受けにくいように，繰り返した中で最も短い時間を使う．
+def per_call(function, quick, number=2000):
+    if quick:
+        number //= 10
+    return min(timeit.repeat(function, number=number, repeat=3 if quick else 7)) / number * 1e6
+
+
+# 自分の艦の初期配置である．通知の自分の状態はいつもこの配置にする．
+POSITIONS = {'w': [0, 0], 'c': [2, 2], 's': [4, 4]}
+
+
+# source/server.rbが送るのと同じ形の通知のJSONを作る．
+def message(result=None):
+    data = {"condition": {
+        "me": {ship_type: {"hp": PlayerShip.MAX_HPS[ship_type], "position": position}
+               for ship_type, position in POSITIONS.items()},
+        "enemy": {ship_type: {"hp": hp} for ship_type, hp in PlayerShip.MAX_HPS.items()}}}
+    if result is not None:
+        data["result"] = result
+    return json.dumps(data, separators=(',', ':'))
+
+
+# AIPlayer.updateに渡す通知である．(通知, 自分の行動の結果かどうか)の組．
+PAYLOADS = {
+    'hit': (message({"attacked": {"position": [1, 1], "hit": "w", "near": ["c"]}}), True),
+    'near': (message({"attacked": {"position": [1, 1], "near": ["c", "s"]}}), True),
+    'miss': (message({"attacked": {"position": [1, 1], "near": []}}), True),
+    'moved': (message({"moved": {"ship": "c", "distance": [0, 2]}}), False),
+}
+
+
+# 予測の状態が初期状態だけにならないように，いくつか通知を与えたAIPlayerを作る．
+def warm_ai():
+    ai = AIPlayer(0)
+    ai.ships = Player(POSITIONS).ships
+    for payload, is_my_turn in PAYLOADS.values():
+        ai.update(payload, is_my_turn)
+    ai.attacked_ship = None
+    return ai
+
+
+@benchmark('player.update')
+def bench_player_update(quick):
+    p = Player(POSITIONS)
+    payload = PAYLOADS['miss'][0]
+    return per_call(lambda: p.update(payload), quick)
+
+
+@benchmark('player.can_attack')
+def bench_can_attack(quick):
+    p = Player(POSITIONS)
+    return per_call(lambda: (p.can_attack([1, 1]), p.can_attack([4, 0])), quick, 20000) / 2
+
+
+@benchmark('player.overlap')
+def bench_overlap(quick):
+    p = Player(POSITIONS)
+    return per_call(lambda: (p.overlap([2, 2]), p.overlap([4, 0])), quick, 20000) / 2
+
+
+# 艦が隅に集まっている場合に，規則に合う行動から一様に1つ選ぶ時間である．
+@benchmark('player.random_action')
+def bench_random_action(quick):
+    p = Player({'w': [0, 0], 'c': [0, 1], 's': [1, 0]})
+    random = RandomPlayer(0).random.random
+    return per_call(lambda: p.random_action(random), quick, 20000)
+
+
+# 艦の移動で行動の集合を更新する時間である．2つのマスを往復させるので，1回あたりの時間にする．
+@benchmark('player.move')
+def bench_move(quick):
+    p = Player(POSITIONS)
+    return per_call(lambda: (p.move('c', [2, 3]), p.move('c', [2, 2])), quick) / 2
+
+
+# 探索で1手を試して戻す時間である．移動と命中した攻撃をそれぞれ行ってから戻す．
+@benchmark('player.make_unmake')
+def bench_make_unmake(quick):
+    p = Player(POSITIONS)
+
+    def run():
+        old = p.make_move('c', 13)
+        i = p.make_attacked(0)
+        p.unmake_attacked(0, i)
+        p.unmake_move('c', old)
+    return per_call(run, quick)
+
+
+# 艦を1隻失った状態から，保存した状態に戻す時間である．
+@benchmark('player.snapshot_restore')
+def bench_snapshot_restore(quick):
+    p = Player(POSITIONS)
+    state = p.snapshot()
+
+    def run():
+        p.make_attacked(24)
+        p.restore(state)
+    return per_call(run, quick)
+
+
+def bench_ai_update(kind):
+    def run(quick):
+        ai = warm_ai()
+        payload, is_my_turn = PAYLOADS[kind]
+        return per_call(lambda: ai.update(payload, is_my_turn), quick)
+    return run
+
+
+for kind in PAYLOADS:
+    benchmark('ai.update.' + kind)(bench_ai_update(kind))
+
+
+@benchmark('ai.action')
+def bench_ai_action(quick):
+    ai = warm_ai()
+    return per_call(ai.action, quick)
+
+
+@benchmark('belief.move_predictions')
+def bench_move_predictions(quick):
+    belief = ListBelief()
+    pred = [[(i * 5 + j) / 300 for j in range(5)] for i in range(5)]
+    return per_call(lambda: belief.move_predictions(pred, 1, -2), quick)
+
+
+@benchmark('belief.normalize')
+def bench_normalize(quick):
+    belief = ListBelief()
+    pred = [[(i * 5 + j) / 300 for j in range(5)] for i in range(5)]
+    return per_call(lambda: belief.normalize(pred), quick)
+
+
+# SearchPlayerの1秒あたりの模擬の回数である．初期状態から，回数を固定して探索する．
+@benchmark('search.playouts', unit='playouts/s', higher_is_better=True)
+def bench_search_playouts(quick):
+    from players.search_player import SearchPlayer
+
+    player = SearchPlayer(0, budget=None, max_playouts=500 if quick else 5000)
+    player.search()
+    return player.last_stats["playouts_per_s"]
+
+
+# AIPlayerとRandomPlayerを先攻後攻を入れ替えながら対戦させ，1秒あたりのゲーム数を返す．
+@benchmark('games.inprocess', unit='games/s', higher_is_better=True)
+def bench_games_inprocess(quick):
+    games = 20 if quick else 200
+    start = time.perf_counter()
+    for seed in range(games):
+        if seed % 2:
+            play(RandomPlayer(seed), AIPlayer(seed))
+        else:
+            play(AIPlayer(seed), RandomPlayer(seed))
+    return games / (time.perf_counter() - start)
+
+
+# source/server.pyのLobbyとlib/async_client.pyのクライアントでループバックのソケットを介して対戦させる．
+@benchmark('games.socket', unit='games/s', higher_is_better=True)
+def bench_games_socket(quick):
+    from lib.async_client import run_sessions
+    from source.server import Lobby
+
+    games = 10 if quick else 100
+
+    def factory(seed):
+        return AIPlayer(seed) if seed % 2 else RandomPlayer(seed)
+
+    async def run():
+        lobby = Lobby(max_matches=games)
+        server = await asyncio.start_server(lobby.accept, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            start = time.perf_counter()
+            await run_sessions('127.0.0.1', port, factory, range(games * 2), games * 2)
+            await lobby.finished.wait()
+            return games / (time.perf_counter() - start)
+
+    return asyncio.run(run())
+
+
+#
+# 盤面の大きさを変えて，AIPlayerとRandomPlayerの対戦の1ターンあたりの時間を測る．
+# ListBeliefは盤面の広さに比例して遅くなるので，100までにする．終わったら既定の規則に戻す．
+#
+SCALING_SIZES = {'list': [5, 25, 100], 'sparse': [5, 25, 100, 200], 'incremental': [5, 25, 100, 200]}
+
+
+def bench_turn(belief, size):
+    def run(quick):
+        configure(size)
+        try:
+            elapsed = 0
+            turns = 0
+            for seed in range(1 if quick else 3):
+                start = time.perf_counter()
+                turns += play(AIPlayer(seed, belief=belief), RandomPlayer(seed), max_turns=40 if quick else 200)[1]
+                elapsed += time.perf_counter() - start
+            return elapsed / turns * 1e6
+        finally:
+            configure()
+    return run
+
+
+for belief, sizes in SCALING_SIZES.items():
+    for size in sizes:
+        benchmark('turn.%s.%d' % (belief, size))(bench_turn(belief, size))
+
+
+#
+# 名前にpatternを含むベンチマークを実行し，結果を連想配列で返す．
+# progressが真の場合は，1つ終わるごとに表示する．
+#
+def run(pattern='', quick=False, progress=False):
+    results = {}
+    for name, (function, unit, higher_is_better) in BENCHMARKS.items():
+        if pattern not in name:
+            continue
+        value = function(quick)
+        results[name] = {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+        if progress:
+            print(f"{name:28s} {value:12.2f} {unit}")
+    return results
+
+
+# 結果に実行環境の情報を加えて保存する．
+def save(results, path):
+    data = {
+        "meta": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "time": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        "results": results,
+    }
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)["results"]
+
+
+#
+# 基準の結果と比べて，悪くなった割合がthresholdを超えたものを(名前，基準，今回，割合)のリストで返す．
+# 割合は，時間なら増えた割合，ゲーム数なら減った割合である．基準にない名前は比べない．
+#
+def compare(results, baseline, threshold=THRESHOLD):
+    regressions = []
+    for name, entry in results.items():
+        if name not in baseline:
+            continue
+        old = baseline[name]["value"]
+        new = entry["value"]
+        change = (new - old) / old
+        if entry["higher_is_better"]:
+            change = -change
+        if change > threshold:
+            regressions.append((name, old, new, change))
+    return regressions
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'test':
+        import tempfile
+        import unittest
+
+        class BenchTest(unittest.TestCase):
+
+            def test_compare(self):
+                baseline = {"a": {"value": 10.0, "unit": "us", "higher_is_better": False},
+                            "b": {"value": 100.0, "unit": "games/s", "higher_is_better": True}}
+                results = {"a": {"value": 10.5, "unit": "us", "higher_is_better": False},
+                           "b": {"value": 80.0, "unit": "games/s", "higher_is_better": True},
+                           "c": {"value": 1.0, "unit": "us", "higher_is_better": False}}
+                self.assertEqual([("b", 100.0, 80.0, 0.2)], compare(results, baseline))
+                self.assertEqual(["a", "b"], [r[0] for r in compare(results, baseline, 0.01)])
+
+            def test_run(self):
+                results = run('player.', quick=True)
+                self.assertEqual(['player.update', 'player.can_attack', 'player.overlap', 'player.random_action',
+                                  'player.move', 'player.make_unmake', 'player.snapshot_restore'], list(results))
+                with tempfile.TemporaryDirectory() as path:
+                    save(results, os.path.join(path, 'bench.json'))
+                    self.assertEqual(results, load(os.path.join(path, 'bench.json')))
+
+            def test_turn(self):
+                results = run('turn.sparse.25', quick=True)
+                self.assertEqual(['turn.sparse.25'], list(results))
+                self.assertEqual(5, Player.FIELD_SIZE)
+
+            def test_payloads(self):
+                # 通知の種類ごとに，AIPlayerが想定どおりの処理を行うことを確かめる．
+                ai = warm_ai()
+                ai.update(*PAYLOADS['hit'])
+                self.assertEqual(1, ai.pred_w[1][1])
+                ai.update(*PAYLOADS['miss'])
+                self.assertEqual(0, ai.pred_c[1][1])
+                self.assertEqual(None, ai.attacked_ship)
+                self.assertIn('attack', json.loads(ai.action()))
+
+        unittest.main(argv=sys.argv[:1])
+    else:
+        import argparse
+
+        parser = argparse.ArgumentParser(description="Benchmarks for players")
+        parser.add_argument("--filter", type=str, default="", help="Run benchmarks whose name contains this")
+        parser.add_argument("--quick", action="store_true", help="Fewer repetitions")
+        parser.add_argument("--output", type=str, default=None, help="Save results to this JSON file")
+        parser.add_argument("--compare", type=str, default=None, help="Baseline JSON file to compare with")
+        parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                            help="Relative slowdown reported as a regression")
+        args = parser.parse_args()
+
+        results = run(args.filter, quick=args.quick, progress=True)
+        if args.output:
+            save(results, args.output)
+        if args.compare:
+            regressions = compare(results, load(args.compare), args.threshold)
+            for name, old, new, change in regressions:
+                print(f"REGRESSION {name}: {old:.2f} -> {new:.2f} ({change * 100:+.1f}%)")
+            if regressions:
+                sys.exit(1)
+            print("no regressions")
@@ -0,0 +1,128 @@
+import os
+import select
+import socket
+import sys
+
+sys.path.append(os.getcwd())
+
+from lib.codec import initial_line, negotiate
+from lib.deadline import Deadline
+from lib.instrument import NULL
+from lib.speculate import NULL as NO_SPECULATION
+
+
+#
+# クライアントのmainが共有する，仕様に従ってサーバとソケット通信を行うループである．
+# プレイヤーごとに違うのは作り方だけなので，各プレイヤーのmainはプレイヤーを作る関数make_playerを渡してrunを呼ぶ．
+#
+
+#
+# ソケットから1行ずつ読むクラスである．readlineはファイルのreadlineと同じく，改行を含む文字列を返し，接続が切れたら残りを返す．
+# readyは次の行をすぐに読めるかを返す．読み込んだ行はこのクラスが持つので，ソケットのselectだけでは分からない．
+# lib/speculate.pyは通知を待つ間にreadyを調べ，届いていたら先読みをやめる．
+#
+class LineReader:
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = bytearray()
+
+    def readline(self):
+        while True:
+            i = self.buffer.find(b'\n')
+            if i >= 0:
+                line = self.buffer[:i + 1]
+                del self.buffer[:i + 1]
+                return line.decode()
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                line = bytes(self.buffer)
+                self.buffer.clear()
+                return line.decode()
+            self.buffer += chunk
+
+    def ready(self):
+        return b'\n' in self.buffer or bool(select.select([self.sock], [], [], 0)[0])
+
+
+#
+# host:portのサーバと1ゲーム対戦し，最後のプレイヤーを返す．make_playerは引数なしでプレイヤーを返す関数である．
+# verboseが0なら何も表示せず，1ならサーバからのメッセージ，2ならプレイヤーの予測(display_predictionsがあれば)も表示する．
+# instrumentsを与えると，ターンの各段階の時間を測る(lib/instrument.py)．
+# deadlineは1手の時間の上限(lib/deadline.py)で，与えなければ既定の上限を使う．
+# speculatorを与えると，相手のターンの間に次の行動を先読みする(lib/speculate.py)．
+#
+def run(host, port, make_player, verbose=1, instruments=NULL, deadline=None, speculator=NO_SPECULATION):
+    assert isinstance(host, str) and isinstance(port, int)
+    if deadline is None:
+        deadline = Deadline()
+
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.connect((host, port))
+        reader = LineReader(sock)
+        get_msg = reader.readline()
+        if verbose:
+            print(get_msg)
+        # サーバが簡潔な形式を提示していれば，それを使う．
+        codec = negotiate(get_msg)
+        player = make_player()
+        sock.sendall((initial_line(player, codec)+'\n').encode())
+        display = getattr(player, 'display_predictions', None) if verbose >= 2 else None
+
+        # 先読みで決めておいた行動と，自分の前のターンの通知である．
+        pending = last = None
+        while True:
+            instruments.start_turn()
+            info = reader.readline().rstrip()
+            instruments.lap('read')
+            if verbose:
+                print(info)
+                instruments.lap('render')
+            if info == "your turn":
+                if pending is not None:
+                    act = pending
+                    pending = None
+                else:
+                    act = player.decide_within(deadline)
+                instruments.lap('action')
+                line = codec.encode_action(act)
+                instruments.lap('encode')
+                sock.sendall((line+'\n').encode())
+                instruments.lap('write')
+                get_msg = reader.readline()
+                instruments.lap('read')
+                message = codec.decode(get_msg)
+                instruments.lap('decode')
+                player.update(message, is_my_turn=True)
+                last = message
+                instruments.lap('update')
+            elif info == "waiting":
+                # 通知を読む前に先読みし，通知が届いたらやめる．先読みの時間は待つ時間と同じくreadに記録する．
+                speculator.start(player, last, reader.ready)
+                get_msg = reader.readline()
+                instruments.lap('read')
+                message = codec.decode(get_msg)
+                instruments.lap('decode')
+                ready = speculator.take(message)
+                if ready is None:
+                    player.update(message, is_my_turn=False)
+                else:
+                    player, pending = ready
+                instruments.lap('update')
+            elif info == "you win":
+                break
+            elif info == "you lose":
+                break
+            elif info == "even":
+                break
+            else:
+                raise RuntimeError("unknown information")
+            # 予測の表示は時間がかかるので，更新の後に行い，計測ではrenderに記録する．
+            if display is not None and message.attacked:
+                player.display_predictions()
+                instruments.lap('render')
+            instruments.end_turn()
+        instruments.end_turn()
+    deadline.finish(verbose)
+    speculator.finish()
+    return player
@@ -0,0 +1,531 @@
+import itertools
+import json
+import operator
+import os
+import sys
+
+sys.path.append(os.getcwd())
+
+
+#
+# サーバとクライアントがやり取りする1行のメッセージの符号化と復号を行うモジュールである．
+# サーバからの通知は1回だけ解析してMessageにし，プレイヤーはその属性を読むだけにする．
+# 行動の文字列や，compactの相手のHPと結果の欄は，取りうる値が少ないので，すべて事前に作っておく．
+#
+# 既定はsource/server.rbと同じJSONである．source/server.pyは挨拶の行で簡潔な形式(compact)を提示し，
+# クライアントが初期状態のJSONに"codec"を加えて応じた場合だけ，その接続ではcompactを使う．
+# server.rbは提示しないので，クライアントはJSONのまま通信する．
+#
+# compactの通知は"自分;相手;結果;勝敗"の4つの欄からなる．
+#   自分: 艦ごとに種類，HP，x，yの4文字．例えば"w300c214"．
+#   相手: 艦ごとに種類，HPの2文字．例えば"w3c2s1"．
+#   結果: 攻撃なら"a"，x，y，命中した艦(なければ"-")，周囲1マスにいた艦．例えば"a12wcs"．
+#         移動なら"m"，艦，"dx,dy"．例えば"mw0,-3"．結果がない場合や不正な行動の場合は空である．
+#   勝敗: 勝ちなら"1"，負けなら"0"，決着していなければ空である．
+# compactの行動は，攻撃なら"a12"，移動なら"mw34"である．座標を1文字で表し，艦種はw, c, s，HPは1から3に限るので，
+# 既定の規則(lib/player_base.pyのdefault_rules)の場合だけ提示し，応じる．
+#
+
+# compactで座標を表せる最大の大きさである．
+MAX_DIGIT = 10
+
+# compactで表せる艦種である．
+SHIP_TYPES = ['w', 'c', 's']
+
+# compactの自分の状態の解析結果を保持する表の大きさの上限である．超えたら空にする．
+CACHE_SIZE = 1 << 16
+
+# サーバが挨拶の行の末尾に加える，compactを使えることを表す文字列である．
+OFFER = " codec: compact"
+
+
+#
+# サーバからの通知を1回だけ解析した結果である．
+# meは艦種ごとの(HP, 座標)，enemyは相手の艦種ごとのHPである．
+# movedは相手の移動(艦種, dx, dy)，attackedは攻撃の結果(座標, 命中した艦種またはNone, 周囲1マスの艦種のリスト)で，
+# なければNoneである．outcomeは勝ちならTrue，負けならFalse，決着していなければNoneである．
+# compactでは同じ欄の復号結果どうしで連想配列とリストを共有するので，受け取った側は書き換えてはいけない
+# (lib/player_base.pyのPOSITIONSの座標と同じ)．作るのが速いように，タプルに名前で読める属性を付けたものにしている．
+#
+class Message(tuple):
+    __slots__ = ()
+    FIELDS = ('me', 'enemy', 'moved', 'attacked', 'outcome')
+
+    def __new__(cls, me, enemy, moved=None, attacked=None, outcome=None):
+        return tuple.__new__(cls, (me, enemy, moved, attacked, outcome))
+
+    me = property(operator.itemgetter(0))
+    enemy = property(operator.itemgetter(1))
+    moved = property(operator.itemgetter(2))
+    attacked = property(operator.itemgetter(3))
+    outcome = property(operator.itemgetter(4))
+
+    def __repr__(self):
+        return "Message(%s)" % ", ".join(
+            "%s=%r" % (name, value) for name, value in zip(Message.FIELDS, self))
+
+
+# compactの復号では，Pythonで書いたMessage.__new__を通さずにこれでMessageを作る．
+NEW = tuple.__new__
+
+
+# lib/engine.pyやJSONから得た連想配列をMessageにする．不正な行動の結果(False)は結果なしとして扱う．
+def from_dict(data):
+    cond = data['condition']
+    me = {}
+    for ship_type, ship in cond['me'].items():
+        me[ship_type] = (ship['hp'], ship['position'])
+    enemy = {}
+    for ship_type, ship in cond.get('enemy', {}).items():
+        enemy[ship_type] = ship['hp']
+    moved = attacked = None
+    if 'result' in data:
+        result = data['result']
+        if 'moved' in result:
+            move = result['moved']
+            if move:
+                moved = (move['ship'], move['distance'][0], move['distance'][1])
+        elif 'attacked' in result:
+            attack = result['attacked']
+            if attack:
+                attacked = (attack['position'], attack.get('hit'), attack.get('near', []))
+    return Message(me, enemy, moved, attacked, data.get('outcome'))
+
+
+# 通知を復号する．JSONの文字列，compactの文字列，連想配列，Messageのどれでもよい．
+def decode(message):
+    if isinstance(message, Message):
+        return message
+    if isinstance(message, dict):
+        return from_dict(message)
+    if message.startswith('{'):
+        return JSON.decode(message)
+    return COMPACT.decode(message)
+
+
+# 行動の連想配列から，艦種(攻撃ならNone)と座標を取り出す．
+def action_key(act):
+    if "attack" in act:
+        x, y = act["attack"]["to"]
+        return None, x, y
+    x, y = act["move"]["to"]
+    return act["move"]["ship"], x, y
+
+
+# 通信の形式の基底クラスである．サブクラスでformat_actionなどを実装する．
+class Codec:
+    name = None
+
+    def __init__(self):
+        # 行動の文字列を，艦種(攻撃はNone)ごとにx, yの順に引く2次元のリストとして事前に作っておく．
+        self.actions = {ship_type: [[self.format_action(ship_type, x, y) for y in range(MAX_DIGIT)]
+                                    for x in range(MAX_DIGIT)]
+                        for ship_type in [None] + SHIP_TYPES}
+        self.attacks = self.actions[None]
+
+    # 行動の連想配列を1行の文字列にする．表にない座標や艦種の場合だけ文字列を作る．
+    def encode_action(self, act):
+        attack = act.get("attack")
+        if attack is not None:
+            x, y = attack["to"]
+            if x >= 0 and y >= 0:
+                try:
+                    return self.attacks[x][y]
+                except IndexError:
+                    pass
+        else:
+            move = act["move"]
+            x, y = move["to"]
+            if x >= 0 and y >= 0:
+                try:
+                    return self.actions[move["ship"]][x][y]
+                except (IndexError, KeyError):
+                    pass
+        return self.format_action(*action_key(act))
+
+
+class JsonCodec(Codec):
+    name = 'json'
+
+    # Player.moveやPlayer.attackの連想配列をjson.dumpsした場合と同じ文字列にする．
+    def format_action(self, ship_type, x, y):
+        if ship_type is None:
+            return json.dumps({"attack": {"to": [x, y]}})
+        return json.dumps({"move": {"ship": ship_type, "to": [x, y]}})
+
+    # 通知には盤面全体の状態が入っていて同じ行はほとんど届かないので，行ごとには保持しない．
+    def decode(self, line):
+        return from_dict(json.loads(line))
+
+    # サーバ側．server.rbのto_jsonと同じく空白を入れない．
+    def encode(self, info):
+        return json.dumps(info, separators=(',', ':'))
+
+    def decode_action(self, line):
+        return json.loads(line)
+
+
+class CompactCodec(Codec):
+    name = 'compact'
+
+    def __init__(self):
+        super().__init__()
+        # 自分の艦1隻分の4文字から(HP, 座標)を引く表である．座標のリストは同じ座標どうしで共有する．
+        positions = {(x, y): [x, y] for x in range(MAX_DIGIT) for y in range(MAX_DIGIT)}
+        self.ships = {"%s%d%d%d" % (ship_type, hp, x, y): (hp, positions[x, y])
+                      for ship_type in SHIP_TYPES for hp in range(1, 4)
+                      for x in range(MAX_DIGIT) for y in range(MAX_DIGIT)}
+        #
+        # 相手のHPと結果の欄は取りうる値が少ないので，行動の文字列と同じくすべて事前に解析しておく．
+        # 周囲の艦はサーバの艦の順に並ぶので，SHIP_TYPESの順の場合だけ登録し，それ以外は届くたびに解析する．
+        #
+        subsets = [''.join(c) for r in range(len(SHIP_TYPES) + 1) for c in itertools.combinations(SHIP_TYPES, r)]
+        self.enemies = {field: self.parse_enemy(field) for field in
+                        [''.join(c) for c in itertools.product(*[[''] + ["%s%d" % (ship_type, hp) for hp in range(1, 4)]
+                                                                 for ship_type in SHIP_TYPES])]}
+        fields = ["a%d%d%s%s" % (x, y, hit, near) for x in range(MAX_DIGIT) for y in range(MAX_DIGIT)
+                  for hit in ['-'] + SHIP_TYPES for near in subsets]
+        fields += ["m%s%d,%d" % (ship_type, dx, dy) for ship_type in SHIP_TYPES
+                   for d in range(1 - MAX_DIGIT, MAX_DIGIT) for dx, dy in [(d, 0), (0, d)]]
+        self.results = {field: self.parse_result(field) for field in [''] + fields}
+        # 自分の状態は数ターン同じことが多いので，届いた欄ごとに解析結果を保持する．
+        self.mes = {}
+        #
+        # サーバ側で使う表である．ship_fieldsは自分の艦1隻分の4文字を艦種，HP，x，yの順に，
+        # enemy_fieldsは相手の艦1隻分の2文字を艦種，HPの順に引く．keysは行動の文字列(改行付きも)から(艦種, x, y)を引く．
+        #
+        self.ship_fields = {ship_type: [[["%s%d%d%d" % (ship_type, hp, x, y) for y in range(MAX_DIGIT)]
+                                         for x in range(MAX_DIGIT)] for hp in range(4)]
+                            for ship_type in SHIP_TYPES}
+        self.enemy_fields = {ship_type: ["%s%d" % (ship_type, hp) for hp in range(4)] for ship_type in SHIP_TYPES}
+        self.keys = {}
+        for ship_type, table in self.actions.items():
+            for x, row in enumerate(table):
+                for y, line in enumerate(row):
+                    self.keys[line] = self.keys[line + '\n'] = (ship_type, x, y)
+
+    def format_action(self, ship_type, x, y):
+        if ship_type is None:
+            return "a%d%d" % (x, y)
+        return "m%s%d%d" % (ship_type, x, y)
+
+    def parse_me(self, field):
+        ships = self.ships
+        return {field[i]: ships[field[i:i + 4]] for i in range(0, len(field), 4)}
+
+    def parse_enemy(self, field):
+        return {field[i]: int(field[i + 1]) for i in range(0, len(field), 2)}
+
+    # 結果の欄を(moved, attacked)にする．
+    def parse_result(self, field):
+        if not field:
+            return None, None
+        if field[0] == 'm':
+            dx, dy = field[2:].split(',')
+            return (field[1], int(dx), int(dy)), None
+        hit = None if field[3] == '-' else field[3]
+        return None, ([int(field[1]), int(field[2])], hit, list(field[4:]))
+
+    #
+    # 表を引くだけで済む場合はメソッドを呼ばない．
+    # 自分の状態は表にないことが多く，ほとんどは3隻なので，その場合はparse_meと同じことをここで行う．
+    #
+    def decode(self, line):
+        try:
+            me, enemy, result, outcome = line.split(';')
+            mes = self.mes
+            state = mes.get(me)
+            if state is None:
+                if len(mes) >= CACHE_SIZE:
+                    mes.clear()
+                if len(me) == 12:
+                    ships = self.ships
+                    state = mes[me] = {me[0]: ships[me[:4]], me[4]: ships[me[4:8]], me[8]: ships[me[8:]]}
+                else:
+                    state = mes[me] = self.parse_me(me)
+            moved, attacked = self.results.get(result) or self.parse_result(result)
+            return NEW(Message, (state, self.enemies.get(enemy) or self.parse_enemy(enemy),
+                                 moved, attacked, OUTCOMES[outcome]))
+        except (KeyError, IndexError, ValueError):
+            raise ValueError('invalid compact message: %r' % line)
+
+    # サーバ側．lib/engine.pyのServer.actionが返す連想配列を1行にする．艦と攻撃の座標の文字列は表から引く．
+    def encode(self, info):
+        cond = info['condition']
+        fields = self.ship_fields
+        line = ''
+        for ship_type, ship in cond['me'].items():
+            x, y = ship['position']
+            line += fields[ship_type][ship['hp']][x][y]
+        line += ';'
+        fields = self.enemy_fields
+        for ship_type, ship in cond['enemy'].items():
+            line += fields[ship_type][ship['hp']]
+        line += ';'
+        if 'result' in info:
+            result = info['result']
+            attack = result.get('attacked')
+            if attack:
+                x, y = attack['position']
+                line += self.attacks[x][y] + attack.get('hit', '-') + ''.join(attack['near'])
+            else:
+                move = result.get('moved')
+                if move:
+                    line += "m%s%d,%d" % (move['ship'], move['distance'][0], move['distance'][1])
+        if 'outcome' in info:
+            return line + (';1' if info['outcome'] else ';0')
+        return line + ';'
+
+    # サーバ側．行動の文字列から(艦種, x, y)を表で引き，連想配列は呼ばれるたびに作る．
+    def decode_action(self, line):
+        key = self.keys.get(line)
+        if key is None:
+            raise ValueError('invalid compact action: %r' % line.rstrip('\n'))
+        ship_type, x, y = key
+        if ship_type is None:
+            return {"attack": {"to": [x, y]}}
+        return {"move": {"ship": ship_type, "to": [x, y]}}
+
+
+# 勝敗の欄の値である．行末の改行を取り除かずに引けるように，改行付きの場合も登録しておく．
+OUTCOMES = {'': None, '1': True, '0': False, '\n': None, '1\n': True, '0\n': False}
+
+JSON = JsonCodec()
+COMPACT = CompactCodec()
+CODECS = {codec.name: codec for codec in [JSON, COMPACT]}
+
+
+#
+# クライアント側．サーバの挨拶の行を見て使う形式を決める．namesは使ってよい形式の名前である．
+# 提示がないか，既定の規則でなければJSONを使う．
+#
+def negotiate(greeting, names=(COMPACT.name,)):
+    from lib.player_base import default_rules
+
+    if OFFER in greeting and default_rules():
+        for name in names:
+            if name in CODECS and name != JSON.name:
+                return CODECS[name]
+    return JSON
+
+
+# クライアント側．初期状態の行を作る．JSON以外を使う場合は"codec"で形式を伝える．
+def initial_line(player, codec):
+    if codec is JSON:
+        return player.initial_condition()
+    cond = json.loads(player.initial_condition())
+    cond["codec"] = codec.name
+    return json.dumps(cond)
+
+
+# サーバ側．挨拶の行の末尾に加える文字列を返す．既定の規則でなければcompactを提示しない．
+def offer():
+    from lib.player_base import default_rules
+
+    return OFFER if default_rules() else ''
+
+
+# サーバ側．初期状態の行を読み，(初期配置, 形式)を返す．提示していない形式を求められた場合は例外を送出する．
+def accept(line):
+    cond = json.loads(line)
+    name = cond.pop("codec", JSON.name) if isinstance(cond, dict) else JSON.name
+    if name not in CODECS or name != JSON.name and not offer():
+        raise ValueError('unknown codec: %r' % name)
+    return cond, CODECS[name]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'test':
+        import unittest
+
+        from lib.engine import Server, play
+        from players.ai_player import AIPlayer
+        from players.random_player import RandomPlayer
+
+        # エンジンの対戦で実際に送られる通知と行動を集める．
+        def record(seeds):
+            messages, actions = [], []
+            for seed in seeds:
+                players = [AIPlayer(seed), RandomPlayer(seed + 1000)]
+                server = Server(json.loads(players[0].initial_condition()),
+                                json.loads(players[1].initial_condition()))
+                for turn in range(200):
+                    c = turn % 2
+                    act = players[c].decide()
+                    actions.append(act)
+                    results = server.action(c, act)
+                    players[c].update(results[0], True)
+                    players[1 - c].update(results[1], False)
+                    messages += results
+                    if "outcome" in results[0]:
+                        break
+            return messages, actions
+
+        class CodecTest(unittest.TestCase):
+
+            def test_round_trip(self):
+                messages, actions = record(range(10))
+                for info in messages:
+                    expected = from_dict(info)
+                    for codec in [JSON, COMPACT]:
+                        self.assertEqual(expected, codec.decode(codec.encode(info) + '\n'))
+                        self.assertEqual(expected, decode(codec.encode(info)))
+                for act in actions:
+                    self.assertEqual(json.dumps(act), JSON.encode_action(act))
+                    for codec in [JSON, COMPACT]:
+                        self.assertEqual(act, codec.decode_action(codec.encode_action(act) + '\n'))
+
+            def test_message(self):
+                m = COMPACT.decode("w300c214;w3s1;a12w;\n")
+                self.assertEqual({'w': (3, [0, 0]), 'c': (2, [1, 4])}, m.me)
+                self.assertEqual({'w': 3, 's': 1}, m.enemy)
+                self.assertEqual(([1, 2], 'w', []), m.attacked)
+                self.assertEqual(None, m.moved)
+                self.assertEqual(([1, 2], None, ['c', 's']), COMPACT.decode("w300;w3;a12-cs;").attacked)
+                m = COMPACT.decode("s110;c1;mc-2,0;0")
+                self.assertEqual(('c', -2, 0), m.moved)
+                self.assertEqual(False, m.outcome)
+                with self.assertRaises(ValueError):
+                    COMPACT.decode("w300")
+                with self.assertRaises(ValueError):
+                    COMPACT.decode_action("b12")
+
+            # compactでは同じ欄の復号結果どうしで連想配列とリストを共有する．
+            def test_shared(self):
+                a = COMPACT.decode("w300c214;w3;a12wc;")
+                b = COMPACT.decode("w300c214;w3;mc1,0;")
+                self.assertIs(a.me, b.me)
+                self.assertIs(a.enemy, b.enemy)
+                self.assertIs(a.attacked, COMPACT.decode("w300;c2;a12wc;").attacked)
+                self.assertEqual(Message(a.me, a.enemy, None, ([1, 2], 'w', ['c'])), a)
+                self.assertEqual("Message(me={'w': (3, [0, 0]), 'c': (2, [1, 4])}, enemy={'w': 3}, "
+                                 "moved=None, attacked=None, outcome=None)", repr(Message(a.me, a.enemy)))
+
+            def test_negotiate(self):
+                greeting = "you are connected. please send me initial state."
+                self.assertIs(JSON, negotiate(greeting))
+                self.assertIs(COMPACT, negotiate(greeting + OFFER))
+                self.assertIs(JSON, negotiate(greeting + OFFER, names=()))
+                p = RandomPlayer(0)
+                self.assertEqual(p.initial_condition(), initial_line(p, JSON))
+                positions, codec = accept(initial_line(p, COMPACT))
+                self.assertIs(COMPACT, codec)
+                self.assertEqual(json.loads(p.initial_condition()), positions)
+                with self.assertRaises(ValueError):
+                    accept('{"codec": "xml"}')
+                # 既定の規則でなければcompactは使わない．
+                from lib.player_base import configure
+
+                configure(12)
+                try:
+                    self.assertEqual('', offer())
+                    self.assertIs(JSON, negotiate(greeting + OFFER))
+                    with self.assertRaises(ValueError):
+                        accept('{"codec": "compact"}')
+                finally:
+                    configure()
+                self.assertEqual(OFFER, offer())
+
+            def test_players(self):
+                # 通知を文字列で渡しても，連想配列で渡しても同じ対戦になる．
+                for seed in range(5):
+                    expected = play(AIPlayer(seed), RandomPlayer(seed + 100), 1000)
+                    a, b = AIPlayer(seed), RandomPlayer(seed + 100)
+                    a.update = lambda m, is_my_turn, f=a.update: f(COMPACT.encode(m), is_my_turn)
+                    b.update = lambda m, is_my_turn, f=b.update: f(JSON.encode(m), is_my_turn)
+                    self.assertEqual(expected, play(a, b, 1000))
+
+        unittest.main(argv=sys.argv[:1])
+    else:
+        import argparse
+        import copy
+        import timeit
+
+        from lib.engine import Server
+        from players.ai_player import AIPlayer
+        from players.random_player import RandomPlayer
+
+        parser = argparse.ArgumentParser(description="Measure per-turn protocol overhead")
+        parser.add_argument("--games", type=int, default=200, help="Number of recorded games")
+        args = parser.parse_args()
+
+        # 対戦を記録し，server.rbが送る形のJSONの行とcompactの行を作る．
+        infos, actions = [], []
+        for seed in range(args.games):
+            players = [AIPlayer(seed), RandomPlayer(seed + args.games)]
+            server = Server(json.loads(players[0].initial_condition()),
+                            json.loads(players[1].initial_condition()))
+            for turn in range(1000):
+                c = turn % 2
+                act = players[c].decide()
+                results = server.action(c, act)
+                players[c].update(results[0], True)
+                players[1 - c].update(results[1], False)
+                infos.append(results)
+                actions.append(act)
+                if "outcome" in results[0]:
+                    break
+
+        # 対戦中に作った行動は他のオブジェクトの間に散らばっていて，それを読む時間が計測に入るので，
+        # クライアントが1ターンの中で作った直後と同じように，まとめて複製しておく．
+        actions = copy.deepcopy(actions)
+        json_lines = [[JSON.encode(info) + '\n' for info in results] for results in infos]
+        compact_lines = [[COMPACT.encode(info) + '\n' for info in results] for results in infos]
+        turns = len(infos)
+
+        # 1ターンに1人のクライアントが行う処理: 行動を文字列にして，2つの通知のうち1つを復号する．
+        def baseline():
+            for act, lines in zip(actions, json_lines):
+                json.dumps(act)
+                data = json.loads(lines[0])
+                cond = data['condition']
+                for ship_type, ship in cond['me'].items():
+                    ship['hp'], ship['position']
+                for ship_type in ['w', 'c', 's']:
+                    ship_type in cond['enemy']
+                if 'result' in data and 'moved' in data['result']:
+                    data['result']['moved']['distance']
+                if 'result' in data and 'attacked' in data['result']:
+                    result = data['result']['attacked']
+                    result['position'], result.get('hit'), result.get('near', [])
+
+        # 自分の状態の表は計測のたびに空にする．事前に作る表はそのまま使う．
+        def client(codec, lines):
+            def run():
+                getattr(codec, 'mes', {}).clear()
+                for act, line in zip(actions, lines):
+                    codec.encode_action(act)
+                    codec.decode(line[0])
+            return run
+
+        # サーバが1ターンに行う処理: 行動を復号して，2つの通知を文字列にする．
+        def server_side(codec):
+            action_lines = [codec.encode_action(act) + '\n' for act in actions]
+
+            def run():
+                for line, results in zip(action_lines, infos):
+                    codec.decode_action(line)
+                    codec.encode(results[0])
+                    codec.encode(results[1])
+            return run
+
+        #
+        # 他の処理の影響を受けにくいように，繰り返した中で最も短い時間を使う．
+        # 計算機の速さが時間とともに変わっても比が崩れないように，比べる処理を交互に実行する．
+        #
+        def measure(runs, repeat=20):
+            times = [[] for run in runs]
+            for i in range(repeat):
+                for run, t in zip(runs, times):
+                    t.append(timeit.timeit(run, number=1))
+            return [min(t) / turns * 1e6 for t in times]
+
+        base, client_json, client_compact, server_json, server_compact = measure(
+            [baseline, client(JSON, json_lines), client(COMPACT, compact_lines),
+             server_side(JSON), server_side(COMPACT)])
+        print(f"{turns} turns")
+        print(f"client json.loads/json.dumps: {base:.2f} us/turn")
+        print(f"client json: {client_json:.2f} us/turn ({base / client_json:.1f}x)")
+        print(f"client compact: {client_compact:.2f} us/turn ({base / client_compact:.1f}x)")
+        print(f"server json: {server_json:.2f} us/turn")
+        print(f"server compact: {server_compact:.2f} us/turn ({server_json / server_compact:.1f}x)")
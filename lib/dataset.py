@@ -0,0 +1,321 @@
+import itertools
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.getcwd())
+
+import numpy as np
+
+from lib.engine import MAX_TURNS, play
+from lib.player_base import SHIP_TYPES, Player, PlayerShip
+from lib.tournament import load_player, player_seeds
+from players.ai_player import AIPlayer
+
+
+#
+# 対戦から学習用のデータを作るモジュールである．numpyが必要．
+# 与えたプレイヤーの組を順に対戦させ，各プレイヤーの行動ごとに次の4つを1件として記録する．
+#   belief:  (3, 5, 5)の予測．行動したプレイヤーが受け取った通知をListBeliefに与えたもの．
+#            プレイヤーの実装によらず同じ方法で作るので，RandomPlayerの行動にも付けられる．
+#   fleet:   (3, 2)の自分の艦隊．SHIP_TYPESの順に(マス, HP)で，沈んだ艦は(-1, 0)．
+#   action:  行動．lib/player_base.pyのPlayer.legal_actionsと同じ整数で表す．
+#   outcome: 行動したプレイヤーから見た対戦の結果．勝ちは1，負けは-1，引き分けは0．
+#
+# 1つのチャンクは，フィールドごとのnumpyの配列のファイル(chunk-00000.belief.npy, ...)で，件数はどれも同じである．
+# ワーカーはチャンクを1つずつ担当し，件数がそろうまで対戦させて書き出す．最後の対戦のうち溢れた分は捨てる．
+# ワーカーのメモリはチャンク1つ分と対戦1回分だけで済む．
+#
+
+# フィールドの名前，型，1件の形である．
+FIELDS = [
+    ('belief', np.float32, (len(SHIP_TYPES), Player.FIELD_SIZE, Player.FIELD_SIZE)),
+    ('fleet', np.int8, (len(SHIP_TYPES), 2)),
+    ('action', np.int16, ()),
+    ('outcome', np.int8, ()),
+]
+
+# チャンクの件数の既定値である．
+CHUNK_SIZE = 4096
+
+# チャンクごとに使うシードの間隔である．チャンクの中の対戦はこの範囲のシードを順に使う．
+SEED_STRIDE = 1 << 20
+
+
+def chunk_path(path, chunk, field):
+    return os.path.join(path, 'chunk-%05d.%s.npy' % (chunk, field))
+
+
+# 行動の連想配列を整数にする．
+def action_code(act):
+    n = Player.FIELD_SIZE * Player.FIELD_SIZE
+    if "attack" in act:
+        x, y = act["attack"]["to"]
+        return x * Player.FIELD_SIZE + y
+    x, y = act["move"]["to"]
+    return n + SHIP_TYPES.index(act["move"]["ship"]) * n + x * Player.FIELD_SIZE + y
+
+
+# 初期配置を，lib/engine.pyの通知と同じ形の連想配列にする．
+def initial_message(positions):
+    return {"condition": {
+        "me": {ship_type: {"hp": PlayerShip.MAX_HPS[ship_type], "position": list(position)}
+               for ship_type, position in positions.items()},
+        "enemy": {ship_type: {"hp": hp} for ship_type, hp in PlayerShip.MAX_HPS.items()}}}
+
+
+#
+# 1回の対戦の記録を集めるクラスである．lib/records.pyのGameRecordと同じく，lib.engine.playのrecorderから作られる．
+# 両プレイヤーの通知を，予測を作るためだけのAIPlayer(observers)にも与える．
+# turnは行動したプレイヤーが通知を受け取る前に呼ばれるので，その時点のobserverの状態が行動の直前の状態である．
+#
+class GameSamples:
+
+    def __init__(self, positions1, positions2):
+        self.observers = [AIPlayer(), AIPlayer()]
+        for observer, positions in zip(self.observers, [positions1, positions2]):
+            observer.update(initial_message(positions), False)
+        self.movers = []
+        self.beliefs = []
+        self.fleets = []
+        self.actions = []
+        self.winner = None
+
+    def turn(self, c, act, results):
+        observer = self.observers[c]
+        self.movers.append(c)
+        self.beliefs.append([observer.belief.prediction(ship_type) for ship_type in SHIP_TYPES])
+        fleet = []
+        for ship_type in SHIP_TYPES:
+            ship = observer.ships.get(ship_type)
+            fleet.append((ship.cell, ship.hp) if ship is not None else (-1, 0))
+        self.fleets.append(fleet)
+        self.actions.append(action_code(act))
+        observer.update(results[0], True)
+        self.observers[1 - c].update(results[1], False)
+
+    def finish(self, winner):
+        self.winner = winner
+
+    def __len__(self):
+        return len(self.movers)
+
+    def outcomes(self):
+        if self.winner == -1:
+            return [0] * len(self.movers)
+        return [1 if c == self.winner else -1 for c in self.movers]
+
+
+# lib.engine.playのrecorderとして渡し，startで作ったGameSamplesを残しておく．
+class Collector:
+
+    def start(self, positions1, positions2, meta=0):
+        self.game = GameSamples(positions1, positions2)
+        return self.game
+
+
+#
+# チャンク1つ分の配列である．addで対戦の記録を詰め，いっぱいになったらwriteで書き出す．
+#
+class ChunkBuffer:
+
+    def __init__(self, size):
+        self.size = size
+        self.arrays = {name: np.zeros((size,) + shape, dtype=dtype) for name, dtype, shape in FIELDS}
+        self.count = 0
+
+    def full(self):
+        return self.count == self.size
+
+    # 入った件数を返す．入りきらなかった分は捨てる．
+    def add(self, game):
+        k = min(len(game), self.size - self.count)
+        if k:
+            end = self.count + k
+            self.arrays['belief'][self.count:end] = game.beliefs[:k]
+            self.arrays['fleet'][self.count:end] = game.fleets[:k]
+            self.arrays['action'][self.count:end] = game.actions[:k]
+            self.arrays['outcome'][self.count:end] = game.outcomes()[:k]
+            self.count = end
+        return k
+
+    # フィールドごとに一時ファイルに書いてから置き換える．outcomeを最後に置き換えるので，outcomeがあればチャンクは揃っている．
+    def write(self, path, chunk):
+        for name, _, _ in FIELDS:
+            tmp = chunk_path(path, chunk, name) + '.tmp'
+            with open(tmp, 'wb') as f:
+                np.save(f, self.arrays[name][:self.count])
+            os.replace(tmp, chunk_path(path, chunk, name))
+
+
+#
+# ワーカーで実行する処理．chunk番目のチャンクを作る．
+# 対戦はシードの順に，プレイヤーの組(先攻後攻を区別する)を順番に使う．
+# (チャンクの番号，件数，対戦数，捨てた件数，時間)を返す．
+#
+def run_chunk(task):
+    path, chunk, specs, seed, chunk_size, max_turns = task
+    classes = [load_player(spec) for spec in specs]
+    pairs = list(itertools.product(range(len(classes)), repeat=2))
+    buffer = ChunkBuffer(chunk_size)
+    collector = Collector()
+    start = time.perf_counter()
+    games = dropped = 0
+    game_seed = seed + chunk * SEED_STRIDE
+    while not buffer.full():
+        a, b = pairs[games % len(pairs)]
+        seed_a, seed_b = player_seeds(game_seed + games)
+        play(classes[a](seed_a), classes[b](seed_b), max_turns, recorder=collector)
+        dropped += len(collector.game) - buffer.add(collector.game)
+        games += 1
+    buffer.write(path, chunk)
+    return chunk, buffer.count, games, dropped, time.perf_counter() - start
+
+
+#
+# specsのプレイヤーを対戦させ，chunks個のチャンクをpathに書き出す．
+# チャンクの中身はワーカー数によらず同じになる．チャンクごとの結果のリストを返す．
+#
+def generate(path, specs, chunks, seed=0, workers=None, chunk_size=CHUNK_SIZE, max_turns=MAX_TURNS):
+    os.makedirs(path, exist_ok=True)
+    tasks = [(path, chunk, specs, seed, chunk_size, max_turns) for chunk in range(chunks)]
+    if workers == 1:
+        return list(map(run_chunk, tasks))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run_chunk, tasks))
+
+
+# 揃っているチャンクの番号を返す．
+def list_chunks(path):
+    suffix = '.outcome.npy'
+    return sorted(int(name[len('chunk-'):-len(suffix)]) for name in os.listdir(path)
+                  if name.startswith('chunk-') and name.endswith(suffix))
+
+
+#
+# チャンクを読み出すクラスである．チャンクの順番をシャッフルし，buffer_size件のバッファを介して1件ずつ返す．
+# バッファがいっぱいになった後は，バッファから一様に選んだ1件を返して新しい1件と入れ替える．
+# チャンクはmmapで開くので，メモリに載るのはバッファの分だけである．
+#
+class ShuffleReader:
+
+    def __init__(self, path, buffer_size=10000, seed=0):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.seed = seed
+
+    def chunks(self):
+        return list_chunks(self.path)
+
+    def load(self, chunk):
+        return [np.load(chunk_path(self.path, chunk, name), mmap_mode='r') for name, _, _ in FIELDS]
+
+    # 1件ずつ(belief, fleet, action, outcome)の組を返す．
+    def __iter__(self):
+        rng = random.Random(self.seed)
+        order = self.chunks()
+        rng.shuffle(order)
+        buffer = []
+        for chunk in order:
+            arrays = self.load(chunk)
+            for i in range(len(arrays[0])):
+                sample = tuple(np.array(a[i]) for a in arrays)
+                if len(buffer) < self.buffer_size:
+                    buffer.append(sample)
+                else:
+                    j = rng.randrange(self.buffer_size)
+                    yield buffer[j]
+                    buffer[j] = sample
+        rng.shuffle(buffer)
+        yield from buffer
+
+    # batch_size件ずつ，フィールドごとに積み重ねた配列の組を返す．最後は端数になる．
+    def batches(self, batch_size):
+        batch = []
+        for sample in self:
+            batch.append(sample)
+            if len(batch) == batch_size:
+                yield tuple(np.stack(field) for field in zip(*batch))
+                batch = []
+        if batch:
+            yield tuple(np.stack(field) for field in zip(*batch))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'test':
+        import tempfile
+        import unittest
+
+        SPECS = ['players.ai_player:AIPlayer', 'players.random_player:RandomPlayer']
+
+        class DatasetTest(unittest.TestCase):
+
+            def test_samples(self):
+                collector = Collector()
+                winner, turns = play(AIPlayer(0), AIPlayer(1), 300, recorder=collector)
+                game = collector.game
+                self.assertEqual(turns, len(game))
+                self.assertEqual([0, 1] * (turns // 2) + [0] * (turns % 2), game.movers)
+                # 最初の行動の前は，艦がすべて残っていて予測は一様である．
+                self.assertEqual([PlayerShip.MAX_HPS[t] for t in SHIP_TYPES], [hp for _, hp in game.fleets[0]])
+                for pred in game.beliefs[0]:
+                    self.assertAlmostEqual(1.0, sum(sum(row) for row in pred))
+                outcomes = game.outcomes()
+                if winner != -1:
+                    self.assertEqual(1, outcomes[turns - 1])
+                self.assertEqual(set(game.outcomes()) - {-1, 0, 1}, set())
+
+            def test_generate(self):
+                with tempfile.TemporaryDirectory() as one, tempfile.TemporaryDirectory() as many:
+                    results = generate(one, SPECS, 3, workers=1, chunk_size=500, max_turns=100)
+                    generate(many, SPECS, 3, workers=2, chunk_size=500, max_turns=100)
+                    self.assertEqual([0, 1, 2], list_chunks(one))
+                    self.assertEqual([500] * 3, [r[1] for r in results])
+                    for chunk in range(3):
+                        for name, dtype, shape in FIELDS:
+                            a = np.load(chunk_path(one, chunk, name))
+                            self.assertEqual((500,) + shape, a.shape)
+                            self.assertEqual(dtype, a.dtype)
+                            self.assertTrue(np.array_equal(a, np.load(chunk_path(many, chunk, name))))
+
+                    # シャッフルしても，すべての件を1回ずつ返す．
+                    reader = ShuffleReader(one, buffer_size=200, seed=1)
+                    actions = [int(sample[2]) for sample in reader]
+                    expected = np.concatenate([np.load(chunk_path(one, c, 'action')) for c in range(3)])
+                    self.assertEqual(sorted(expected.tolist()), sorted(actions))
+                    self.assertNotEqual(expected.tolist(), actions)
+                    batches = list(reader.batches(256))
+                    self.assertEqual([256] * 5 + [220], [len(b[0]) for b in batches])
+                    self.assertEqual((256, 3, 5, 5), batches[0][0].shape)
+
+        unittest.main(argv=sys.argv[:1])
+    else:
+        import argparse
+
+        parser = argparse.ArgumentParser(description="Generate training samples from self-play games")
+        parser.add_argument("path", metavar="DIR", type=str, help="Directory to write chunks to")
+        parser.add_argument(
+            "--players",
+            nargs="+",
+            default=['players.ai_player:AIPlayer', 'players.random_player:RandomPlayer'],
+            help="Player classes. E.g., players.ai_player:AIPlayer",
+        )
+        parser.add_argument("--chunks", type=int, default=8, help="Number of chunks")
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Samples per chunk")
+        parser.add_argument("--seed", type=int, default=0, help="First seed")
+        parser.add_argument("--workers", type=int, default=None, help="Number of processes")
+        parser.add_argument("--max-turns", type=int, default=1000, help="Turn limit")
+        args = parser.parse_args()
+
+        start = time.perf_counter()
+        results = generate(args.path, args.players, args.chunks, seed=args.seed, workers=args.workers,
+                           chunk_size=args.chunk_size, max_turns=args.max_turns)
+        elapsed = time.perf_counter() - start
+        samples = sum(r[1] for r in results)
+        games = sum(r[2] for r in results)
+        dropped = sum(r[3] for r in results)
+        worker_rate = sum(r[1] for r in results) / sum(r[4] for r in results)
+        print(f"{samples} samples from {games} games ({dropped} dropped) in {elapsed:.1f}s")
+        print(f"{samples / elapsed:.0f} samples/s, {worker_rate:.0f} samples/s per worker")
@@ -0,0 +1,189 @@
+import os
+import signal
+import sys
+import threading
+import time
+
+sys.path.append(os.getcwd())
+
+from lib.histogram import Histogram
+
+
+#
+# 1手の時間の上限を守るためのモジュールである．サーバは時間内に行動を送らないと負けにする．
+# Player.decide_withinは，行動を決める前に安全な行動(Player.fallback)を決めておき，
+# Deadlineの時間内に決まらなければ，決定を中断してその行動を送る．
+#
+# 中断はSIGALRMのタイマーで行う．タイマーの設定と解除はシステムコール2回なので，時間内に決まる場合の負担は小さい．
+# setitimerがない環境(Windows)やメインスレッド以外ではシグナルを受けられないので中断できない．
+# その場合は決定が終わってから時間を調べ，超えた回数(late)を数えるだけにする．
+#
+
+# 1手の時間の上限(秒)の既定値である．
+DEADLINE = 1.0
+
+
+#
+# 時間の上限を過ぎたことを表す例外である．
+# 行動を決める処理のexcept Exceptionで捕まらずにPlayer.decide_withinまで届くように，BaseExceptionを継承する．
+#
+class DeadlineExceeded(BaseException):
+    pass
+
+
+#
+# 1手の時間の上限と，その集計を持つクラスである．with文で行動の決定を囲む．
+# budgetは秒で，Noneなら中断せずに時間だけ測る．
+# turnsは決定の回数，expiredは中断して安全な行動を送った回数，lateは中断できずに時間を超えた回数である．
+#
+class Deadline:
+
+    def __init__(self, budget=DEADLINE):
+        self.budget = budget
+        self.turns = 0
+        self.expired = 0
+        self.late = 0
+        # 決定にかかった時間(ミリ秒)である．
+        self.times = Histogram()
+        self.armed = False
+        self.start = 0.0
+        self.interruptible = budget is not None and hasattr(signal, 'setitimer') \
+            and threading.current_thread() is threading.main_thread()
+        if self.interruptible:
+            signal.signal(signal.SIGALRM, self.expire)
+
+    #
+    # SIGALRMを受けた時に呼ばれる．決定の途中なら例外で中断する．
+    # 決定が終わってからシグナルが届いた場合は，armedが偽なので何もしない．
+    #
+    def expire(self, signum, frame):
+        if self.armed:
+            self.armed = False
+            self.expired += 1
+            raise DeadlineExceeded()
+
+    def __enter__(self):
+        self.turns += 1
+        self.start = time.perf_counter()
+        if self.interruptible:
+            self.armed = True
+            signal.setitimer(signal.ITIMER_REAL, self.budget)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.interruptible:
+            self.armed = False
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        elapsed = time.perf_counter() - self.start
+        self.times.record(elapsed * 1e3)
+        if not self.interruptible and self.budget is not None and elapsed > self.budget:
+            self.late += 1
+        return False
+
+    # シグナルの処理を既定に戻す．使い終わったら呼ぶ．
+    def close(self):
+        if self.interruptible:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, signal.SIG_DFL)
+            self.interruptible = False
+
+    # ゲームの終わりに呼ぶ．verboseか，安全な行動を送ったか時間を超えた場合は集計を表示し，シグナルの処理を戻す．
+    def finish(self, verbose=0):
+        if verbose or self.expired or self.late:
+            self.report()
+        self.close()
+
+    def summary(self):
+        return {"budget_ms": None if self.budget is None else self.budget * 1e3,
+                "turns": self.turns, "expired": self.expired, "late": self.late,
+                "decide_ms": self.times.summary()}
+
+    # 安全な行動を送った回数と，決定にかかった時間を表示する．
+    def report(self, file=None):
+        file = file if file is not None else sys.stderr
+        budget = 'none' if self.budget is None else f"{self.budget * 1e3:.0f} ms"
+        times = self.times.summary()
+        print(f"deadline {budget}: fallback {self.expired}/{self.turns} turns, late {self.late}, "
+              f"decide p99 {times['p99']:.2f} ms, max {times['max']:.2f} ms", file=file)
+
+
+# クライアントのmainに時間の上限の引数を加える．
+def add_arguments(parser):
+    parser.add_argument("--deadline", type=float, default=DEADLINE,
+                        help="Seconds to decide a move before sending the fallback action. 0 disables the timer")
+
+
+# コマンドライン引数から時間の上限を作る．0以下なら中断せずに時間だけ測る．
+def from_args(args):
+    return Deadline(args.deadline if args.deadline > 0 else None)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'test':
+        import unittest
+
+        # lib/player_base.pyが捕まえる例外と同じクラスになるように，__main__ではなくlib.deadlineのものを使う．
+        from lib.deadline import Deadline
+        from lib.player_base import Player
+        from players.ai_player import AIPlayer
+        from players.random_player import RandomPlayer
+
+        # 決定の途中で，艦を動かしてから時間のかかる処理をするプレイヤーである．
+        class SlowPlayer(RandomPlayer):
+
+            def decide(self):
+                ship = self.all_ships[0]
+                ship.place(max(self.moves[ship.type]))
+                while True:
+                    try:
+                        time.sleep(0.001)
+                    except Exception:
+                        pass
+
+        class DeadlineTest(unittest.TestCase):
+
+            def test_expire(self):
+                deadline = Deadline(0.02)
+                try:
+                    p = SlowPlayer(0)
+                    state = p.snapshot()
+                    fallback = p.fallback()
+                    start = time.perf_counter()
+                    act = p.decide_within(deadline)
+                    self.assertLess(time.perf_counter() - start, 0.2)
+                    # 中断された移動は戻り，安全な行動を行う．
+                    self.assertEqual(state, p.snapshot())
+                    self.assertEqual(p.act(fallback), act)
+                    self.assertEqual((1, 1), (deadline.turns, deadline.expired))
+                    # 行動の集合も作り直されている．
+                    q = Player({ship.type: ship.position for ship in p.all_ships})
+                    self.assertEqual(q.legal_actions(), p.legal_actions())
+                finally:
+                    deadline.close()
+
+            def test_in_time(self):
+                # 時間内に決まれば，decideと同じ行動になる．
+                deadline = Deadline(1.0)
+                try:
+                    for seed in range(5):
+                        a, b = AIPlayer(seed), AIPlayer(seed)
+                        self.assertEqual(a.decide(), b.decide_within(deadline))
+                    self.assertEqual((5, 0), (deadline.turns, deadline.expired))
+                    # 決定の後に届いたシグナルでは中断しない．
+                    deadline.armed = False
+                    deadline.expire(signal.SIGALRM, None)
+                finally:
+                    deadline.close()
+
+            def test_untimed(self):
+                deadline = Deadline(None)
+                self.assertFalse(deadline.interruptible)
+                RandomPlayer(0).decide_within(deadline)
+                self.assertEqual(1, deadline.times.count)
+
+            def test_fallback(self):
+                for seed in range(20):
+                    for p in (RandomPlayer(seed), AIPlayer(seed)):
+                        self.assertIn(p.fallback(), p.legal_actions())
+
+        unittest.main(argv=sys.argv[:1])
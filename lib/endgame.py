@@ -0,0 +1,388 @@
+import collections
+import mmap
+import os
+import struct
+import sys
+
+sys.path.append(os.getcwd())
+
+from lib.player_base import Player, PlayerShip, build_masks
+
+
+#
+# 1隻対1隻の終盤を後退解析で解いた表である．
+# 互いの艦の座標とHPが分かっている(完全情報の)場合について，手番のプレイヤーから見た結果と最善の行動を持つ．
+# 相手が自分の座標を知っていても結果は変わらないので，勝ちの局面は実際の対戦でも必ず勝てる．
+#
+# 局面は(手番側のHP，相手のHP，手番側のマス，相手のマス)の組で，次の式でインデックスにする．
+#   ((hp - 1) * max_hp + enemy_hp - 1) * n * n + cell * n + enemy_cell    (nはマスの数)
+# 表の1件は結果と行動の2バイトである．
+#   結果: 正なら相手を沈めるまでのプライ数(自分の行動を1と数える)で勝ち，負ならそのプライ数で負け，0は引き分け．
+#   行動: n未満ならそのマスへの攻撃，n以上ならマス(行動 - n)への移動．
+#
+# 引き分けの局面では，引き分けを保つ行動のうち相手に最も近づくものを選ぶ．対戦を先に進めるためである．
+#
+
+MAGIC = b'SEG1'
+HEADER = struct.Struct('<4sBB')
+ENTRY = struct.Struct('<bB')
+
+# 攻撃で相手の最後の艦を沈めたことを表す後続局面である．
+KILL = -1
+
+
+def state_index(size, max_hp, hp, enemy_hp, cell, enemy_cell):
+    n = size * size
+    return ((hp - 1) * max_hp + enemy_hp - 1) * n * n + cell * n + enemy_cell
+
+
+# 各局面について(行動, 後続局面)のリストを作る．後続局面は相手の手番から見たものである．
+def successors(size, max_hp):
+    n = size * size
+    attack, reach, _ = build_masks(size)
+    table = []
+    for hp in range(1, max_hp + 1):
+        for enemy_hp in range(1, max_hp + 1):
+            for cell in range(n):
+                for enemy_cell in range(n):
+                    moves = []
+                    for a in range(n):
+                        if not attack[cell] >> a & 1:
+                            continue
+                        if a == enemy_cell:
+                            if enemy_hp == 1:
+                                moves.append((a, KILL))
+                            else:
+                                moves.append((a, state_index(size, max_hp, enemy_hp - 1, hp, enemy_cell, cell)))
+                        else:
+                            moves.append((a, state_index(size, max_hp, enemy_hp, hp, enemy_cell, cell)))
+                    for to in range(n):
+                        if reach[cell] >> to & 1:
+                            moves.append((n + to, state_index(size, max_hp, enemy_hp, hp, enemy_cell, to)))
+                    table.append(moves)
+    return table
+
+
+#
+# 後退解析で各局面の結果を求める．
+# 相手を沈められる局面を1プライの勝ちとし，解けた局面を距離の短い順に取り出して，
+# 負けの局面の前の局面を勝ち，後続がすべて勝ちになった局面を負けとする．最後まで決まらない局面は引き分けである．
+#
+def retrograde(table):
+    values = [0] * len(table)
+    solved = [False] * len(table)
+    predecessors = [[] for _ in table]
+    remaining = [0] * len(table)
+    queue = collections.deque()
+    for s, moves in enumerate(table):
+        targets = {t for _, t in moves}
+        if KILL in targets:
+            values[s] = 1
+            solved[s] = True
+            queue.append(s)
+            continue
+        remaining[s] = len(targets)
+        for t in targets:
+            predecessors[t].append(s)
+
+    while queue:
+        t = queue.popleft()
+        value = values[t]
+        for p in predecessors[t]:
+            if solved[p]:
+                continue
+            if value < 0:
+                values[p] = backup(value)
+                solved[p] = True
+                queue.append(p)
+            else:
+                remaining[p] -= 1
+                if remaining[p] == 0:
+                    values[p] = backup(value)
+                    solved[p] = True
+                    queue.append(p)
+    return values
+
+
+# 後続局面の結果(相手から見たもの)を自分から見た結果にする．
+def backup(value):
+    if value < 0:
+        return 1 - value
+    if value > 0:
+        return -(value + 1)
+    return 0
+
+
+# 行動の良さを比べるキーである．勝ちは早いほど，負けは遅いほど良く，同じ結果なら相手に近づく行動を優先する．
+def action_key(value, progress):
+    if value > 0:
+        return (2, -value, progress)
+    if value < 0:
+        return (0, -value, progress)
+    return (1, progress)
+
+
+#
+# 行動がどれだけ対戦を進めるかである．相手のマスへの攻撃は1，それ以外は行動の後の自分の艦と相手の艦の距離の符号を変えたもの．
+# 距離はチェビシェフ距離で比べ，同じならマンハッタン距離で比べる．攻撃は移動しないので，cellは攻撃する艦のマスである．
+#
+def progress(size, cell, action, enemy_cell):
+    n = size * size
+    if action < n:
+        if action == enemy_cell:
+            return 1
+    else:
+        cell = action - n
+    x, y = divmod(cell, size)
+    ex, ey = divmod(enemy_cell, size)
+    dx, dy = abs(x - ex), abs(y - ey)
+    return -(2 * size * max(dx, dy) + dx + dy)
+
+
+# 各局面の最善の行動を選ぶ．同じキーなら番号の小さい行動を選ぶ．
+def best_actions(size, table, values):
+    n = size * size
+    actions = []
+    for s, moves in enumerate(table):
+        cell, enemy_cell = divmod(s % (n * n), n)
+        best = None
+        for action, t in moves:
+            value = 1 if t == KILL else backup(values[t])
+            key = action_key(value, progress(size, cell, action, enemy_cell))
+            if best is None or key > best[0]:
+                best = (key, action, value)
+        if best[2] != values[s]:
+            raise ValueError('inconsistent retrograde analysis')
+        actions.append(best[1])
+    return actions
+
+
+# 表を解いてファイルの内容をバイト列で返す．大きさとHPの最大値を与えなければ，今の規則で解く．
+def solve(size=None, max_hp=None):
+    size = size or Player.FIELD_SIZE
+    max_hp = max_hp or max(PlayerShip.MAX_HPS.values())
+    table = successors(size, max_hp)
+    values = retrograde(table)
+    actions = best_actions(size, table, values)
+    if max(abs(v) for v in values) > 127:
+        raise ValueError('distance does not fit in a byte')
+    data = bytearray(HEADER.pack(MAGIC, size, max_hp))
+    for value, action in zip(values, actions):
+        data += ENTRY.pack(value, action)
+    return bytes(data)
+
+
+# 表を解いてpathに書き出す．一時ファイルに書いてから置き換える．
+def generate(path, size=None, max_hp=None):
+    data = solve(size, max_hp)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+    return data
+
+
+#
+# 表を引くクラスである．pathを与えると，最初に引いた時にファイルをmmapする．dataを与えると，そのバイト列を使う．
+#
+class Endgame:
+
+    def __init__(self, path=None, data=None):
+        if path is None and data is None:
+            raise ValueError('path or data is required')
+        self.path = path
+        self.file = None
+        self.data = data
+        self.size = self.max_hp = None
+        if data is not None:
+            self.check()
+
+    # 見出しを確かめる．フィールドの大きさが違う表は使えない．
+    def check(self):
+        magic, self.size, self.max_hp = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            raise ValueError('not an endgame table')
+        if self.size != Player.FIELD_SIZE or self.max_hp < max(PlayerShip.MAX_HPS.values()):
+            raise ValueError('endgame table for a different field')
+
+    def load(self):
+        self.file = open(self.path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.check()
+
+    # 局面の(結果, 行動)を返す．
+    def probe(self, hp, enemy_hp, cell, enemy_cell):
+        if self.data is None:
+            self.load()
+        s = state_index(self.size, self.max_hp, hp, enemy_hp, cell, enemy_cell)
+        return ENTRY.unpack_from(self.data, HEADER.size + s * ENTRY.size)
+
+    #
+    # 相手の艦が1隻で座標が分かっている場合に，playerの行動を連想配列で返す．
+    # 自分の艦が複数ある場合は，艦ごとに1隻対1隻の表を引き，最も良い行動を選ぶ．
+    # 他の艦は相手の攻撃を受けるだけなので，1隻対1隻の勝ちは複数の艦でも勝ちである．
+    # ただし，移動先に自分の他の艦がいる行動は選ばない．選べる行動がなければNoneを返す．
+    #
+    def action(self, player, enemy_hp, enemy_cell):
+        n = Player.FIELD_SIZE * Player.FIELD_SIZE
+        occupied = player.occupied()
+        best = None
+        for ship in player.ships.values():
+            value, action = self.probe(ship.hp, enemy_hp, ship.cell, enemy_cell)
+            if action >= n and occupied >> (action - n) & 1:
+                continue
+            key = action_key(value, progress(Player.FIELD_SIZE, ship.cell, action, enemy_cell))
+            if best is None or key > best[0]:
+                best = (key, ship, action)
+        if best is None:
+            return None
+        _, ship, action = best
+        if action < n:
+            return player.attack(list(divmod(action, Player.FIELD_SIZE)))
+        return player.move(ship.type, list(divmod(action - n, Player.FIELD_SIZE)))
+
+    def close(self):
+        if self.file is not None:
+            self.data.close()
+            self.file.close()
+            self.file = None
+            self.data = None
+
+
+# lib/tables.pyの表を使うEndgameを返す．SUBMARINE_TABLESを与えたプロセスどうしは同じファイルをmmapして共有する．numpyが必要．
+def shared():
+    from lib import tables
+    return Endgame(data=tables.get(tables.endgame_name())['data'])
+
+
+if __name__ == '__main__':
+    from players.ai_player import AIPlayer
+
+    #
+    # 表の効果を測るためのプレイヤーである．相手の残りが座標の分かっている1隻なら，表で行動を決める．
+    # 表は1隻対1隻しか扱えず，対戦が長引くのは互いに2隻以上残っている場合なので，AIPlayerには組み込んでいない．
+    #
+    class EndgamePlayer(AIPlayer):
+
+        def __init__(self, seed, endgame):
+            super().__init__(seed)
+            self.endgame = endgame
+
+        def decide(self):
+            if len(self.enemy_hps) == 1:
+                (enemy_type, enemy_hp), = self.enemy_hps.items()
+                if enemy_type in self.known:
+                    act = self.endgame.action(self, enemy_hp, self.known[enemy_type])
+                    if act is not None:
+                        self.attacked_ship = None
+                        return act
+            return super().decide()
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'test':
+        import tempfile
+        import unittest
+
+        from lib.engine import play
+        from players.random_player import RandomPlayer
+
+        TABLE = Endgame(data=solve())
+
+        class EndgameTest(unittest.TestCase):
+
+            def test_values(self):
+                # 相手を沈められる局面は1プライの勝ち．
+                self.assertEqual((1, 13), TABLE.probe(3, 1, 12, 13))
+                # 相手はいつでも攻撃できない位置に逃げられるので，それ以外は引き分けである．
+                self.assertEqual(0, TABLE.probe(3, 2, 12, 13)[0])
+                self.assertEqual(0, TABLE.probe(1, 3, 0, 24)[0])
+
+            def test_actions(self):
+                n = Player.FIELD_SIZE ** 2
+                # HPが同じなら攻撃し，HPが1で反撃されると沈む場合は逃げる．
+                self.assertEqual(13, TABLE.probe(2, 2, 12, 13)[1])
+                value, action = TABLE.probe(1, 2, 12, 13)
+                self.assertTrue(action >= n)
+                self.assertEqual(-2 * 5 * 2 - 2, progress(5, 12, action, 13))
+                # 近づくと先に攻撃されて沈む場合は，攻撃できる範囲の外から近づく．
+                value, action = TABLE.probe(1, 2, 4, 24)
+                self.assertEqual((0, n + 14), (value, action))
+                # HPが多ければ，攻撃できる範囲に入る．自分の艦と重ならなければ，相手の艦と同じマスにも移動できる．
+                self.assertEqual((0, n + 24), TABLE.probe(2, 1, 4, 24))
+
+            def test_file(self):
+                with tempfile.TemporaryDirectory() as path:
+                    path = os.path.join(path, 'endgame.bin')
+                    generate(path)
+                    table = Endgame(path)
+                    # 最初に引くまでファイルを開かない．
+                    self.assertEqual(None, table.data)
+                    for args in [(3, 1, 12, 13), (1, 2, 12, 13), (2, 3, 0, 24)]:
+                        self.assertEqual(TABLE.probe(*args), table.probe(*args))
+                    table.close()
+                try:
+                    table = shared()
+                except ImportError:
+                    table = None
+                if table is not None:
+                    for args in [(3, 1, 12, 13), (1, 2, 12, 13), (2, 3, 0, 24)]:
+                        self.assertEqual(TABLE.probe(*args), table.probe(*args))
+                with self.assertRaises(ValueError):
+                    Endgame(data=b'XXXX\x05\x03')
+
+            def test_player(self):
+                # 命中した艦の座標を移動の通知で追う．
+                ai = EndgamePlayer(0, TABLE)
+                ai.update({"result": {"attacked": {"position": [1, 1], "hit": "w", "near": []}},
+                           "condition": {"me": {"w": {"hp": 3, "position": [0, 0]}},
+                                         "enemy": {"w": {"hp": 2}}}}, True)
+                self.assertEqual({'w': 6}, ai.known)
+                ai.update({"result": {"moved": {"ship": "w", "distance": [0, 3]}},
+                           "condition": {"me": {"w": {"hp": 3, "position": [0, 0]}},
+                                         "enemy": {"w": {"hp": 2}}}}, False)
+                self.assertEqual({'w': 9}, ai.known)
+                # HPが多いので，(0, 0)から相手の艦(1, 4)を攻撃できるマスに移動する．
+                self.assertEqual({"move": {"ship": "w", "to": [0, 4]}}, ai.decide())
+
+                for seed in range(10):
+                    winner, turns = play(EndgamePlayer(seed, TABLE), RandomPlayer(seed + 100))
+                    self.assertIn(winner, [-1, 0, 1])
+
+        unittest.main(argv=sys.argv[:1])
+    else:
+        import argparse
+        import time
+
+        from lib.engine import MAX_TURNS, play
+        from players.random_player import RandomPlayer
+
+        parser = argparse.ArgumentParser(description="Generate the endgame table and measure game lengths")
+        parser.add_argument("--output", type=str, default=None, help="Table file to write. Not written if omitted")
+        parser.add_argument("--games", type=int, default=0, help="Games to compare with and without the table")
+        parser.add_argument("--max-turns", type=int, default=MAX_TURNS, help="Turns before a draw")
+        args = parser.parse_args()
+
+        start = time.perf_counter()
+        data = solve() if args.output is None else generate(args.output)
+        values = [ENTRY.unpack_from(data, HEADER.size + i * ENTRY.size)[0]
+                  for i in range((len(data) - HEADER.size) // ENTRY.size)]
+        print(f"{args.output or 'endgame'}: {len(values)} positions, {len(data)} bytes, "
+              f"{time.perf_counter() - start:.2f}s")
+        print(f"win: {sum(v > 0 for v in values)}, loss: {sum(v < 0 for v in values)}, "
+              f"draw: {values.count(0)}")
+
+        table = Endgame(data=data)
+        pairings = {
+            'ai-random': lambda seed, make: (make(seed), RandomPlayer(seed + args.games)),
+            'ai-ai': lambda seed, make: (make(seed), make(seed + args.games)),
+        }
+        for name, pairing in pairings.items():
+            for label, make in [('without', AIPlayer), ('with', lambda seed: EndgamePlayer(seed, table))]:
+                if not args.games:
+                    break
+                start = time.perf_counter()
+                results = [play(*pairing(seed, make), max_turns=args.max_turns) for seed in range(args.games)]
+                turns = [t for _, t in results]
+                print(f"{name:10s} {label:8s} mean turns {sum(turns) / len(turns):8.1f}, "
+                      f"draws {sum(w == -1 for w, _ in results)}/{len(results)}, "
+                      f"wins {sum(w == 0 for w, _ in results)}, {time.perf_counter() - start:.1f}s")
+        table.close()
@@ -0,0 +1,347 @@
+import json
+import os
+import sys
+
+sys.path.append(os.getcwd())
+
+from lib.player_base import Player, PlayerShip
+
+
+#
+# ソケットを介さずにゲームを進めるためのモジュールである．
+# source/server.rbのClient, Serverと同じ規則を実装しているが，JSONの代わりに連想配列をやり取りする．
+#
+
+# ターン数がこれを超えると引き分けになる．
+MAX_TURNS = 10000
+
+
+# サーバ側で管理するプレイヤーを表すクラスである．艦を複数保持している．
+class Client:
+
+    #
+    # 艦種ごとに座標を与えられるので，PlayerShipオブジェクトを作成し，連想配列に加える．
+    # 座標が重複していたり，フィールド外であったりする場合は例外を送出する．
+    #
+    def __init__(self, positions):
+        self.ships = {}
+        for ship_type, position in positions.items():
+            if self.overlap(position) is not None:
+                raise ValueError('given overlapping positions')
+            if not Player.in_field(position):
+                raise ValueError('position out of field')
+            self.ships[ship_type] = PlayerShip(ship_type, list(position))
+
+    # 艦が座標に移動可能か確かめてから移動させる．相手プレイヤーに渡す情報を連想配列で返す．
+    def move(self, ship_type, to):
+        ship = self.ships.get(ship_type)
+
+        if ship is None or not Player.in_field(to) or not ship.can_reach(to)\
+                or self.overlap(to) is not None:
+            return False
+
+        distance = [to[0] - ship.position[0], to[1] - ship.position[1]]
+        ship.moved(list(to))
+        return {"ship": ship_type, "distance": distance}
+
+    #
+    # 攻撃された時の処理．攻撃を受けた艦，あるいは周囲1マスにいる艦を調べ，状態を更新する．
+    # 相手プレイヤーに渡す情報を連想配列で返す．
+    #
+    def attacked(self, to):
+        if not Player.in_field(to):
+            return False
+
+        info = {"position": to}
+        ship = self.overlap(to)
+        near = self.near(to)
+
+        if ship is not None:
+            ship.damaged(1)
+            info["hit"] = ship.type
+
+            if ship.hp == 0:
+                self.ships.pop(ship.type)
+
+        info["near"] = [s.type for s in near]
+
+        return info
+
+    # 艦の座標とHPを返す．meで自分かどうかを判定し，違うなら座標は教えない．
+    def condition(self, me):
+        cond = {}
+        for ship in self.ships.values():
+            cond[ship.type] = {"hp": ship.hp}
+            if me:
+                cond[ship.type]["position"] = list(ship.position)
+        return cond
+
+    # 艦隊の攻撃可能な範囲を返す．
+    def can_attack(self, to):
+        return Player.in_field(to)\
+            and any(ship.can_attack(to) for ship in self.ships.values())
+
+    # 与えられた座標にいる艦を返す．
+    def overlap(self, position):
+        for ship in self.ships.values():
+            if ship.position == position:
+                return ship
+        return None
+
+    # 与えられた座標の周り1マスにいる艦を配列で返す．
+    def near(self, to):
+        return [ship for ship in self.ships.values()
+                if ship.position != to and ship.can_attack(to)]
+
+
+#
+# 処理を行うクラスである．プレイヤー2人を保持している．
+# 行動プレイヤーのインデックスをcとすると，待機プレイヤーのインデックスは1-cである．
+#
+class Server:
+
+    # 両プレイヤーの初期配置を連想配列で受け取る．
+    def __init__(self, positions1, positions2):
+        self.clients = [Client(positions1), Client(positions2)]
+
+    # 初期配置を連想配列で返す．
+    def initial_condition(self, c):
+        return [self.condition(c), self.condition(1 - c)]
+
+    #
+    # 可能かどうかチェックしてから攻撃，あるいは移動の処理を行い，両プレイヤーに結果を通知する連想配列を作る．
+    # 0番目の要素が行動プレイヤー宛，1番目の要素が待機プレイヤー宛である．
+    #
+    def action(self, c, act):
+        info = [{}, {}]
+        active = self.clients[c]
+        passive = self.clients[1 - c]
+        result = None
+
+        if "attack" in act:
+            to = act["attack"]["to"]
+
+            if not active.can_attack(to):
+                result = False
+            else:
+                result = passive.attacked(to)
+
+            info[c]["result"] = {"attacked": result}
+            info[1 - c]["result"] = {"attacked": result}
+
+            if not passive.ships:
+                info[c]["outcome"] = True
+                info[1 - c]["outcome"] = False
+        elif "move" in act:
+            result = active.move(act["move"]["ship"], act["move"]["to"])
+            info[1 - c]["result"] = {"moved": result}
+
+        if not result:
+            info[c]["outcome"] = False
+            info[1 - c]["outcome"] = True
+
+        info[c].update(self.condition(c))
+        info[1 - c].update(self.condition(1 - c))
+
+        return [info[c], info[1 - c]]
+
+    # 自分と相手の状態を連想配列で返す．
+    def condition(self, c):
+        return {
+            "condition": {
+                "me": self.clients[c].condition(True),
+                "enemy": self.clients[1 - c].condition(False)
+            }
+        }
+
+
+#
+# Playerのサブクラスのオブジェクト2つを対戦させる．source/server.rbのmainと同じ手順で進める．
+# 勝利したプレイヤーのインデックス(引き分けは-1)とターン数を返す．
+# recorderにlib/records.pyのRecordWriterを与えると，対戦を記録する．metaは記録に残す整数である．
+#
+def play(player1, player2, max_turns=MAX_TURNS, recorder=None, meta=0):
+    players = [player1, player2]
+    positions = [json.loads(player1.initial_condition()), json.loads(player2.initial_condition())]
+    server = Server(*positions)
+    record = recorder.start(*positions, meta=meta) if recorder is not None else None
+
+    winner = -1
+    turns = 0
+    c = 0
+    while winner == -1 and turns < max_turns:
+        act = players[c].decide()
+        results = server.action(c, act)
+        if record is not None:
+            record.turn(c, act, results)
+        players[c].update(results[0], is_my_turn=True)
+        players[1 - c].update(results[1], is_my_turn=False)
+
+        if "outcome" in results[0]:
+            winner = c if results[0]["outcome"] else 1 - c
+        c = 1 - c
+        turns += 1
+
+    if record is not None:
+        record.finish(winner)
+    return winner, turns
+
+
+if __name__ == '__main__':
+    import unittest
+
+    # test/server-test.rbと同じ場面を再現し，Ruby側と規則がずれていないことを確かめる．
+    class ClientTest(unittest.TestCase):
+
+        def test_init(self):
+            with self.assertRaises(ValueError):
+                Client({"w": [0, 0], "c": [0, 1], "s": [0, 0]})
+            with self.assertRaises(ValueError):
+                Client({"w": [5, 0], "c": [0, 1], "s": [0, 0]})
+            c = Client({"w": [0, 0], "c": [0, 1], "s": [1, 0]})
+            self.assertEqual([0, 0], c.ships["w"].position)
+            self.assertEqual([0, 1], c.ships["c"].position)
+            self.assertEqual([1, 0], c.ships["s"].position)
+
+        def test_move(self):
+            c = Client({"w": [0, 0], "c": [0, 1], "s": [1, 0]})
+            self.assertEqual(False, c.move("a", [1, 1]))
+            self.assertEqual(False, c.move("w", [5, 5]))
+            self.assertEqual(False, c.move("w", [0, 1]))
+            self.assertEqual(False, c.move("w", [1, 1]))
+            self.assertEqual({"ship": "w", "distance": [0, 2]}, c.move("w", [0, 2]))
+            self.assertEqual([0, 2], c.ships["w"].position)
+
+        def test_attacked(self):
+            c = Client({"w": [0, 0], "c": [0, 1], "s": [1, 0]})
+            self.assertEqual(False, c.attacked([5, 5]))
+            self.assertEqual({"position": [2, 2], "near": []}, c.attacked([2, 2]))
+            self.assertEqual({"position": [0, 0], "hit": "w", "near": ["c", "s"]},
+                             c.attacked([0, 0]))
+            self.assertEqual(2, c.ships["w"].hp)
+            self.assertEqual({"position": [1, 0], "hit": "s", "near": ["w", "c"]},
+                             c.attacked([1, 0]))
+            self.assertEqual(False, "s" in c.ships)
+
+        def test_condition(self):
+            c = Client({"w": [0, 0], "c": [0, 1], "s": [1, 0]})
+            self.assertEqual({
+                "w": {"hp": 3, "position": [0, 0]},
+                "c": {"hp": 2, "position": [0, 1]},
+                "s": {"hp": 1, "position": [1, 0]}
+            }, c.condition(True))
+            self.assertEqual({"w": {"hp": 3}, "c": {"hp": 2}, "s": {"hp": 1}},
+                             c.condition(False))
+
+        def test_overlap(self):
+            c = Client({"w": [0, 0], "c": [0, 1], "s": [1, 0]})
+            self.assertEqual(None, c.overlap([1, 1]))
+            self.assertEqual(c.ships["w"], c.overlap([0, 0]))
+
+        def test_near(self):
+            c = Client({"w": [0, 0], "c": [0, 1], "s": [1, 0]})
+            self.assertEqual([], c.near([2, 2]))
+            self.assertEqual([c.ships["c"]], c.near([0, 2]))
+
+    class ServerTest(unittest.TestCase):
+
+        def test_action(self):
+            s = Server({"w": [0, 0], "c": [0, 1], "s": [1, 0]},
+                       {"w": [1, 1], "c": [1, 0], "s": [0, 1]})
+            atk_t = {"attack": {"to": [1, 1]}}
+            atk_f1 = {"attack": {"to": [2, 2]}}
+            atk_f2 = {"attack": {"to": [5, 5]}}
+            mov_t = {"move": {"ship": "w", "to": [0, 2]}}
+            mov_f = {"move": {"ship": "w", "to": [5, 5]}}
+            me0 = {"w": {"hp": 3, "position": [0, 0]},
+                   "c": {"hp": 2, "position": [0, 1]},
+                   "s": {"hp": 1, "position": [1, 0]}}
+            me1 = {"w": {"hp": 2, "position": [1, 1]},
+                   "c": {"hp": 2, "position": [1, 0]},
+                   "s": {"hp": 1, "position": [0, 1]}}
+            enemy0 = {"w": {"hp": 2}, "c": {"hp": 2}, "s": {"hp": 1}}
+            enemy1 = {"w": {"hp": 3}, "c": {"hp": 2}, "s": {"hp": 1}}
+            attacked = {"position": [1, 1], "hit": "w", "near": ["c", "s"]}
+
+            self.assertEqual([
+                {"result": {"attacked": attacked},
+                 "condition": {"me": me0, "enemy": enemy0}},
+                {"result": {"attacked": attacked},
+                 "condition": {"me": me1, "enemy": enemy1}}
+            ], s.action(0, atk_t))
+            for atk_f in [atk_f1, atk_f2]:
+                self.assertEqual([
+                    {"result": {"attacked": False}, "outcome": False,
+                     "condition": {"me": me0, "enemy": enemy0}},
+                    {"result": {"attacked": False}, "outcome": True,
+                     "condition": {"me": me1, "enemy": enemy1}}
+                ], s.action(0, atk_f))
+
+            me0["w"]["position"] = [0, 2]
+            self.assertEqual([
+                {"condition": {"me": me0, "enemy": enemy0}},
+                {"result": {"moved": {"ship": "w", "distance": [0, 2]}},
+                 "condition": {"me": me1, "enemy": enemy1}}
+            ], s.action(0, mov_t))
+            self.assertEqual([
+                {"outcome": False, "condition": {"me": me0, "enemy": enemy0}},
+                {"result": {"moved": False}, "outcome": True,
+                 "condition": {"me": me1, "enemy": enemy1}}
+            ], s.action(0, mov_f))
+
+            s.action(0, atk_t)
+            s.action(0, atk_t)
+            s.action(0, {"attack": {"to": [1, 0]}})
+            s.action(0, {"attack": {"to": [1, 0]}})
+            attacked = {"position": [0, 1], "hit": "s", "near": []}
+            self.assertEqual([
+                {"result": {"attacked": attacked}, "outcome": True,
+                 "condition": {"me": me0, "enemy": {}}},
+                {"result": {"attacked": attacked}, "outcome": False,
+                 "condition": {"me": {}, "enemy": enemy1}}
+            ], s.action(0, {"attack": {"to": [0, 1]}}))
+
+        def test_condition(self):
+            s = Server({"w": [0, 0], "c": [0, 1], "s": [1, 0]},
+                       {"w": [1, 1], "c": [1, 0], "s": [0, 1]})
+            self.assertEqual({
+                "condition": {
+                    "me": {"w": {"hp": 3, "position": [0, 0]},
+                           "c": {"hp": 2, "position": [0, 1]},
+                           "s": {"hp": 1, "position": [1, 0]}},
+                    "enemy": {"w": {"hp": 3}, "c": {"hp": 2}, "s": {"hp": 1}}
+                }
+            }, s.condition(0))
+
+        def test_play(self):
+            from players.ai_player import AIPlayer
+            from players.random_player import RandomPlayer
+
+            winner, turns = play(RandomPlayer(1), RandomPlayer(2))
+            self.assertIn(winner, [-1, 0, 1])
+            self.assertTrue(0 < turns <= MAX_TURNS)
+
+            winner, turns = play(AIPlayer(3), RandomPlayer(4), max_turns=10)
+            self.assertTrue(turns <= 10)
+
+        # 2x2の盤面では，残りのマスを味方の艦がふさいで移動先のない艦ができる．その場合は攻撃する．
+        def test_no_moves(self):
+            from lib.player_base import configure
+            from players.ai_player import AIPlayer
+            from players.random_player import RandomPlayer
+
+            configure(2)
+            try:
+                player = AIPlayer(0)
+                blocked = [ship_type for ship_type in player.ships if not player.moves[ship_type]]
+                self.assertEqual(1, len(blocked))
+                player.attacked_ship = blocked[0]
+                self.assertIn("attack", player.decide())
+                self.assertIsNone(player.attacked_ship)
+                for seed in range(10):
+                    winner, turns = play(AIPlayer(seed), RandomPlayer(seed + 100), max_turns=100)
+                    self.assertIn(winner, [-1, 0, 1])
+            finally:
+                configure()
+
+    unittest.main()
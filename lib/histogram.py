@@ -0,0 +1,102 @@
+import math
+
+
+#
+# 値の分布を対数の幅の区間で数えるヒストグラムである．記録は区間のインデックスを計算して数を足すだけなので軽い．
+# 区間の幅は値のおよそ1/SUBDIVISIONSなので，パーセンタイルの誤差もその程度になる．
+#
+class Histogram:
+
+    # 値を2倍するごとに区間をいくつに分けるかを定義している．
+    SUBDIVISIONS = 8
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    # 値を記録する．0以下の値は0の区間に入れる．
+    def record(self, value):
+        if value > 0:
+            bucket = int(math.log2(value) * Histogram.SUBDIVISIONS) + 1
+        else:
+            bucket = 0
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    # 区間の上端の値を返す．
+    def upper(self, bucket):
+        if bucket == 0:
+            return 0.0
+        return 2 ** (bucket / Histogram.SUBDIVISIONS)
+
+    # pパーセンタイルを返す．区間の上端で近似するが，記録した最大値は超えない．
+    def percentile(self, p):
+        if self.count == 0:
+            return 0.0
+        rank = p / 100 * self.count
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(self.upper(bucket), self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    # 他のヒストグラムを足し合わせる．
+    def merge(self, other):
+        for bucket, n in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + n
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    # 件数，平均，パーセンタイルなどを連想配列で返す．
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": self.mean(),
+            "min": self.min if self.count else 0.0,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "max": self.max if self.count else 0.0,
+        }
+
+
+if __name__ == '__main__':
+    import unittest
+
+    class HistogramTest(unittest.TestCase):
+
+        def test_percentile(self):
+            h = Histogram()
+            for v in range(1, 1001):
+                h.record(v)
+            self.assertEqual(1000, h.count)
+            self.assertAlmostEqual(500.5, h.mean())
+            self.assertTrue(500 <= h.percentile(50) <= 500 * 2 ** (1 / 8))
+            self.assertTrue(990 <= h.percentile(99) <= 1000)
+            self.assertEqual(1000, h.percentile(100))
+
+        def test_merge(self):
+            a = Histogram()
+            b = Histogram()
+            a.record(0)
+            b.record(4)
+            a.merge(b)
+            self.assertEqual(2, a.count)
+            self.assertEqual(0, a.percentile(50))
+            self.assertEqual(4, a.percentile(100))
+
+    unittest.main()
@@ -0,0 +1,179 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import time
+
+sys.path.append(os.getcwd())
+
+from lib.histogram import Histogram
+
+
+#
+# クライアントのmainのループで，ターンごとの各段階(読み込み，復号，更新，行動の決定，符号化，書き込み)の時間を測るモジュールである．
+# mainはlapを段階の終わりごとに呼ぶ．前回lapを呼んでからの時間がその段階のヒストグラムに記録される．
+# 計測しない場合はNULLを使う．何もしないメソッドを呼ぶだけなので，ほとんど時間はかからない．
+#
+
+# 段階の名前である．表示の順番もこの順である．
+PHASES = ['read', 'render', 'decode', 'update', 'action', 'encode', 'write']
+
+
+# 計測しない場合に使うクラスである．Instrumentsと同じメソッドを持つが，何もしない．
+class NullInstruments:
+
+    def start_turn(self):
+        pass
+
+    def lap(self, phase):
+        pass
+
+    def end_turn(self):
+        pass
+
+    def summary(self):
+        return {}
+
+    def report(self, file=None):
+        pass
+
+
+NULL = NullInstruments()
+
+
+#
+# 段階ごとの時間(マイクロ秒)をヒストグラムに記録するクラスである．
+# profile_turnsに含まれるターンはcProfileで計測し，最後にreportで上位の関数を表示する．
+# profile_pathを与えると，表示の代わりにpstatsの形式で保存する．
+#
+class Instruments:
+
+    def __init__(self, profile_turns=(), profile_path=None):
+        self.histograms = {phase: Histogram() for phase in PHASES}
+        self.turn = -1
+        self.last = time.perf_counter()
+        self.profile_turns = set(profile_turns)
+        self.profile_path = profile_path
+        self.profiler = None
+        self.profiling = False
+
+    # ターンを始める．計測するターンならプロファイラを有効にする．
+    def start_turn(self):
+        self.turn += 1
+        if self.turn in self.profile_turns:
+            if self.profiler is None:
+                self.profiler = cProfile.Profile()
+            self.profiler.enable()
+            self.profiling = True
+        self.last = time.perf_counter()
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.histograms[phase].record((now - self.last) * 1e6)
+        self.last = now
+
+    def end_turn(self):
+        if self.profiling:
+            self.profiler.disable()
+            self.profiling = False
+
+    # 段階ごとの件数，平均，パーセンタイルを連想配列で返す．記録がない段階は含めない．
+    def summary(self):
+        return {
+            "turns": self.turn + 1,
+            "phases_us": {phase: self.histograms[phase].summary()
+                          for phase in PHASES if self.histograms[phase].count},
+        }
+
+    # 集計をfileに表示する．プロファイルがあれば，上位の関数も表示するか保存する．
+    def report(self, file=None):
+        file = file or sys.stderr
+        summary = self.summary()
+        print(f"turns: {summary['turns']}", file=file)
+        print(f"{'phase':8s} {'count':>7s} {'mean':>9s} {'p50':>9s} {'p90':>9s} {'p99':>9s} {'max':>9s} (us)",
+              file=file)
+        for phase, s in summary["phases_us"].items():
+            print(f"{phase:8s} {s['count']:7d} {s['mean']:9.1f} {s['p50']:9.1f} {s['p90']:9.1f} "
+                  f"{s['p99']:9.1f} {s['max']:9.1f}", file=file)
+        if self.profiler is not None:
+            if self.profile_path:
+                self.profiler.dump_stats(self.profile_path)
+                print(f"profile saved to {self.profile_path}", file=file)
+            else:
+                stream = io.StringIO()
+                pstats.Stats(self.profiler, stream=stream).sort_stats('cumulative').print_stats(15)
+                print(stream.getvalue(), file=file)
+
+    # 集計をJSONで保存する．
+    def export(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
+
+# コマンドライン引数から計測の設定を作る．計測を指定しなければNULLを返す．
+def from_args(args):
+    if not (args.instrument or args.instrument_json or args.profile_turns):
+        return NULL
+    return Instruments(args.profile_turns, args.profile_out)
+
+
+# クライアントのmainに計測の引数を加える．
+def add_arguments(parser):
+    parser.add_argument("--instrument", action="store_true",
+                        help="Print per-phase timings at the end of the game")
+    parser.add_argument("--instrument-json", type=str, default=None,
+                        help="Save per-phase timings to this JSON file")
+    parser.add_argument("--profile-turns", type=lambda s: [int(t) for t in s.split(',')], default=[],
+                        help="Profile these turns with cProfile. E.g., 0,10,20")
+    parser.add_argument("--profile-out", type=str, default=None,
+                        help="Save the profile to this file instead of printing it")
+    parser.add_argument("--verbose", type=int, default=1,
+                        help="0: silent, 1: server messages, 2: also predictions")
+
+
+# ゲームの終わりに，引数で指定された形で集計を出力する．
+def finish(instruments, args):
+    if instruments is NULL:
+        return
+    if args.instrument or args.profile_turns:
+        instruments.report()
+    if args.instrument_json:
+        instruments.export(args.instrument_json)
+
+
+if __name__ == '__main__':
+    import timeit
+    import unittest
+
+    class InstrumentsTest(unittest.TestCase):
+
+        def test_laps(self):
+            inst = Instruments(profile_turns=[1])
+            for _ in range(3):
+                inst.start_turn()
+                time.sleep(0.001)
+                inst.lap('read')
+                sum(range(1000))
+                inst.lap('update')
+                inst.end_turn()
+            summary = inst.summary()
+            self.assertEqual(3, summary["turns"])
+            self.assertEqual(['read', 'update'], list(summary["phases_us"]))
+            self.assertTrue(summary["phases_us"]["read"]["p50"] >= 1000)
+            stream = io.StringIO()
+            inst.report(stream)
+            self.assertIn('read', stream.getvalue())
+            self.assertIn('function calls', stream.getvalue())
+
+        def test_null(self):
+            # 計測しない場合のlapは，何もしない関数呼び出しと同程度の時間で済む．
+            NULL.start_turn()
+            NULL.lap('read')
+            NULL.end_turn()
+            self.assertEqual({}, NULL.summary())
+            t = min(timeit.repeat(lambda: NULL.lap('read'), number=10000, repeat=5)) / 10000
+            self.assertLess(t, 5e-6)
+
+    unittest.main()
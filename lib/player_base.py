@@ -1,20 +1,72 @@
+import copy
 import json
+import os
+import sys
 
+sys.path.append(os.getcwd())
 
+from lib.codec import decode
+from lib.deadline import DeadlineExceeded
+
+
+#
 # プレイヤーの船を表すクラスである．
+# 探索で大量に状態を変えては戻すので，__slots__で属性を固定し，状態はマス(cell)とHPの2つの整数で表す．
+#
 class PlayerShip:
     # 船の種類と最大HPを定義している．
     MAX_HPS = {"w": 3, "c": 2, "s": 1}
 
+    __slots__ = ('type', 'owner', 'cell', 'bit', '_position', 'hp')
+
     # 種類と場所を与えられる．HPは自動で決まる．
     def __init__(self, ship_type, position):
         if ship_type not in PlayerShip.MAX_HPS:
             raise ValueError('invalid type supecified')
 
         self.type = ship_type
+        # 艦を持つPlayerである．マスが変わると知らせる．サーバ側の艦などPlayerに属さない場合はNoneである．
+        self.owner = None
+        self.cell = -1
         self.position = position
         self.hp = PlayerShip.MAX_HPS[ship_type]
 
+    #
+    # 座標である．代入するとマスのインデックス(cell)とビットマスク(bit)も更新される．
+    # フィールド外の座標ではcellは-1，bitは0になる．
+    #
+    @property
+    def position(self):
+        return self._position
+
+    @position.setter
+    def position(self, position):
+        self._position = position
+        old = self.cell
+        if Player.in_field(position):
+            self.cell = cell_index(position)
+            self.bit = 1 << self.cell
+        else:
+            self.cell = -1
+            self.bit = 0
+        if self.owner is not None and self.cell != old:
+            self.owner.ship_moved(self, old)
+
+    #
+    # マスのインデックスで移動する．座標のリストを作らずにPOSITIONSのものを共有するので，座標を書き換えてはいけない．
+    # -1を与えるとフィールド外になる．
+    #
+    def place(self, cell):
+        old = self.cell
+        if cell >= 0:
+            self._position = POSITIONS[cell]
+            self.bit = BITS[cell]
+        else:
+            self.bit = 0
+        self.cell = cell
+        if self.owner is not None and cell != old:
+            self.owner.ship_moved(self, old)
+
     # 座標を変更する．
     def moved(self, to):
         self.position = to
@@ -23,7 +75,10 @@ class PlayerShip:
     def damaged(self, d):
         self.hp -= d
 
+    #
     # 座標が移動できる範囲(縦横)にあるか確認する．
+    # 1隻だけなら比較2回の方が表を引くより速いので，表はPlayer.move_maskで使う．
+    #
     def can_reach(self, to):
         return self.position[0] == to[0] or self.position[1] == to[1]
 
@@ -33,11 +88,17 @@ class PlayerShip:
             and abs(to[1] - self.position[1]) <= 1
 
 
+#
 # プレイヤーを表すクラスである．艦を複数保持している．
+# shipsは残っている艦，all_shipsは最初の艦すべてを初期配置の順に並べたリストである．
+#
 class Player:
     # フィールドの大きさを定義している．
     FIELD_SIZE = 5
 
+    # サブクラスは__slots__を定義しないので__dict__を持ち，属性を自由に足せる．
+    __slots__ = ('ships', 'all_ships', 'coverage', 'attacks', 'moves', 'all_moves')
+
     #
     # 艦種ごとに座標を与えられるので，Shipオブジェクトを作成し，連想配列に加える．
     # 艦のtypeがkeyになる．
@@ -45,6 +106,8 @@ class Player:
     def __init__(self, positions):
         self.ships = {ship_type: PlayerShip(ship_type, position)
                       for ship_type, position in positions.items()}
+        self.all_ships = list(self.ships.values())
+        self.build_actions()
 
     # 初期状態をJSONで返す．
     def initial_condition(self):
@@ -55,15 +118,43 @@ class Player:
     def action(self):
         pass
 
-    # 通知された情報で艦の状態を更新する．
-    def update(self, json_):
-        cond = json.loads(json_)['condition']['me']
+    #
+    # 行動を連想配列で返す．ソケットを介さずにゲームを進める場合に使う．
+    # actionだけを実装したサブクラスのために，既定ではactionのJSONを読み込んで返す．
+    #
+    def decide(self):
+        return json.loads(self.action())
+
+    #
+    # 時間の上限deadline(lib/deadline.pyのDeadline)の中でdecideを呼び，行動を連想配列で返す．
+    # 先にfallbackで安全な行動を決めておき，時間内に決まらなければ，途中で変えた艦の状態を戻してその行動を行う．
+    #
+    def decide_within(self, deadline):
+        fallback = self.fallback()
+        state = self.snapshot()
+        try:
+            with deadline:
+                return self.decide()
+        except DeadlineExceeded:
+            self.rebuild(state)
+            return self.act(fallback)
+
+    # 時間切れの場合に送る行動を整数で返す．攻撃できるマスは必ずあるので，どれか1つを攻撃する．すぐに決まる必要がある．
+    def fallback(self):
+        return self.attacks.items[0]
+
+    #
+    # 通知された情報で艦の状態を更新する．JSONの代わりにcompactの文字列，連想配列，lib/codec.pyのMessageを与えてもよい．
+    # is_my_turnは自分の行動の結果かどうかを表す．ここでは使わない．
+    #
+    def update(self, json_, is_my_turn=False):
+        me = decode(json_).me
         for ship_type in list(self.ships):
-            if ship_type not in cond:
-                self.ships.pop(ship_type)
+            if ship_type not in me:
+                self.lose(ship_type)
             else:
-                self.ships[ship_type].hp = cond[ship_type]['hp']
-                self.ships[ship_type].position = cond[ship_type]['position']
+                ship = self.ships[ship_type]
+                ship.hp, ship.position = me[ship_type]
 
     # 移動の処理を行い，連想配列で結果を返す．
     def move(self, ship_type, to):
@@ -84,23 +175,503 @@ class Player:
             }
         }
 
+    #
     # 艦隊の攻撃可能な範囲を返す．
+    # 攻撃範囲は対称なので，座標の周囲1マス(自分を含む)に艦がいるかどうかを艦隊のビットマスクで調べればよい．
+    #
     def can_attack(self, to):
-        return Player.in_field(to)\
-            and any([ship.can_attack(to) for ship in self.ships.values()])
+        x, y = to
+        if not (0 <= x < Player.FIELD_SIZE and 0 <= y < Player.FIELD_SIZE):
+            return False
+        mask = ATTACK_MASKS[x * Player.FIELD_SIZE + y]
+        for ship in self.ships.values():
+            if mask & ship.bit:
+                return True
+        return False
 
     # 与えられた座標がフィールドないかどうかを返す．
     def in_field(position):
-        return position[0] < Player.FIELD_SIZE and position[1] < Player.FIELD_SIZE\
-            and position[0] >= 0 and position[1] >= 0
+        return 0 <= position[0] < Player.FIELD_SIZE and 0 <= position[1] < Player.FIELD_SIZE
 
-    # 与えられた座標にいる艦を返す．
+    # 与えられた座標にいる艦を返す．座標のリストではなくビットを比較する．
     def overlap(self, position):
+        x, y = position
+        if not (0 <= x < Player.FIELD_SIZE and 0 <= y < Player.FIELD_SIZE):
+            return None
+        bit = 1 << (x * Player.FIELD_SIZE + y)
         for ship in self.ships.values():
-            if ship.position == position:
+            if ship.bit == bit:
                 return ship
         return None
 
+    # 艦隊がいるマスのビットマスクを返す．
+    def occupied(self):
+        mask = 0
+        for ship in self.ships.values():
+            mask |= ship.bit
+        return mask
+
+    # 艦隊が攻撃できるマスのビットマスクを返す．
+    def attack_mask(self):
+        mask = 0
+        for ship in self.ships.values():
+            mask |= ATTACK_MASKS[ship.cell]
+        return mask
+
+    # 艦が移動できるマス(縦横で，自分の他の艦がいない)のビットマスクを返す．
+    def move_mask(self, ship):
+        return REACH_MASKS[ship.cell] & ~self.occupied()
+
+    #
+    # 規則に合う行動の集合である．行動は整数で表し，マスの数をnとすると，
+    # n未満はそのマスへの攻撃，n + k * n + マスはSHIP_TYPESのk番目の艦の移動である．
+    # 攻撃できるマスはattacks，艦ごとの移動先はmovesに持ち，艦のマスが変わるたびに差分だけ更新する．
+    # coverageはマスごとに，そのマスを攻撃できる艦の数である．
+    #
+    def build_actions(self):
+        n = Player.FIELD_SIZE * Player.FIELD_SIZE
+        self.coverage = [0] * n
+        self.attacks = CellSet()
+        self.moves = {}
+        occupied = self.occupied()
+        for ship in self.ships.values():
+            ship.owner = self
+            if ship.cell >= 0:
+                for c in ATTACK_CELLS[ship.cell]:
+                    self.coverage[c] += 1
+                    self.attacks.add(c)
+            self.moves[ship.type] = CellSet()
+            if ship.cell >= 0:
+                self.moves[ship.type].reset(REACH_CELLS[ship.cell], occupied)
+        # 失った艦を戻す時に使うので，移動先の集合は艦を失っても捨てずに持っておく．
+        self.all_moves = dict(self.moves)
+
+    # 艦のマスがoldから変わった時に，行動の集合を更新する．
+    def ship_moved(self, ship, old):
+        new = ship.cell
+        coverage = self.coverage
+        attacks = self.attacks
+        # 移動の前後で共通する範囲は数が変わらないので，差分のマスだけを更新する．
+        removed, added = ATTACK_DIFFS[old][new]
+        for c in removed:
+            coverage[c] -= 1
+            if coverage[c] == 0:
+                attacks.discard(c)
+        for c in added:
+            coverage[c] += 1
+            if coverage[c] == 1:
+                attacks.add(c)
+        occupied = self.occupied()
+        # 縦横に移動できるかは座標で調べる．大きい盤面ではビットマスクの演算が盤面の広さに比例するためである．
+        size = Player.FIELD_SIZE
+        for other in self.ships.values():
+            if other is ship or other.cell < 0:
+                continue
+            x, y = divmod(other.cell, size)
+            moves = self.moves[other.type]
+            if old >= 0 and old != other.cell and (old // size == x or old % size == y) \
+                    and not occupied & BITS[old]:
+                moves.add(old)
+            if new >= 0 and new != other.cell and (new // size == x or new % size == y):
+                moves.discard(new)
+        if ship.type in self.moves:
+            self.moves[ship.type].reset(REACH_CELLS[new] if new >= 0 else (), occupied)
+
+    # 艦を失う．艦のマスを-1にしてから外すので，攻撃できるマスと他の艦の移動先が更新される．
+    def lose(self, ship_type):
+        ship = self.ships.pop(ship_type)
+        self.moves.pop(ship_type, None)
+        old = ship.cell
+        ship.owner = None
+        ship.cell = -1
+        ship.bit = 0
+        self.ship_moved(ship, old)
+
+    # 失った艦をマスcellに戻す．艦の順番はall_shipsの順にする．
+    def revive(self, ship, cell):
+        ship.owner = self
+        self.ships = {s.type: s for s in self.all_ships if s.owner is self}
+        self.moves = {s.type: self.all_moves[s.type] for s in self.ships.values()}
+        ship.place(cell)
+
+    #
+    # 艦隊の状態を，all_shipsの順に(マス, HP)を並べたタプルで返す．失った艦は(-1, 0)である．
+    # restoreで戻すと，攻撃できるマスと移動先の集合も差分で戻る．
+    #
+    def snapshot(self):
+        state = []
+        for ship in self.all_ships:
+            if ship.owner is self:
+                state += (ship.cell, ship.hp)
+            else:
+                state += (-1, 0)
+        return tuple(state)
+
+    def restore(self, state):
+        for i, ship in enumerate(self.all_ships):
+            cell = state[2 * i]
+            hp = state[2 * i + 1]
+            if ship.owner is not self:
+                if hp > 0:
+                    ship.hp = hp
+                    self.revive(ship, cell)
+                continue
+            if hp <= 0:
+                ship.hp = 0
+                self.lose(ship.type)
+                continue
+            ship.hp = hp
+            if ship.cell != cell:
+                ship.place(cell)
+
+    #
+    # 状態を複製したプレイヤーを返す．複製を更新しても元のプレイヤーは変わらない．
+    # 集合の要素の順番も同じなので，同じ乱数で同じ行動を選ぶ．サブクラスは自分の状態の複製を加える．
+    #
+    def clone(self):
+        new = copy.copy(self)
+        new.all_ships = [copy.copy(ship) for ship in self.all_ships]
+        for ship in new.all_ships:
+            if ship.owner is self:
+                ship.owner = new
+        new.ships = {ship.type: ship for ship in new.all_ships if ship.owner is new}
+        new.coverage = self.coverage[:]
+        new.attacks = self.attacks.copy()
+        new.all_moves = {ship_type: moves.copy() for ship_type, moves in self.all_moves.items()}
+        new.moves = {ship_type: new.all_moves[ship_type] for ship_type in self.moves}
+        return new
+
+    #
+    # snapshotの状態に戻す．処理の途中で中断された後に使う．
+    # 行動の集合が更新の途中で壊れているかもしれないので，差分ではなく作り直す．
+    #
+    def rebuild(self, state):
+        for i, ship in enumerate(self.all_ships):
+            ship.owner = None
+            ship.hp = state[2 * i + 1]
+            ship.place(state[2 * i])
+        self.ships = {ship.type: ship for ship in self.all_ships if ship.hp > 0}
+        self.build_actions()
+        for ship in self.all_ships:
+            self.all_moves.setdefault(ship.type, CellSet())
+
+    #
+    # 探索のために，状態を変えて戻す処理である．戻すのに必要な値を整数で返すので，呼ぶたびにオブジェクトを作らない．
+    #   make_move(ship_type, cell)     艦をマスcellへ移動し，元のマスを返す．unmake_move(ship_type, 元のマス)で戻す．
+    #   make_damage(ship_type)         艦のHPを1減らし，0になれば失う．艦のマスを返す．unmake_damage(ship_type, マス)で戻す．
+    #   make_attacked(cell)            マスcellへの相手の攻撃を受け，命中した艦のall_shipsの番号(なければ-1)を返す．
+    #                                  unmake_attacked(cell, 番号)で戻す．
+    #
+    def make_move(self, ship_type, cell):
+        ship = self.ships[ship_type]
+        old = ship.cell
+        ship.place(cell)
+        return old
+
+    def unmake_move(self, ship_type, old):
+        self.ships[ship_type].place(old)
+
+    def make_damage(self, ship_type):
+        ship = self.ships[ship_type]
+        cell = ship.cell
+        ship.hp -= 1
+        if ship.hp <= 0:
+            self.lose(ship_type)
+        return cell
+
+    def unmake_damage(self, ship_type, cell):
+        for ship in self.all_ships:
+            if ship.type == ship_type:
+                break
+        ship.hp += 1
+        if ship.owner is not self:
+            self.revive(ship, cell)
+
+    def make_attacked(self, cell):
+        bit = BITS[cell]
+        all_ships = self.all_ships
+        for i in range(len(all_ships)):
+            ship = all_ships[i]
+            if ship.bit == bit and ship.owner is self:
+                self.make_damage(ship.type)
+                return i
+        return -1
+
+    def unmake_attacked(self, cell, i):
+        if i >= 0:
+            self.unmake_damage(self.all_ships[i].type, cell)
+
+    # 規則に合うすべての行動を整数のリストで返す．攻撃が先で，移動はSHIP_TYPESの順である．
+    def legal_actions(self):
+        n = Player.FIELD_SIZE * Player.FIELD_SIZE
+        actions = sorted(self.attacks)
+        for k, ship_type in enumerate(SHIP_TYPES):
+            if ship_type in self.moves:
+                actions += [n + k * n + c for c in sorted(self.moves[ship_type])]
+        return actions
+
+    # 規則に合う行動から一様に1つ選ぶ．randomは0以上1未満の値を返す関数である．
+    def random_action(self, random):
+        n = Player.FIELD_SIZE * Player.FIELD_SIZE
+        r = int(random() * (len(self.attacks) + sum(len(moves) for moves in self.moves.values())))
+        if r < len(self.attacks):
+            return self.attacks.items[r]
+        r -= len(self.attacks)
+        for k, ship_type in enumerate(SHIP_TYPES):
+            moves = self.moves.get(ship_type)
+            if moves is not None:
+                if r < len(moves):
+                    return n + k * n + moves.items[r]
+                r -= len(moves)
+
+    # 整数で表した行動を行い，moveやattackと同じ連想配列を返す．
+    def act(self, action):
+        n = Player.FIELD_SIZE * Player.FIELD_SIZE
+        if action < n:
+            return self.attack(list(divmod(action, Player.FIELD_SIZE)))
+        k, to = divmod(action - n, n)
+        return self.move(SHIP_TYPES[k], list(divmod(to, Player.FIELD_SIZE)))
+
+
+#
+# マスの集合である．要素をリストに並べ，各マスのリスト内の位置を持つので，追加，削除，一様な取り出しが定数時間でできる．
+# 削除した位置には最後の要素を移すので，要素の順番は決まっていない．
+#
+class CellSet:
+
+    __slots__ = ('items', 'where')
+
+    def __init__(self, cells=()):
+        self.items = []
+        self.where = [-1] * (Player.FIELD_SIZE * Player.FIELD_SIZE)
+        for c in cells:
+            self.add(c)
+
+    def __len__(self):
+        return len(self.items)
+
+    def copy(self):
+        new = CellSet.__new__(CellSet)
+        new.items = self.items[:]
+        new.where = self.where[:]
+        return new
+
+    def __contains__(self, c):
+        return self.where[c] >= 0
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def add(self, c):
+        if self.where[c] < 0:
+            self.where[c] = len(self.items)
+            self.items.append(c)
+
+    #
+    # 要素をcandidatesのうちexcludedのビットが立っていないマスに置き換える．
+    # excludedは艦のマスなので立っているビットは少ない．マスの集合にしてから調べると，大きい盤面でも速い．
+    #
+    def reset(self, candidates, excluded=0):
+        where = self.where
+        items = self.items
+        for c in items:
+            where[c] = -1
+        blocked = set(cells(excluded))
+        # リストを作り直さずに使い回す．
+        items.clear()
+        for c in candidates:
+            if c not in blocked:
+                where[c] = len(items)
+                items.append(c)
+
+    def discard(self, c):
+        i = self.where[c]
+        if i >= 0:
+            last = self.items.pop()
+            if last != c:
+                self.items[i] = last
+                self.where[last] = i
+            self.where[c] = -1
+
+    # 一様に1つ選ぶ．randomは0以上1未満の値を返す関数である．
+    def sample(self, random):
+        return self.items[int(random() * len(self.items))]
+
+
+# 座標をマスのインデックスに変換する．
+def cell_index(position):
+    return position[0] * Player.FIELD_SIZE + position[1]
+
+
+# ビットマスクに含まれるマスのインデックスを小さい順に返す．
+def cells(mask):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+#
+# 各マスについて，攻撃できる範囲(自分と周囲1マス)，移動できる範囲(縦横，自分を除く)，
+# 周囲1マス(自分を除く)のビットマスクを計算する．
+#
+def build_masks(size):
+    attack, reach, near = [], [], []
+    for x in range(size):
+        for y in range(size):
+            a = r = 0
+            for i in range(size):
+                for j in range(size):
+                    bit = 1 << (i * size + j)
+                    if abs(i - x) <= 1 and abs(j - y) <= 1:
+                        a |= bit
+                    if (i == x) != (j == y):
+                        r |= bit
+            attack.append(a)
+            reach.append(r)
+            near.append(a & ~(1 << (x * size + y)))
+    return attack, reach, near
+
+
+#
+# マスのインデックスなどを引数として値を作り，記憶する表である．dictなので添字で引ける．
+# 引かれていない値はbuildで作るので，大きい盤面でも使ったマスの分しかメモリを使わない．
+#
+class LazyTable(dict):
+
+    __slots__ = ('build',)
+
+    def __init__(self, build):
+        super().__init__()
+        self.build = build
+
+    def __missing__(self, key):
+        value = self[key] = self.build(key)
+        return value
+
+
+# マスの数がこれ以下の盤面では，表を最初にすべて作っておく．
+EAGER_CELLS = 100
+
+# configureで作り直す表と，表を最初にすべて作る場合の引数の範囲を返す関数の一覧である．
+TABLES = []
+
+
+def field_cells():
+    return range(Player.FIELD_SIZE * Player.FIELD_SIZE)
+
+
+# 盤面が小さければ，表の値をすべて作る．
+def fill(table, domain):
+    table.clear()
+    if Player.FIELD_SIZE * Player.FIELD_SIZE <= EAGER_CELLS:
+        for key in domain():
+            table[key]
+
+
+# 表を作ってconfigureの対象に加える．
+def lazy_table(build, domain=field_cells):
+    table = LazyTable(build)
+    TABLES.append((table, domain))
+    fill(table, domain)
+    return table
+
+
+# マスの周囲1マス(自分を含む)のマスを小さい順に返す．
+def around_cells(cell):
+    size = Player.FIELD_SIZE
+    x, y = divmod(cell, size)
+    return [i * size + j for i in range(max(x - 1, 0), min(x + 2, size))
+            for j in range(max(y - 1, 0), min(y + 2, size))]
+
+
+# マスから縦横に移動できるマス(自分を除く)を小さい順に返す．
+def reach_cells(cell):
+    size = Player.FIELD_SIZE
+    x, y = divmod(cell, size)
+    return [i * size + j for i in range(size) for j in (range(size) if i == x else (y,)) if (i, j) != (x, y)]
+
+
+def mask_of(cells_):
+    mask = 0
+    for c in cells_:
+        mask |= BITS[c]
+    return mask
+
+
+# インデックスから座標とビットへの変換表である．
+POSITIONS = lazy_table(lambda cell: list(divmod(cell, Player.FIELD_SIZE)))
+BITS = lazy_table(lambda cell: 1 << cell)
+
+# 攻撃できるマス(自分と周囲1マス)，移動できるマス(縦横，自分を除く)，周囲1マス(自分を除く)のインデックスのリストの表である．
+ATTACK_CELLS = lazy_table(around_cells)
+REACH_CELLS = lazy_table(reach_cells)
+NEAR_CELLS = lazy_table(lambda cell: [c for c in around_cells(cell) if c != cell])
+
+# 同じ範囲をビットマスクで持つ表である．
+ATTACK_MASKS = lazy_table(lambda cell: mask_of(ATTACK_CELLS[cell]))
+# 縦横のマスは，行のビットと列のビット(COLUMN_MASKS)を合わせて作る．1マスずつ足すと大きい盤面で遅いためである．
+COLUMN_MASKS = lazy_table(lambda y: int(('0' * (Player.FIELD_SIZE - 1) + '1') * Player.FIELD_SIZE, 2) << y,
+                          lambda: range(Player.FIELD_SIZE))
+REACH_MASKS = lazy_table(lambda cell: ((1 << Player.FIELD_SIZE) - 1 << cell // Player.FIELD_SIZE * Player.FIELD_SIZE
+                                       | COLUMN_MASKS[cell % Player.FIELD_SIZE]) & ~BITS[cell])
+NEAR_MASKS = lazy_table(lambda cell: mask_of(NEAR_CELLS[cell]))
+
+
+#
+# 艦がマスoldからnewに移った時に，攻撃できなくなるマスと攻撃できるようになるマスのリストの組を返す．
+# -1はフィールド外(艦を失った場合など)を表す．
+#
+def attack_diff(old, new):
+    before = ATTACK_CELLS[old] if old >= 0 else []
+    after = ATTACK_CELLS[new] if new >= 0 else []
+    return [c for c in before if c not in after], [c for c in after if c not in before]
+
+
+# ATTACK_DIFFS[old][new]で引く表である．
+ATTACK_DIFFS = lazy_table(lambda old: LazyTable(lambda new: attack_diff(old, new)),
+                          lambda: list(field_cells()) + [-1])
+
+# 艦種の順番である．整数で表した移動の行動の艦の番号はこの順である．
+SHIP_TYPES = list(PlayerShip.MAX_HPS)
+
+# 既定の規則である．
+DEFAULT_FIELD_SIZE = Player.FIELD_SIZE
+DEFAULT_MAX_HPS = dict(PlayerShip.MAX_HPS)
+
+# configureの後に呼ぶ関数の一覧である．盤面の大きさから表を作るモジュールが登録する．
+ON_CONFIGURE = []
+
+
+#
+# 盤面の大きさと艦隊(艦種ごとの最大HP)を変える．プロセス内のすべての対戦に効くので，プレイヤーを作る前に呼ぶ．
+# 表は作り直し，Player.FIELD_SIZE，PlayerShip.MAX_HPS，SHIP_TYPESは同じオブジェクトのまま書き換えるので，
+# 他のモジュールがインポートした名前もそのまま使える．引数を省くと既定の規則に戻る．
+#
+def configure(size=DEFAULT_FIELD_SIZE, max_hps=None):
+    max_hps = dict(DEFAULT_MAX_HPS if max_hps is None else max_hps)
+    if size < 2:
+        raise ValueError('field size must be at least 2')
+    if not max_hps or len(max_hps) > size * size:
+        raise ValueError('fleet does not fit in the field')
+    if any(hp < 1 for hp in max_hps.values()):
+        raise ValueError('ship hp must be positive')
+    Player.FIELD_SIZE = size
+    PlayerShip.MAX_HPS.clear()
+    PlayerShip.MAX_HPS.update(max_hps)
+    SHIP_TYPES[:] = list(max_hps)
+    for table, domain in TABLES:
+        fill(table, domain)
+    for hook in ON_CONFIGURE:
+        hook()
+
+
+# 今の規則が既定の規則かどうかを返す．既定の規則でしか使えない実装が確かめるのに使う．
+def default_rules():
+    return Player.FIELD_SIZE == DEFAULT_FIELD_SIZE and SHIP_TYPES == list(DEFAULT_MAX_HPS) \
+        and PlayerShip.MAX_HPS == DEFAULT_MAX_HPS
+
+
 if __name__ == '__main__':
     import unittest
 
@@ -173,6 +744,9 @@ if __name__ == '__main__':
             p.update(json_)
             self.assertEqual(2, p.ships["w"].hp)
             self.assertEqual([0, 4], p.ships["c"].position)
+            p.update({"condition": {"me": {"w": {"hp": 1, "position": [0, 0]}}}})
+            self.assertEqual(1, p.ships["w"].hp)
+            self.assertEqual(["w"], list(p.ships))
 
         def test_move(self):
             p = Player({"w": [0, 0], "c": [0, 1], "s": [1, 0]})
@@ -198,4 +772,128 @@ if __name__ == '__main__':
             self.assertEqual(False, Player.in_field([5, 5]))
             self.assertEqual(False, Player.in_field([-1, 0]))
 
+        def test_masks(self):
+            p = Player({"w": [0, 0], "c": [0, 1], "s": [4, 4]})
+            self.assertEqual(1 | 1 << 1 | 1 << 24, p.occupied())
+            self.assertEqual([0, 1, 2, 5, 6, 7, 18, 19, 23, 24], list(cells(p.attack_mask())))
+            self.assertEqual(True, p.can_attack([3, 3]))
+            self.assertEqual(False, p.can_attack([2, 2]))
+            self.assertEqual(False, p.can_attack([5, 4]))
+            self.assertEqual([1, 5, 6], list(cells(NEAR_MASKS[0])))
+            self.assertEqual([1, 2, 3, 4, 5, 10, 15, 20], list(cells(REACH_MASKS[0])))
+            self.assertEqual([2, 3, 4, 5, 10, 15, 20], list(cells(p.move_mask(p.ships["w"]))))
+            p.update({"condition": {"me": {"w": {"hp": 3, "position": [2, 2]}}}})
+            self.assertEqual(1 << 12, p.occupied())
+            self.assertEqual(None, p.overlap([0, 1]))
+            self.assertEqual(p.ships["w"], p.overlap([2, 2]))
+
+        # 差分で更新した行動の集合が，ビットマスクから作り直したものと一致することを確かめる．
+        def assert_actions(self, p):
+            n = Player.FIELD_SIZE * Player.FIELD_SIZE
+            expected = list(cells(p.attack_mask()))
+            for k, ship_type in enumerate(SHIP_TYPES):
+                if ship_type in p.ships:
+                    expected += [n + k * n + c for c in cells(p.move_mask(p.ships[ship_type]))]
+            self.assertEqual(expected, p.legal_actions())
+
+        def test_legal_actions(self):
+            import random
+            rng = random.Random(0)
+            p = Player({"w": [0, 0], "c": [0, 1], "s": [1, 0]})
+            self.assert_actions(p)
+            self.assertEqual(8 + 6 + 7 + 7, len(p.legal_actions()))
+            for _ in range(200):
+                action = p.random_action(rng.random)
+                self.assertIn(action, p.legal_actions())
+                p.act(action)
+                self.assert_actions(p)
+            # 通知による移動と艦の喪失でも更新される．
+            p.update({"condition": {"me": {"w": {"hp": 3, "position": [2, 2]},
+                                           "s": {"hp": 1, "position": [2, 3]}}}})
+            self.assert_actions(p)
+            self.assertEqual(['w', 's'], list(p.moves))
+            p.update({"condition": {"me": {"s": {"hp": 1, "position": [2, 2]}}}})
+            self.assert_actions(p)
+            self.assertEqual({"move": {"ship": "s", "to": [4, 2]}}, p.act(25 + 2 * 25 + 22))
+
+        def test_random_action(self):
+            # すべての行動がほぼ同じ回数だけ選ばれる．
+            import collections
+            import random
+            rng = random.Random(1)
+            p = Player({"w": [0, 0], "c": [0, 1], "s": [4, 4]})
+            counts = collections.Counter(p.random_action(rng.random) for _ in range(30000))
+            self.assertEqual(set(p.legal_actions()), set(counts))
+            mean = 30000 / len(counts)
+            self.assertTrue(all(abs(count - mean) < mean * 0.2 for count in counts.values()))
+
+        def test_slots(self):
+            p = Player({"w": [0, 0], "c": [0, 1], "s": [1, 0]})
+            with self.assertRaises(AttributeError):
+                p.ships["w"].speed = 1
+            with self.assertRaises(AttributeError):
+                p.speed = 1
+
+        def test_make_unmake(self):
+            import random
+            rng = random.Random(2)
+            p = Player({"w": [0, 0], "c": [0, 1], "s": [1, 0]})
+            for _ in range(300):
+                state = p.snapshot()
+                actions = p.legal_actions()
+                n = Player.FIELD_SIZE * Player.FIELD_SIZE
+                action = p.random_action(rng.random)
+                if action >= n:
+                    k, to = divmod(action - n, n)
+                    old = p.make_move(SHIP_TYPES[k], to)
+                    self.assert_actions(p)
+                    p.unmake_move(SHIP_TYPES[k], old)
+                cell = rng.randrange(n)
+                i = p.make_attacked(cell)
+                self.assert_actions(p)
+                p.unmake_attacked(cell, i)
+                self.assertEqual(state, p.snapshot())
+                self.assertEqual(actions, p.legal_actions())
+                # 戻さずに進めることもある．艦がなくなったら最初からやり直す．
+                p.act(action)
+                if not p.ships:
+                    p = Player({"w": [0, 0], "c": [0, 1], "s": [1, 0]})
+
+        def test_snapshot(self):
+            p = Player({"w": [0, 0], "c": [0, 1], "s": [1, 0]})
+            state = p.snapshot()
+            self.assertEqual((0, 3, 1, 2, 5, 1), state)
+            actions = p.legal_actions()
+            p.make_attacked(5)
+            p.make_attacked(1)
+            p.make_attacked(1)
+            p.make_move('w', 12)
+            self.assertEqual((12, 3, -1, 0, -1, 0), p.snapshot())
+            self.assertEqual(['w'], list(p.ships))
+            p.restore(state)
+            self.assertEqual(state, p.snapshot())
+            self.assertEqual(['w', 'c', 's'], list(p.ships))
+            self.assertEqual([0, 1], p.ships['c'].position)
+            self.assertEqual(actions, p.legal_actions())
+            self.assert_actions(p)
+            # update(JSON)で失った艦も戻せる．
+            p.update({"condition": {"me": {"c": {"hp": 1, "position": [0, 4]}}}})
+            p.restore(state)
+            self.assertEqual(actions, p.legal_actions())
+
+    class CellSetTest(unittest.TestCase):
+
+        def test_set(self):
+            s = CellSet([3, 5, 7])
+            s.add(5)
+            s.discard(3)
+            s.discard(9)
+            self.assertEqual([5, 7], sorted(s))
+            self.assertEqual(2, len(s))
+            self.assertIn(7, s)
+            self.assertNotIn(3, s)
+            s.discard(7)
+            s.discard(5)
+            self.assertEqual([], list(s))
+
     unittest.main()
@@ -0,0 +1,361 @@
+import collections
+import mmap
+import operator
+import os
+import struct
+import sys
+import time
+
+sys.path.append(os.getcwd())
+
+from lib.histogram import Histogram
+from lib.player_base import SHIP_TYPES, Player, default_rules
+
+
+#
+# SearchPlayerの行動の選択を記憶するキャッシュである．探索は1手に数ミリ秒から数十ミリ秒かかるので，
+# 状態を作って正規化する数十マイクロ秒を払っても，わずかなヒット率で元が取れる．
+#
+# 状態はマスごとの4つの層と，相手の艦のHPを並べたバイト列である．
+# 1つ目の層は自分の艦(艦種とHP)，残りは相手の艦種ごとの予測をLEVELS段階に丸めたものである．
+# 座標が分かっている艦はそのマスだけLEVELS，沈んだ艦はすべて0にする．探索は予測から配置の標本を取るので，
+# 丸めた予測が同じ状態では同じくらい良い行動を選ぶ．
+# 正方形の8つの対称変換(回転と鏡映)で移り合う状態は同じ選択になるので，8通りのうち最小のものを正規形として記憶する．
+# 値は正規形での行動(SearchPlayerと同じ整数)で，元の向きに戻して返す．
+#
+# メモリ上の表はLRUで大きさを制限する．saveで正規形の状態を並べたファイルに書き出すと，
+# 他のプロセスはそのファイルをmmapして，メモリ上の表になければ二分探索で引く．ファイルは読むだけなので共有できる．
+# 探索の設定(時間の予算や模擬の回数)が違うプレイヤーの間では共有しない．
+#
+
+N = Player.FIELD_SIZE * Player.FIELD_SIZE
+# 予測を丸める段階の数である．
+LEVELS = 8
+LAYERS = 1 + len(SHIP_TYPES)
+
+# ファイルの1件である．正規形の状態と，行動．
+KEY_SIZE = LAYERS * N + len(SHIP_TYPES)
+ENTRY = struct.Struct('<%dsI' % KEY_SIZE)
+
+# メモリ上の表の大きさの既定値である．
+CAPACITY = 1 << 16
+
+
+# 8つの対称変換を，変換後のマスから変換前のマスを引く表として作る．
+def build_symmetries(size):
+    symmetries = []
+    for transform in [lambda x, y: (x, y), lambda x, y: (y, size - 1 - x),
+                      lambda x, y: (size - 1 - x, size - 1 - y), lambda x, y: (size - 1 - y, x),
+                      lambda x, y: (y, x), lambda x, y: (size - 1 - x, y),
+                      lambda x, y: (size - 1 - y, size - 1 - x), lambda x, y: (x, size - 1 - y)]:
+        perm = [0] * (size * size)
+        for x in range(size):
+            for y in range(size):
+                tx, ty = transform(x, y)
+                perm[tx * size + ty] = x * size + y
+        symmetries.append(perm)
+    return symmetries
+
+
+SYMMETRIES = build_symmetries(Player.FIELD_SIZE)
+# 変換前のマスから変換後のマスを引く表である．
+INVERSES = [[perm.index(cell) for cell in range(N)] for perm in SYMMETRIES]
+# 層ごとの並べ替えをC言語の速さで行うため，itemgetterにしておく．
+GETTERS = [operator.itemgetter(*[layer * N + cell for layer in range(LAYERS) for cell in perm])
+           for perm in SYMMETRIES]
+
+
+# 状態の層の8通りの変換のうち最小のものに相手の艦のHPを付けたキーと，その変換の番号を返す．
+def canonical(layers, hps):
+    best = bytes(GETTERS[0](layers))
+    k = 0
+    for i in range(1, 8):
+        t = bytes(GETTERS[i](layers))
+        if t < best:
+            best = t
+            k = i
+    return best + hps, k
+
+
+# SearchPlayerのplayerから状態の層と相手の艦のHPを作る．
+def state_of(player):
+    layers = [0] * (LAYERS * N)
+    for k, ship_type in enumerate(SHIP_TYPES):
+        ship = player.ships.get(ship_type)
+        if ship is not None:
+            layers[ship.cell] = k * 4 + ship.hp
+    for k, ship_type in enumerate(SHIP_TYPES):
+        offset = (k + 1) * N
+        if ship_type not in player.enemy_hps:
+            continue
+        if ship_type in player.known:
+            layers[offset + player.known[ship_type]] = LEVELS
+            continue
+        cell = offset
+        for row in player.belief.prediction(ship_type):
+            for p in row:
+                layers[cell] = min(LEVELS, int(p * LEVELS + 0.5))
+                cell += 1
+    return layers, bytes(player.enemy_hps.get(ship_type, 0) for ship_type in SHIP_TYPES)
+
+
+# 行動の中のマスをpermで移す．permは変換後のマスから変換前のマスを引く表か，その逆である．
+def transform(action, perm):
+    if action < N:
+        return perm[action]
+    k, to = divmod(action - N, N)
+    return N + k * N + perm[to]
+
+
+class PolicyCache:
+
+    # pathを与えると，saveで書き出したファイルを読み取り専用で開く．対称変換の表は既定の盤面で作るので，既定の規則でだけ使える．
+    def __init__(self, capacity=CAPACITY, path=None):
+        if not default_rules():
+            raise ValueError('PolicyCache supports only the default field and fleet')
+        self.capacity = capacity
+        self.table = collections.OrderedDict()
+        self.path = path
+        self.file = None
+        self.data = b''
+        if path is not None and os.path.exists(path) and os.path.getsize(path) > 0:
+            self.file = open(path, 'rb')
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.hits = 0
+        self.file_hits = 0
+        self.misses = 0
+        # 探索を除いた1回あたりの時間(マイクロ秒)と，外れた時の探索の時間(ミリ秒)である．
+        self.latency = Histogram()
+        self.search_time = Histogram()
+
+    def __len__(self):
+        return len(self.data) // ENTRY.size
+
+    # ファイルのi番目の正規形の状態のバイト列である．
+    def file_key(self, i):
+        offset = i * ENTRY.size
+        return self.data[offset:offset + KEY_SIZE]
+
+    # ファイルを二分探索する．なければNoneを返す．
+    def lookup_file(self, key):
+        n = len(self)
+        if n == 0:
+            return None
+        lo, hi = 0, n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.file_key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < n and self.file_key(lo) == key:
+            return ENTRY.unpack_from(self.data, lo * ENTRY.size)[-1]
+        return None
+
+    # メモリ上の表に加える．大きさを超えたら最も長く使われていないものを捨てる．
+    def put(self, key, value):
+        self.table[key] = value
+        if len(self.table) > self.capacity:
+            self.table.popitem(last=False)
+
+    # 正規形の状態に対する行動を返す．メモリ上の表にもファイルにもなければNoneを返す．
+    def get(self, key):
+        value = self.table.get(key)
+        if value is not None:
+            self.table.move_to_end(key)
+            self.hits += 1
+            return value
+        value = self.lookup_file(key)
+        if value is not None:
+            self.file_hits += 1
+            self.put(key, value)
+        else:
+            self.misses += 1
+        return value
+
+    # SearchPlayerのplayerの行動を返す．表になければplayer.search()で探索して記憶する．
+    def action(self, player):
+        start = time.perf_counter()
+        key, k = canonical(*state_of(player))
+        # 同じゲームで前に見た状態では探索し直す．同じ行動を繰り返して堂々巡りになるのを避けるためである．
+        if key in player.visited:
+            self.misses += 1
+            value = None
+        else:
+            player.visited.add(key)
+            value = self.get(key)
+        if value is None:
+            searched = time.perf_counter()
+            value = transform(player.search(), INVERSES[k])
+            # 先読みで打ち切った探索の行動は記憶しない．
+            interrupt = getattr(player, 'interrupt', None)
+            if interrupt is None or not interrupt.is_set():
+                self.put(key, value)
+            elapsed = time.perf_counter() - searched
+            self.search_time.record(elapsed * 1e3)
+            start += elapsed
+        action = transform(value, SYMMETRIES[k])
+        self.latency.record((time.perf_counter() - start) * 1e6)
+        return action
+
+    def hit_rate(self):
+        lookups = self.hits + self.file_hits + self.misses
+        return (self.hits + self.file_hits) / lookups if lookups else 0.0
+
+    # 件数，ヒット率，1回あたりの時間，外れた時の探索の時間を連想配列で返す．
+    def stats(self):
+        return {
+            "lookups": self.hits + self.file_hits + self.misses,
+            "hits": self.hits,
+            "file_hits": self.file_hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate(),
+            "entries": len(self.table),
+            "file_entries": len(self),
+            "latency_us": self.latency.summary(),
+            "search_ms": self.search_time.summary(),
+        }
+
+    #
+    # メモリ上の表とファイルの内容を合わせ，正規形の状態の順に並べてpathに書き出す．
+    # 一時ファイルに書いてから置き換えるので，読んでいる他のプロセスは古いファイルをそのまま使える．
+    #
+    def save(self, path=None):
+        path = path or self.path
+        entries = {}
+        for i in range(len(self)):
+            key, value = ENTRY.unpack_from(self.data, i * ENTRY.size)
+            entries[key] = value
+        entries.update(self.table)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            for key in sorted(entries):
+                f.write(ENTRY.pack(key, entries[key]))
+        os.replace(tmp, path)
+
+    def close(self):
+        if self.file is not None:
+            self.data.close()
+            self.file.close()
+            self.file = None
+            self.data = b''
+
+
+# 同じプロセスの中では，同じファイルのキャッシュを1つだけ作って共有する．
+SHARED = {}
+
+
+def shared(path, capacity=CAPACITY):
+    if path not in SHARED:
+        SHARED[path] = PolicyCache(capacity, path)
+    return SHARED[path]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'test':
+        import tempfile
+        import unittest
+
+        from lib.engine import play
+        from players.random_player import RandomPlayer
+        from players.search_player import SearchPlayer
+
+        class PolicyCacheTest(unittest.TestCase):
+
+            def test_symmetries(self):
+                self.assertEqual(8, len({tuple(perm) for perm in SYMMETRIES}))
+                for perm, inverse in zip(SYMMETRIES, INVERSES):
+                    self.assertEqual(list(range(N)), sorted(perm))
+                    self.assertEqual(list(range(N)), [perm[c] for c in inverse])
+                layers = [i % 7 for i in range(LAYERS * N)]
+                keys = {canonical(GETTERS[k](layers), b'\x01')[0] for k in range(8)}
+                self.assertEqual(1, len(keys))
+
+            def test_transform(self):
+                for k in range(8):
+                    for action in range(N + len(SHIP_TYPES) * N):
+                        self.assertEqual(action, transform(transform(action, INVERSES[k]), SYMMETRIES[k]))
+
+            def test_action(self):
+                # 回転した配置のプレイヤーは，記憶した行動を回転して使う．
+                cache = PolicyCache()
+                a = SearchPlayer(0, budget=None, max_playouts=64, policy_cache=cache)
+                b = SearchPlayer(1, budget=None, max_playouts=64, policy_cache=cache)
+                for ship in b.ships.values():
+                    ship.place(-1)
+                for ship_type, ship in a.ships.items():
+                    b.ships[ship_type].place(INVERSES[1][ship.cell])
+                action = cache.action(a)
+                self.assertEqual(transform(action, INVERSES[1]), cache.action(b))
+                self.assertEqual((1, 1), (cache.hits, cache.misses))
+                # 同じゲームで前に見た状態では探索し直す．
+                cache.action(a)
+                self.assertEqual((1, 2), (cache.hits, cache.misses))
+
+            def test_lru(self):
+                cache = PolicyCache(capacity=2)
+                for key in [b'1', b'2', b'1', b'3']:
+                    if cache.get(key) is None:
+                        cache.put(key, 0)
+                self.assertEqual([b'1', b'3'], list(cache.table))
+
+            def test_games(self):
+                # 同じシードの対戦を繰り返すと，少なくとも最初の手は記憶した行動を使う．
+                cache = PolicyCache()
+                for seed in [0, 1, 2, 0, 1, 2]:
+                    winner, turns = play(SearchPlayer(seed, budget=None, max_playouts=32, policy_cache=cache),
+                                         SearchPlayer(seed + 100, budget=None, max_playouts=32, policy_cache=cache),
+                                         60)
+                    self.assertTrue(turns > 0)
+                self.assertTrue(cache.hits > 0)
+
+            def test_save(self):
+                cache = PolicyCache()
+                for seed in range(3):
+                    play(SearchPlayer(seed, budget=None, max_playouts=32, policy_cache=cache),
+                         RandomPlayer(seed + 100), 60)
+                with tempfile.TemporaryDirectory() as path:
+                    path = os.path.join(path, 'policy.bin')
+                    cache.save(path)
+                    shared_cache = PolicyCache(capacity=1, path=path)
+                    self.assertEqual(len(cache.table), len(shared_cache))
+                    for key, value in cache.table.items():
+                        self.assertEqual(value, shared_cache.lookup_file(key))
+                    play(SearchPlayer(0, budget=None, max_playouts=32, policy_cache=shared_cache),
+                         RandomPlayer(100), 60)
+                    self.assertTrue(shared_cache.file_hits > 0)
+                    shared_cache.close()
+
+        unittest.main(argv=sys.argv[:1])
+    else:
+        import argparse
+        import json
+
+        from lib.engine import play
+        from players.search_player import SearchPlayer
+
+        parser = argparse.ArgumentParser(description="Measure the policy cache in SearchPlayer self-play")
+        parser.add_argument("--games", type=int, default=100, help="Number of games")
+        parser.add_argument("--playouts", type=int, default=200, help="Playouts per move")
+        parser.add_argument("--max-turns", type=int, default=300, help="Turns per game")
+        parser.add_argument("--path", type=str, default=None, help="Cache file to read and update")
+        parser.add_argument("--capacity", type=int, default=CAPACITY, help="Entries kept in memory")
+        args = parser.parse_args()
+
+        cache = PolicyCache(args.capacity, args.path)
+        start = time.perf_counter()
+        for seed in range(args.games):
+            play(SearchPlayer(seed, budget=None, max_playouts=args.playouts, policy_cache=cache),
+                 SearchPlayer(seed + args.games, budget=None, max_playouts=args.playouts, policy_cache=cache),
+                 args.max_turns)
+        elapsed = time.perf_counter() - start
+        stats = cache.stats()
+        print(json.dumps({key: stats[key] for key in stats if key not in ("latency_us", "search_ms")}))
+        print(f"lookup: mean {stats['latency_us']['mean']:.1f} us, p99 {stats['latency_us']['p99']:.1f} us")
+        # 1手あたりの時間を，すべて探索した場合(外れた時の探索の平均)と比べる．
+        per_move = (cache.latency.total / 1e3 + cache.search_time.total) / stats['lookups']
+        print(f"search on miss: mean {stats['search_ms']['mean']:.2f} ms, "
+              f"per move with cache: {per_move:.2f} ms")
+        print(f"{args.games} games in {elapsed:.1f}s")
+        if args.path:
+            cache.save()
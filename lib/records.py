@@ -0,0 +1,476 @@
+import mmap
+import os
+import struct
+import sys
+
+sys.path.append(os.getcwd())
+
+from lib.belief import SHIP_TYPES
+from lib.engine import Server
+from lib.player_base import Player, default_rules
+
+
+#
+# 対戦の記録を固定長のバイナリで保存し，mmapで読み出すモジュールである．
+# 記録はディレクトリに置き，対戦の本体はチャンクファイル(chunk-00000.rec, ...)に追記し，
+# 各対戦の位置をindex.recに追記する．チャンクが一定の大きさを超えたら次のチャンクに移る．
+# ファイルは追記するだけなので，書き込み中でも書き終えた対戦は読み出せる．
+#
+# チャンクの中の1つの対戦は，GAMEの見出しの後にターン数だけTURNが並んだものである．
+#   GAME: meta(任意の整数，シードなど)，ターン数，勝者(-1は引き分け)，両プレイヤーのw, c, sの初期座標．
+#   TURN: 行動(0〜2はw, c, sの移動，3は攻撃)，行動の座標，攻撃で命中した艦(なければ255)，
+#         周囲1マスにいた艦のビット，移動の距離，フラグ．
+#   フラグは，1のビットが不正な行動，2のビットが行動したプレイヤーの勝ち，4のビットが負けを表す．
+#   形式の正しくない行動(知らない艦種，-128から127に入らない座標など)は，行動を255，座標を0にして不正な行動として記録する．
+# 見出しは3隻の艦を前提にしているので，既定の規則でだけ記録できる．
+#
+
+MAGIC = b'SGR1'
+HEADER = struct.Struct('<4s')
+GAME = struct.Struct('<QIb12b')
+TURN = struct.Struct('<BbbBBbbB')
+INDEX = struct.Struct('<IQIb')
+
+ATTACK = 3
+NONE = 255
+INVALID, WIN, LOSE = 1, 2, 4
+
+# チャンクの大きさの既定値である．
+CHUNK_SIZE = 64 << 20
+
+
+# チャンクと索引のファイル名である．
+def chunk_path(path, chunk):
+    return os.path.join(path, 'chunk-%05d.rec' % chunk)
+
+
+def index_path(path):
+    return os.path.join(path, 'index.rec')
+
+
+# 初期配置の連想配列2つを12個の整数にする．
+def pack_positions(positions1, positions2):
+    values = []
+    for positions in [positions1, positions2]:
+        for ship_type in SHIP_TYPES:
+            values += positions[ship_type]
+    return values
+
+
+#
+# 行動の連想配列を(行動, x, y)にする．TURNに収まらない，または形式の正しくない行動ならNoneを返す．
+# クライアントから届いた値をそのまま添字にしたりpackしたりしないように，先に型と範囲を調べる．
+#
+def pack_action(act):
+    if not isinstance(act, dict):
+        return None
+    if "attack" in act:
+        action = ATTACK
+        body = act["attack"]
+    elif "move" in act:
+        body = act["move"]
+        ship = body.get("ship") if isinstance(body, dict) else None
+        if not isinstance(ship, str) or ship not in SHIP_TYPES:
+            return None
+        action = SHIP_TYPES.index(ship)
+    else:
+        return None
+    to = body.get("to") if isinstance(body, dict) else None
+    if not isinstance(to, list) or len(to) != 2 \
+            or not all(type(v) is int and -128 <= v <= 127 for v in to):
+        return None
+    return action, to[0], to[1]
+
+
+#
+# 1回の対戦の記録である．RecordWriter.startで作り，ターンごとにturnを呼び，finishで書き込む．
+# ターンの記録は書き込むまでメモリに溜めておくので，同時に進む対戦が混ざることはない．
+#
+class GameRecord:
+
+    def __init__(self, writer, positions1, positions2, meta=0):
+        self.writer = writer
+        self.positions = pack_positions(positions1, positions2)
+        self.meta = meta
+        self.turns = 0
+        self.data = bytearray()
+
+    #
+    # 1ターンを記録する．cは行動プレイヤー，actは行動，resultsはlib.engine.Server.actionの返り値である．
+    # 攻撃の結果は行動プレイヤー宛，移動の結果は待機プレイヤー宛の通知に入っている．
+    #
+    def turn(self, c, act, results):
+        dx = dy = 0
+        hit = NONE
+        near = flags = 0
+        packed = pack_action(act)
+        if packed is None:
+            action, x, y = NONE, 0, 0
+            flags |= INVALID
+        elif packed[0] == ATTACK:
+            action, x, y = packed
+            attacked = results[0].get("result", {}).get("attacked")
+            if attacked:
+                if "hit" in attacked:
+                    hit = SHIP_TYPES.index(attacked["hit"])
+                for ship_type in attacked["near"]:
+                    near |= 1 << SHIP_TYPES.index(ship_type)
+            else:
+                flags |= INVALID
+        else:
+            action, x, y = packed
+            moved = results[1].get("result", {}).get("moved")
+            if moved:
+                dx, dy = moved["distance"]
+            else:
+                flags |= INVALID
+        if "outcome" in results[0]:
+            flags |= WIN if results[0]["outcome"] else LOSE
+        self.data += TURN.pack(action, x, y, hit, near, dx, dy, flags)
+        self.turns += 1
+
+    # 勝者(-1は引き分け)を与えて書き込む．
+    def finish(self, winner):
+        self.writer.append(self, winner)
+
+
+#
+# 記録を追記するクラスである．既存のディレクトリを与えると，その続きに追記する．
+# chunk_sizeはチャンクを切り替える大きさ(バイト)である．
+#
+class RecordWriter:
+
+    def __init__(self, path, chunk_size=CHUNK_SIZE):
+        self.path = path
+        self.chunk_size = chunk_size
+        os.makedirs(path, exist_ok=True)
+        self.index = open(index_path(path), 'ab')
+        # 最後のチャンクの続きから書く．索引に載っていない書きかけの対戦は上書きされる．
+        self.chunk = 0
+        size = self.index.tell()
+        self.games = size // INDEX.size
+        if self.games:
+            with open(index_path(path), 'rb') as f:
+                f.seek((self.games - 1) * INDEX.size)
+                chunk, offset, turns, _ = INDEX.unpack(f.read(INDEX.size))
+            self.chunk = chunk
+            self.offset = offset + GAME.size + turns * TURN.size
+        else:
+            self.offset = HEADER.size
+        self.open_chunk()
+
+    def open_chunk(self):
+        path = chunk_path(self.path, self.chunk)
+        self.file = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+        if self.offset == HEADER.size:
+            self.file.write(HEADER.pack(MAGIC))
+        self.file.seek(self.offset)
+        self.file.truncate()
+
+    def start(self, positions1, positions2, meta=0):
+        if not default_rules():
+            raise ValueError('game records support only the default field and fleet')
+        return GameRecord(self, positions1, positions2, meta)
+
+    # 対戦を書き込む．チャンクに書いてから索引に書くので，索引にある対戦は必ず読める．
+    def append(self, record, winner):
+        if self.offset > HEADER.size and self.offset + GAME.size + len(record.data) > self.chunk_size:
+            self.file.close()
+            self.chunk += 1
+            self.offset = HEADER.size
+            self.open_chunk()
+        self.file.write(GAME.pack(record.meta, record.turns, winner, *record.positions))
+        self.file.write(record.data)
+        self.file.flush()
+        self.index.write(INDEX.pack(self.chunk, self.offset, record.turns, winner))
+        self.index.flush()
+        self.offset += GAME.size + len(record.data)
+        self.games += 1
+
+    def close(self):
+        self.file.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+#
+# 記録から読み出した1回の対戦である．ターンの記録はmmapから切り出したバイト列のままで，読むまで解釈しない．
+#
+class Game:
+
+    def __init__(self, number, meta, winner, positions, data):
+        self.number = number
+        self.meta = meta
+        self.winner = winner
+        self.positions = positions
+        self.data = data
+
+    def __len__(self):
+        return len(self.data) // TURN.size
+
+    # t番目のターンの(行動プレイヤー, 行動の連想配列, 記録の組)を返す．
+    def turn(self, t):
+        fields = TURN.unpack_from(self.data, t * TURN.size)
+        return t % 2, action_dict(*fields[:3]), fields
+
+    def __iter__(self):
+        for t, fields in enumerate(TURN.iter_unpack(self.data)):
+            yield t % 2, action_dict(*fields[:3]), fields
+
+    # 行動の連想配列を順に返す．
+    def actions(self):
+        return [act for _, act, _ in self]
+
+
+# 記録の行動を，Player.moveやPlayer.attackと同じ形の連想配列にする．形式の正しくない行動は空の連想配列にする．
+def action_dict(action, x, y):
+    if action == NONE:
+        return {}
+    if action == ATTACK:
+        return {"attack": {"to": [x, y]}}
+    return {"move": {"ship": SHIP_TYPES[action], "to": [x, y]}}
+
+
+#
+# 記録をmmapで読み出すクラスである．len(reader)で対戦数，reader[i]でi番目の対戦を返す．
+# チャンクは必要になった時にだけmmapする．
+#
+class RecordReader:
+
+    def __init__(self, path):
+        self.path = path
+        self.files = []
+        self.maps = {}
+        self.index = self.map(index_path(path))
+
+    def map(self, path):
+        f = open(path, 'rb')
+        self.files.append(f)
+        if os.fstat(f.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def chunk(self, chunk):
+        if chunk not in self.maps:
+            data = self.map(chunk_path(self.path, chunk))
+            if data[:HEADER.size] != MAGIC:
+                raise ValueError('not a game record: %s' % chunk_path(self.path, chunk))
+            self.maps[chunk] = data
+        return self.maps[chunk]
+
+    def __len__(self):
+        return len(self.index) // INDEX.size
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('game index out of range')
+        chunk, offset, turns, _ = INDEX.unpack_from(self.index, i * INDEX.size)
+        data = self.chunk(chunk)
+        header = GAME.unpack_from(data, offset)
+        meta, _, winner = header[:3]
+        values = header[3:]
+        positions = [{ship_type: [values[p * 6 + j * 2], values[p * 6 + j * 2 + 1]]
+                      for j, ship_type in enumerate(SHIP_TYPES)} for p in range(2)]
+        start = offset + GAME.size
+        return Game(i, meta, winner, positions, data[start:start + turns * TURN.size])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    # 索引だけを読んで，(ターン数, 勝者)を順に返す．対戦の本体は読まない．
+    def summaries(self):
+        for _, _, turns, winner in INDEX.iter_unpack(self.index):
+            yield turns, winner
+
+    def close(self):
+        for data in self.maps.values():
+            data.close()
+        if isinstance(self.index, mmap.mmap):
+            self.index.close()
+        for f in self.files:
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+#
+# 記録をlib.engine.Serverで最初のturnsターンだけ再生し，その時点の両プレイヤーの状態を返す．
+# playersを与えると，そのプレイヤー(例えば同じシードのAIPlayer)に通知を渡して内部の状態を再現する．
+# 与えなければ初期配置からPlayerを作る．記録の結果と再生した結果が違う場合は例外を送出する．
+#
+def replay(game, turns=None, players=None):
+    server = Server(*game.positions)
+    if players is None:
+        players = [Player(positions) for positions in game.positions]
+    for t, (c, act, fields) in enumerate(game):
+        if turns is not None and t >= turns:
+            break
+        results = server.action(c, act)
+        expected = GameRecord(None, *game.positions)
+        expected.turn(c, act, results)
+        if bytes(expected.data) != TURN.pack(*fields):
+            raise ValueError('record does not match the rules at turn %d' % t)
+        players[c].update(results[0], True)
+        players[1 - c].update(results[1], False)
+    return players
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'test':
+        import json
+        import tempfile
+        import unittest
+
+        from lib.engine import play
+        from players.ai_player import AIPlayer
+        from players.random_player import RandomPlayer
+
+        class RecordsTest(unittest.TestCase):
+
+            def record(self, path, seeds, chunk_size=CHUNK_SIZE):
+                results = []
+                with RecordWriter(path, chunk_size) as writer:
+                    for seed in seeds:
+                        results.append(play(AIPlayer(seed), RandomPlayer(seed + 100), 300,
+                                            recorder=writer, meta=seed))
+                return results
+
+            def test_round_trip(self):
+                with tempfile.TemporaryDirectory() as path:
+                    results = self.record(path, range(10), chunk_size=4096)
+                    # 続きに追記できる．
+                    results += self.record(path, range(10, 15), chunk_size=4096)
+                    self.assertTrue(os.path.exists(chunk_path(path, 1)))
+                    with RecordReader(path) as reader:
+                        self.assertEqual(15, len(reader))
+                        self.assertEqual([(t, w) for w, t in results], list(reader.summaries()))
+                        for seed, game in enumerate(reader):
+                            self.assertEqual(seed, game.meta)
+                            self.assertEqual(results[seed], (game.winner, len(game)))
+                            self.assertEqual(json.loads(AIPlayer(seed).initial_condition()),
+                                             game.positions[0])
+                        self.assertEqual(14, reader[-1].meta)
+                        with self.assertRaises(IndexError):
+                            reader[15]
+
+            def test_replay(self):
+                with tempfile.TemporaryDirectory() as path:
+                    self.record(path, [3])
+                    with RecordReader(path) as reader:
+                        game = reader[0]
+                        # 途中の状態を再現する．AIPlayerを与えれば予測も同じになる．
+                        a = AIPlayer(3)
+                        b = RandomPlayer(103)
+                        server = Server(json.loads(a.initial_condition()),
+                                        json.loads(b.initial_condition()))
+                        for t in range(6):
+                            c = t % 2
+                            results = server.action(c, [a, b][c].decide())
+                            a.update(results[c], c == 0)
+                            b.update(results[1 - c], c == 1)
+                        players = replay(game, 6, [AIPlayer(3), RandomPlayer(103)])
+                        self.assertEqual(a.pred_w, players[0].pred_w)
+                        for mine, theirs in zip([a, b], players):
+                            self.assertEqual({t: (s.hp, s.position) for t, s in mine.ships.items()},
+                                             {t: (s.hp, s.position) for t, s in theirs.ships.items()})
+                        self.assertEqual(0, game.winner)
+                        self.assertEqual({}, replay(game)[1].ships)
+
+            # 形式の正しくない行動は，値を使わずに不正な行動として記録し，再生すると同じく負けになる．
+            def test_invalid(self):
+                positions = [json.loads(AIPlayer(seed).initial_condition()) for seed in (1, 2)]
+                for act in [{"attack": {"to": [300, 0]}}, {"move": {"ship": "x", "to": [0, 0]}},
+                            {"move": {"ship": ["w"], "to": [0, 0]}}, {"attack": {"to": [1]}}, [], {}]:
+                    with tempfile.TemporaryDirectory() as path:
+                        with RecordWriter(path) as writer:
+                            record = writer.start(*positions)
+                            record.turn(0, act, Server(*positions).action(0, {}))
+                            record.finish(1)
+                        with RecordReader(path) as reader:
+                            _, replayed, fields = reader[0].turn(0)
+                            self.assertEqual({}, replayed)
+                            self.assertEqual((NONE, 0, 0), fields[:3])
+                            self.assertEqual(INVALID | LOSE, fields[-1])
+                            replay(reader[0])
+
+            def test_rules(self):
+                from lib.player_base import configure
+
+                configure(7)
+                try:
+                    with tempfile.TemporaryDirectory() as path:
+                        with RecordWriter(path) as writer:
+                            with self.assertRaises(ValueError):
+                                play(AIPlayer(0), RandomPlayer(1), 10, recorder=writer)
+                finally:
+                    configure()
+
+            def test_tampered(self):
+                with tempfile.TemporaryDirectory() as path:
+                    self.record(path, [1])
+                    with open(chunk_path(path, 0), 'r+b') as f:
+                        f.seek(HEADER.size + GAME.size + 3)
+                        f.write(bytes([0]))
+                    with RecordReader(path) as reader:
+                        with self.assertRaises(ValueError):
+                            replay(reader[0])
+
+        unittest.main(argv=sys.argv[:1])
+    else:
+        import argparse
+        import time
+
+        from lib.engine import play
+        from lib.tournament import load_player, player_seeds
+
+        parser = argparse.ArgumentParser(description="Record games and read them back")
+        parser.add_argument("path", metavar="DIR", type=str, help="Record directory")
+        parser.add_argument("--record", type=int, default=0, help="Number of games to append")
+        parser.add_argument("--players", type=str, nargs=2,
+                            default=["players.ai_player:AIPlayer", "players.random_player:RandomPlayer"],
+                            help="Player classes")
+        parser.add_argument("--seed", type=int, default=0, help="First seed")
+        parser.add_argument("--show", type=int, default=None, help="Print the game with this number")
+        parser.add_argument("--turn", type=int, default=None, help="Replay the shown game up to this turn")
+        args = parser.parse_args()
+
+        if args.record:
+            classes = [load_player(spec) for spec in args.players]
+            start = time.perf_counter()
+            with RecordWriter(args.path) as writer:
+                for seed in range(args.seed, args.seed + args.record):
+                    seeds = player_seeds(seed)
+                    play(classes[0](seeds[0]), classes[1](seeds[1]), recorder=writer, meta=seed)
+            print(f"recorded {args.record} games in {time.perf_counter() - start:.1f}s")
+
+        with RecordReader(args.path) as reader:
+            size = sum(os.path.getsize(os.path.join(args.path, name)) for name in os.listdir(args.path))
+            summaries = list(reader.summaries())
+            turns = sum(t for t, _ in summaries)
+            wins = [sum(1 for _, w in summaries if w == winner) for winner in [0, 1, -1]]
+            print(f"{len(reader)} games, {turns} turns, {size} bytes")
+            print(f"player1 {wins[0]}, player2 {wins[1]}, even {wins[2]}")
+
+            if args.show is not None:
+                game = reader[args.show]
+                print(f"game {game.number}: meta {game.meta}, winner {game.winner}, {len(game)} turns")
+                print(f"positions: {game.positions}")
+                for t, (c, act, _) in enumerate(game):
+                    if args.turn is not None and t >= args.turn:
+                        break
+                    print(f"{t} player{c + 1}: {act}")
+                for c, player in enumerate(replay(game, args.turn)):
+                    print(f"player{c + 1}: " + ", ".join(
+                        f"{ship.type} hp {ship.hp} at {ship.position}" for ship in player.ships.values()))
@@ -0,0 +1,340 @@
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+
+from lib.codec import from_dict
+from lib.engine import Client
+from lib.histogram import Histogram
+from lib.player_base import POSITIONS, Player, PlayerShip
+
+
+#
+# 相手のターンの間に，届きうる通知ごとに次の行動を先に決めておくモジュールである．
+# クライアントのmainは"waiting"の後でサーバの通知を待つ間，CPUを使っていない．
+# その間にプレイヤーを複製(Player.clone)し，通知の候補で更新して行動を決めておく．
+# 届いた通知が候補のどれかと同じなら，その複製をプレイヤーとして使い，更新と行動の決定を省く．違えば普通に更新する．
+#
+# 先読みは別のスレッドではなくmainのスレッドで，通知を読む前に行う．候補の更新と決定の間ごとにready()で通知が届いたかを調べ，
+# 届いていたらすぐにやめて通知を読む．スレッドで行うとGILをmainと取り合い，通知が届いてからの処理が遅れるためである．
+# 通知が届いてから先読みをやめるまでの遅れは，調べる間隔(AIPlayerでは更新か決定の1回分)を超えない．
+#
+# 相手の行動の結果は，攻撃ならマスだけで決まる(命中と周囲の艦は自分の艦の配置から分かる)．移動なら艦と距離で決まる．
+# 候補は，自分の前の攻撃が命中した艦の移動，自分の艦に近いマスへの攻撃，残りの艦の移動の順に試す．
+# 5x5なら攻撃が25通り，移動が艦ごとに16通りなので，相手が考えている間にすべて試せることが多い．
+#
+# 1コアのマシンでAIPlayer同士(相手が1手2ミリ秒考える)を測ると，相手の送信から自分の次の更新までの時間は平均で
+# 先読みなし1471マイクロ秒，ありが1475マイクロ秒で，差がなかった．そのためプレイヤーのコマンドライン引数では使えず，
+# lib/client.pyのrunにSpeculatorを渡した場合だけ先読みする．
+#
+
+
+# 先読みは急がない処理なので，調べるたびにCPUを譲る．同じマシンでサーバや相手が動く場合に，その処理を遅らせないためである．
+YIELD = getattr(os, 'sched_yield', lambda: None)
+
+
+# 通知を比べるためのキーである．周囲の艦の順番は問わない．
+def message_key(message):
+    attacked = message.attacked
+    if attacked is not None:
+        position, hit, near = attacked
+        attacked = (tuple(position), hit, frozenset(near))
+    return (frozenset((ship_type, hp, tuple(position)) for ship_type, (hp, position) in message.me.items()),
+            frozenset(message.enemy.items()), message.moved, attacked, message.outcome)
+
+
+#
+# playerに届きうる相手の行動の結果の通知を，試す順に返す．enemyは相手の艦種ごとのHP，chasedは移動しそうな相手の艦である．
+# 自分が負ける攻撃は，その後に行動を決めることがないので含めない．
+#
+def candidates(player, enemy, chased=None):
+    size = Player.FIELD_SIZE
+    ships = list(player.ships.values())
+    condition = {"me": {ship.type: {"hp": ship.hp, "position": list(ship.position)} for ship in ships},
+                 "enemy": {ship_type: {"hp": hp} for ship_type, hp in enemy.items()}}
+
+    def moves(ship_type):
+        for d in range(1, size):
+            for distance in ([d, 0], [-d, 0], [0, d], [0, -d]):
+                yield from_dict({"condition": condition,
+                                 "result": {"moved": {"ship": ship_type, "distance": distance}}})
+
+    if chased in enemy:
+        yield from moves(chased)
+
+    def distance(cell):
+        x, y = divmod(cell, size)
+        return min(max(abs(x - ship.position[0]), abs(y - ship.position[1])) for ship in ships)
+
+    for cell in sorted(range(size * size), key=distance):
+        client = Client({ship.type: ship.position for ship in ships})
+        for ship in ships:
+            client.ships[ship.type].hp = ship.hp
+        info = client.attacked(list(POSITIONS[cell]))
+        if not client.ships:
+            continue
+        yield from_dict({"condition": {"me": client.condition(True), "enemy": condition["enemy"]},
+                         "result": {"attacked": info}})
+
+    for ship_type in enemy:
+        if ship_type != chased:
+            yield from moves(ship_type)
+
+
+#
+# 通知が届いたかを調べるオブジェクトである．SearchPlayerのinterruptとしても使う(is_setが真になったら探索を打ち切る)．
+# readyは通知を読める時に真を返す関数で，Noneなら届かないものとして候補をすべて試す．
+# 一度真になったら真のままである．lateは最後に偽だった時から真になった時までの時間(秒)で，先読みをやめるまでの遅れの上限である．
+#
+class Poll:
+
+    def __init__(self, ready):
+        self.ready = ready
+        self.fired = False
+        self.last = time.perf_counter()
+        self.late = 0.0
+
+    def is_set(self):
+        if not self.fired:
+            YIELD()
+            now = time.perf_counter()
+            if self.ready is not None and self.ready():
+                self.fired = True
+                self.late = now - self.last
+            else:
+                self.last = now
+        return self.fired
+
+
+#
+# 先読みを行うクラスである．mainは通知を読む前にstart，読んだらtakeを呼ぶ．
+# limitは1回の先読みで試す候補の数の上限で，Noneなら候補がなくなるか通知が届くまで試す．
+# waitsは先読みの回数，hitsは候補が当たった回数である．
+# savedは当たった候補の更新と決定にかかった時間，lateは通知が届いてから先読みをやめるまでの遅れ(の上限)，
+# overheadはtakeで候補を引くのにかかった時間(ミリ秒)である．
+#
+class Speculator:
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.results = {}
+        self.waits = 0
+        self.hits = 0
+        self.tried = Histogram()
+        self.saved = Histogram()
+        self.late = Histogram()
+        self.overhead = Histogram()
+
+    #
+    # playerの複製で，ready()が真になるまで先読みする．readyはPollに渡す関数である．
+    # lastは自分の前のターンの通知(Message)で，相手の艦のHPと自分の攻撃が命中した艦を使う．なければ相手の艦はすべて残っているとする．
+    # 候補ごとに複製を作り，更新して行動を決め，resultsに(複製, 行動, 時間)を加える．
+    # 途中で通知が届いた候補は加えない．探索を打ち切った行動は普通に決めた行動と違うからである．
+    #
+    def start(self, player, last=None, ready=None):
+        self.waits += 1
+        self.results = {}
+        poll = Poll(ready)
+        enemy = last.enemy if last is not None else dict(PlayerShip.MAX_HPS)
+        chased = last.attacked[1] if last is not None and last.attacked is not None else None
+        for i, message in enumerate(candidates(player, enemy, chased)):
+            if poll.is_set() or (self.limit is not None and i >= self.limit):
+                break
+            start = time.perf_counter()
+            clone = player.clone()
+            # 先読みの間は表示しない．
+            verbose = getattr(clone, 'verbose', 0)
+            if verbose:
+                clone.verbose = 0
+            clone.update(message, is_my_turn=False)
+            if poll.is_set():
+                break
+            if hasattr(clone, 'interrupt'):
+                clone.interrupt = poll
+            act = clone.decide()
+            if poll.fired and hasattr(clone, 'interrupt'):
+                break
+            if verbose:
+                clone.verbose = verbose
+            if hasattr(clone, 'interrupt'):
+                clone.interrupt = None
+            self.results[message_key(message)] = (clone, act, time.perf_counter() - start)
+        if poll.fired:
+            self.late.record(poll.late * 1e3)
+
+    #
+    # 届いた通知message(Message)で先読みを終える．当たった候補があれば(更新済みのプレイヤー, 決めておいた行動)を返し，
+    # なければNoneを返す．Noneなら元のプレイヤーは変わっていないので，普通に更新する．
+    #
+    def take(self, message):
+        start = time.perf_counter()
+        results, self.results = self.results, {}
+        found = results.get(message_key(message))
+        self.overhead.record((time.perf_counter() - start) * 1e3)
+        self.tried.record(len(results))
+        if found is None:
+            return None
+        clone, act, elapsed = found
+        self.hits += 1
+        self.saved.record(elapsed * 1e3)
+        return clone, act
+
+    def summary(self):
+        return {"waits": self.waits, "hits": self.hits, "hit_rate": self.hits / self.waits if self.waits else 0.0,
+                "tried": self.tried.summary(), "saved_ms": self.saved.summary(), "late_ms": self.late.summary(),
+                "overhead_ms": self.overhead.summary()}
+
+    # 当たった割合と，省いた時間，先読みをやめるまでの遅れ，候補を引くのにかかった時間を表示する．
+    def report(self, file=None):
+        file = file if file is not None else sys.stderr
+        s = self.summary()
+        print(f"speculation: hits {s['hits']}/{s['waits']} ({s['hit_rate'] * 100:.1f}%), "
+              f"candidates/wait {s['tried']['mean']:.1f}, "
+              f"saved {self.saved.total:.1f} ms (p50 {s['saved_ms']['p50']:.3f} ms), "
+              f"late p50 {s['late_ms']['p50']:.3f} ms, max {s['late_ms']['max']:.3f} ms, "
+              f"overhead p50 {s['overhead_ms']['p50']:.3f} ms", file=file)
+
+    # ゲームの終わりに呼ぶ．先読みした場合は集計を表示する．
+    def finish(self):
+        if self.waits:
+            self.report()
+
+
+# 先読みしない場合に使うクラスである．Speculatorと同じメソッドを持つが，何もしない．
+class NullSpeculator:
+
+    def start(self, player, last=None, ready=None):
+        pass
+
+    def take(self, message):
+        return None
+
+    def finish(self):
+        pass
+
+
+NULL = NullSpeculator()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'test':
+        import unittest
+
+        from lib.codec import decode
+        from lib.engine import Server
+        from players.ai_player import AIPlayer
+        from players.random_player import RandomPlayer
+
+        class SpeculatorTest(unittest.TestCase):
+
+            #
+            # lib/engine.pyと同じ手順で対戦させ，相手のターンの間に先読みする．
+            # 候補をすべて試せば必ず当たり，普通に更新して決めた場合と同じ行動になる．
+            #
+            def play(self, player, opponent, turns=60):
+                import json
+
+                speculator = Speculator()
+                server = Server(json.loads(player.initial_condition()), json.loads(opponent.initial_condition()))
+                last = pending = None
+                for _ in range(turns):
+                    act = pending if pending is not None else player.decide()
+                    results = server.action(0, act)
+                    player.update(results[0], is_my_turn=True)
+                    opponent.update(results[1], is_my_turn=False)
+                    if "outcome" in results[0]:
+                        break
+                    last = decode(results[0])
+
+                    speculator.start(player, last)
+                    results = server.action(1, opponent.decide())
+                    opponent.update(results[0], is_my_turn=True)
+                    if "outcome" in results[1]:
+                        break
+                    message = decode(results[1])
+                    expected = player.clone()
+                    expected.update(message, is_my_turn=False)
+                    ready = speculator.take(message)
+                    self.assertIsNotNone(ready)
+                    player, pending = ready
+                    self.assertEqual(expected.decide(), pending)
+                    self.assertEqual(expected.snapshot(), player.snapshot())
+                return speculator
+
+            def test_hits(self):
+                for seed in range(3):
+                    speculator = self.play(AIPlayer(seed), RandomPlayer(seed + 100))
+                    self.assertEqual(speculator.waits, speculator.hits)
+
+            def test_miss(self):
+                # 候補を試す前に通知が届けば，当たらずに元のプレイヤーをそのまま使う．
+                player = AIPlayer(0)
+                state = player.snapshot()
+                speculator = Speculator(limit=0)
+                speculator.start(player)
+                message = decode({"condition": {"me": {ship.type: {"hp": ship.hp, "position": ship.position}
+                                                       for ship in player.ships.values()},
+                                                "enemy": {"w": {"hp": 3}, "c": {"hp": 2}, "s": {"hp": 1}}},
+                                  "result": {"moved": {"ship": "w", "distance": [0, 1]}}})
+                self.assertIsNone(speculator.take(message))
+                self.assertEqual(state, player.snapshot())
+                self.assertEqual((1, 0), (speculator.waits, speculator.hits))
+
+            def test_ready(self):
+                # 通知が届いたら，試している候補を加えずにすぐやめる．
+                polls = []
+
+                def ready():
+                    polls.append(1)
+                    return len(polls) > 5
+
+                speculator = Speculator()
+                speculator.start(AIPlayer(0), ready=ready)
+                self.assertEqual(6, len(polls))
+                self.assertEqual(2, len(speculator.results))
+                self.assertEqual(1, speculator.late.count)
+
+                # 探索は通知が届いた時点で打ち切り，その候補は加えない．
+                from players.search_player import SearchPlayer
+
+                polls.clear()
+                speculator.start(SearchPlayer(0, budget=10.0), ready=ready)
+                self.assertEqual({}, speculator.results)
+
+            def test_candidates(self):
+                # 負ける攻撃を除いたすべての攻撃と，すべての移動が1回ずつ含まれる．
+                player = AIPlayer(0)
+                messages = list(candidates(player, dict(PlayerShip.MAX_HPS), 'c'))
+                self.assertEqual(25 + 3 * 16, len(messages))
+                self.assertEqual(len(messages), len({message_key(m) for m in messages}))
+                self.assertEqual('c', messages[0].moved[0])
+
+            def test_clone(self):
+                # 複製を変えても元のプレイヤーは変わらない．
+                player = AIPlayer(0)
+                clone = player.clone()
+                ship = clone.all_ships[0]
+                clone.make_move(ship.type, max(clone.moves[ship.type]))
+                clone.belief.enemy_attacked([2, 2], ['w'])
+                self.assertNotEqual(clone.snapshot(), player.snapshot())
+                self.assertEqual(0, player.pred_w[2][2])
+                self.assertEqual(Player({s.type: s.position for s in player.all_ships}).legal_actions(),
+                                 player.legal_actions())
+
+            def test_beliefs(self):
+                # どの予測の実装でも，複製は元のプレイヤーと同じ行動を選ぶ．
+                from lib.belief import BELIEFS
+
+                for belief in BELIEFS:
+                    player = AIPlayer(0, belief=belief)
+                    messages = list(candidates(player, dict(PlayerShip.MAX_HPS)))
+                    for message in messages[::7]:
+                        expected = AIPlayer(0, belief=belief)
+                        expected.update(message, is_my_turn=False)
+                        clone = player.clone()
+                        clone.update(message, is_my_turn=False)
+                        self.assertEqual(expected.decide(), clone.decide())
+                    self.assertEqual(AIPlayer(0, belief=belief).decide(), player.decide())
+
+        unittest.main(argv=sys.argv[:1])
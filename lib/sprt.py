@@ -0,0 +1,245 @@
+import math
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
+
+sys.path.append(os.getcwd())
+
+from lib.engine import MAX_TURNS
+from lib.tournament import Stats, make_tasks, run_chunk
+
+
+#
+# 2つのプレイヤーのどちらが強いかを，逐次確率比検定(SPRT)で決めるモジュールである．
+# lib/tournament.pyと同じく，同じシードで先攻後攻を入れ替えた2ゲームを1組として，組をまとめたバッチごとに並列に対戦させる．
+# バッチが終わるたびに対数尤度比(LLR)を計算し，境界を越えたら止める．差がはっきりしていれば，固定の数だけ対戦させるより早く終わる．
+#
+# 仮説はEloの差で与える．H0は「AのBに対するEloの差がelo0」，H1は「elo1」である．
+# 組の得点(2ゲームの得点の平均，0から1)を1つの観測とし，その分散を標本から推定する正規近似(GSPRT)を使う．
+# 組にすると，先攻後攻の有利とシードによる配置の有利が打ち消し合うので，分散が小さくなる．
+#
+
+# 仮説の既定値である．AがBよりELO1だけ強いか，差がないか(ELO0)を見分ける．
+ELO0 = 0.0
+ELO1 = 20.0
+# 第1種，第2種の誤りの確率の既定値である．
+ALPHA = 0.05
+BETA = 0.05
+# バッチあたりの組の数と，対戦させるゲームの数の上限の既定値である．
+BATCH = 100
+MAX_GAMES = 20000
+
+# 組の得点の表で，数が0の欄に加える値である．結果が1種類しかない場合でも分散が0にならないようにする．
+EPSILON = 1e-3
+
+
+# Eloの差から，1ゲームあたりの得点の期待値を返す．
+def expected_score(elo):
+    return 1 / (1 + 10 ** (-elo / 400))
+
+
+# 得点からEloの差を返す．得点が0か1ならinfを返す．
+def elo(score):
+    if score <= 0:
+        return -math.inf
+    if score >= 1:
+        return math.inf
+    return -400 * math.log10(1 / score - 1)
+
+
+# 組の得点の表pairs(lib/tournament.pyのStats.pairs)から，(組の数，得点の平均，分散)を返す．得点は0から1に直す．
+def pair_stats(pairs):
+    counts = [n if n > 0 else EPSILON for n in pairs]
+    n = sum(counts)
+    mean = sum(i / 4 * c for i, c in enumerate(counts)) / n
+    var = sum((i / 4 - mean) ** 2 * c for i, c in enumerate(counts)) / n
+    return n, mean, var
+
+
+# 対数尤度比である．正ならH1，負ならH0を支持する．
+def llr(pairs, elo0, elo1):
+    if sum(pairs) == 0:
+        return 0.0
+    n, mean, var = pair_stats(pairs)
+    s0, s1 = expected_score(elo0), expected_score(elo1)
+    return n * (s1 - s0) * (2 * mean - s0 - s1) / (2 * var)
+
+
+# LLRの(下側，上側)の境界である．下側を下回ればH0，上側を上回ればH1を採る．
+def bounds(alpha, beta):
+    return math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+
+
+#
+# 同じ誤りの確率でH0とH1を見分ける，固定の数の組の検定に必要なゲームの数を返す．
+# 固定の数は対戦の前に決めるので，分散は引き分けのない独立な2ゲームの平均の値(最大で0.125)を仮定する．
+#
+def fixed_games(elo0, elo1, alpha, beta):
+    s = (expected_score(elo0) + expected_score(elo1)) / 2
+    var = s * (1 - s) / 2
+    normal = NormalDist()
+    z = normal.inv_cdf(1 - alpha) + normal.inv_cdf(1 - beta)
+    pairs = (z * math.sqrt(var) / (expected_score(elo1) - expected_score(elo0))) ** 2
+    return 2 * math.ceil(pairs)
+
+
+#
+# 集計結果statsの要約を連想配列で返す．得点とEloの差は，confidenceの信頼区間とともに返す．
+# fixed_gamesは同じ誤りの確率の固定の数の検定に必要なゲームの数，savedはそれより少なく済んだゲームの数である．
+#
+def summary(stats, elo0=ELO0, elo1=ELO1, alpha=ALPHA, beta=BETA, confidence=0.95):
+    n, mean, var = pair_stats(stats.pairs)
+    margin = NormalDist().inv_cdf((1 + confidence) / 2) * math.sqrt(var / n)
+    low, high = max(mean - margin, 0.0), min(mean + margin, 1.0)
+    lower, upper = bounds(alpha, beta)
+    fixed = fixed_games(elo0, elo1, alpha, beta)
+    return {
+        "games": stats.games(),
+        "pairs": list(stats.pairs),
+        "wins": stats.total(),
+        "llr": llr(stats.pairs, elo0, elo1),
+        "bounds": [lower, upper],
+        "score": [mean, low, high],
+        "elo": [elo(mean), elo(low), elo(high)],
+        "fixed_games": fixed,
+        "saved": fixed - stats.games(),
+    }
+
+
+#
+# spec_aとspec_bのプレイヤーを，seedから始まるシードで組ごとに対戦させ，SPRTで判定する．
+# 1回にbatch組ずつ対戦させ，LLRが境界を越えるか，ゲームの数がmax_gamesに達したら止める．
+# (判定，Stats)を返す．判定はH1なら'H1'，H0なら'H0'，上限に達したならNoneである．
+# progressを与えると，バッチが終わるたびに(Stats, LLR)で呼ぶ．チャンクの分け方はワーカー数によらないので，結果も同じになる．
+#
+def run(spec_a, spec_b, elo0=ELO0, elo1=ELO1, alpha=ALPHA, beta=BETA, batch=BATCH, max_games=MAX_GAMES,
+        seed=0, workers=None, chunk_size=25, max_turns=MAX_TURNS, rules=None, progress=None):
+    lower, upper = bounds(alpha, beta)
+    stats = Stats()
+    executor = None if workers == 1 else ProcessPoolExecutor(max_workers=workers)
+    try:
+        start = seed
+        while True:
+            count = min(batch, (max_games - stats.games()) // 2)
+            if count <= 0:
+                return None, stats
+            tasks = make_tasks([(spec_a, spec_b)], count, start, chunk_size, max_turns, rules)
+            chunks = map(run_chunk, tasks) if executor is None else executor.map(run_chunk, tasks)
+            for _, chunk in chunks:
+                stats.merge(chunk)
+            start += count
+            value = llr(stats.pairs, elo0, elo1)
+            if progress is not None:
+                progress(stats, value)
+            if value >= upper:
+                return 'H1', stats
+            if value <= lower:
+                return 'H0', stats
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+# 判定と要約を表示する．
+def report(spec_a, spec_b, decision, stats, elo0=ELO0, elo1=ELO1, alpha=ALPHA, beta=BETA, max_games=MAX_GAMES):
+    s = summary(stats, elo0, elo1, alpha, beta)
+    win, lose, even = s["wins"]
+    print(f"{spec_a} vs {spec_b}: {s['games']} games (win {win}  lose {lose}  even {even}), pairs {s['pairs']}")
+    print(f"  score {s['score'][0]:.4f} [{s['score'][1]:.4f}, {s['score'][2]:.4f}]  "
+          f"elo {s['elo'][0]:+.1f} [{s['elo'][1]:+.1f}, {s['elo'][2]:+.1f}] (95%)")
+    print(f"  LLR {s['llr']:.2f} in [{s['bounds'][0]:.2f}, {s['bounds'][1]:.2f}] "
+          f"for elo {elo0:+g} vs {elo1:+g}, alpha {alpha}, beta {beta}")
+    if decision is None:
+        print(f"  undecided at the cap of {max_games} games")
+    else:
+        print(f"  accepted {decision} (elo {elo1 if decision == 'H1' else elo0:+g})")
+    print(f"  fixed-size test would need {s['fixed_games']} games: saved {s['saved']}; "
+          f"cap {max_games}: saved {max_games - s['games']}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'test':
+        import unittest
+
+        class SprtTest(unittest.TestCase):
+
+            def test_llr(self):
+                lower, upper = bounds(0.05, 0.05)
+                self.assertAlmostEqual(-upper, lower)
+                self.assertAlmostEqual(2.944, upper, places=3)
+                # 勝ち越していればH1，負け越していればH0の側に傾く．
+                self.assertGreater(llr([5, 10, 30, 30, 25], 0, 20), 0)
+                self.assertLess(llr([25, 30, 30, 10, 5], 0, 20), 0)
+                # 組の数が4倍になれば，LLRも4倍になる．
+                self.assertAlmostEqual(4 * llr([1, 2, 3, 4, 5], 0, 20), llr([4, 8, 12, 16, 20], 0, 20))
+                self.assertEqual(0.0, llr([0, 0, 0, 0, 0], 0, 20))
+
+            def test_fixed_games(self):
+                # 差が小さいほど，固定の数の検定には多くのゲームが要る．
+                self.assertGreater(fixed_games(0, 5, 0.05, 0.05), 10 * fixed_games(0, 20, 0.05, 0.05))
+                self.assertEqual(3272, fixed_games(0, 20, 0.05, 0.05))
+
+            def test_elo(self):
+                for d in (-100, 0, 35):
+                    self.assertAlmostEqual(d, elo(expected_score(d)))
+                self.assertEqual(math.inf, elo(1.0))
+
+            def test_decides(self):
+                # 強さの差がはっきりしていれば，上限よりずっと少ないゲームでH1を採る．
+                specs = 'players.ai_player:AIPlayer', 'players.random_player:RandomPlayer'
+                decision, stats = run(*specs, elo0=0, elo1=50, batch=10, max_games=400, workers=1, max_turns=300)
+                self.assertEqual('H1', decision)
+                self.assertLess(stats.games(), 400)
+                self.assertEqual(stats.games(), 2 * sum(stats.pairs))
+                s = summary(stats, 0, 50)
+                self.assertGreater(s["elo"][1], 50)
+                self.assertGreater(s["saved"], 0)
+
+                # 逆の組ならH0を採る．ワーカー数によらず同じ結果になる．
+                decision, one = run(*reversed(specs), elo0=0, elo1=50, batch=10, max_games=400, workers=1,
+                                    max_turns=300)
+                self.assertEqual('H0', decision)
+                _, many = run(*reversed(specs), elo0=0, elo1=50, batch=10, max_games=400, workers=2,
+                              chunk_size=3, max_turns=300)
+                self.assertEqual(one, many)
+
+            def test_cap(self):
+                # 同じプレイヤーどうしでは，小さい差を見分けられずに上限で止まる．
+                spec = 'players.random_player:RandomPlayer'
+                decision, stats = run(spec, spec, elo0=-5, elo1=5, batch=8, max_games=40, workers=1, max_turns=100)
+                self.assertIsNone(decision)
+                self.assertEqual(40, stats.games())
+
+        unittest.main(argv=sys.argv[:1])
+    else:
+        import argparse
+        import time
+
+        parser = argparse.ArgumentParser(description="Sequential probability ratio test between two players")
+        parser.add_argument("player_a", metavar="A", help="Player class to test. E.g., players.ai_player:AIPlayer")
+        parser.add_argument("player_b", metavar="B", help="Baseline player class")
+        parser.add_argument("--elo0", type=float, default=ELO0, help="Elo difference of H0")
+        parser.add_argument("--elo1", type=float, default=ELO1, help="Elo difference of H1")
+        parser.add_argument("--alpha", type=float, default=ALPHA, help="Probability of accepting H1 under H0")
+        parser.add_argument("--beta", type=float, default=BETA, help="Probability of accepting H0 under H1")
+        parser.add_argument("--batch", type=int, default=BATCH, help="Seed pairs per batch")
+        parser.add_argument("--max-games", type=int, default=MAX_GAMES, help="Stop after this number of games")
+        parser.add_argument("--seed", type=int, default=0, help="First seed")
+        parser.add_argument("--workers", type=int, default=None, help="Number of processes")
+        parser.add_argument("--chunk", type=int, default=25, help="Seeds per chunk")
+        parser.add_argument("--max-turns", type=int, default=MAX_TURNS, help="Turn limit")
+        args = parser.parse_args()
+
+        def progress(stats, value):
+            print(f"{stats.games()} games: LLR {value:.2f}", file=sys.stderr)
+
+        start = time.perf_counter()
+        decision, stats = run(args.player_a, args.player_b, elo0=args.elo0, elo1=args.elo1, alpha=args.alpha,
+                              beta=args.beta, batch=args.batch, max_games=args.max_games, seed=args.seed,
+                              workers=args.workers, chunk_size=args.chunk, max_turns=args.max_turns,
+                              progress=progress)
+        elapsed = time.perf_counter() - start
+        report(args.player_a, args.player_b, decision, stats, args.elo0, args.elo1, args.alpha, args.beta,
+               args.max_games)
+        print(f"{stats.games()} games in {elapsed:.1f}s ({stats.games() / elapsed:.1f} games/s)")
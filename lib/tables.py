@@ -0,0 +1,291 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+sys.path.append(os.getcwd())
+
+import numpy as np
+
+from lib.player_base import SHIP_TYPES, Player, PlayerShip
+
+
+#
+# 事前に計算する表を管理するモジュールである．numpyが必要．
+# 表は名前，版，作る関数の組で登録し，最初にgetした時に作る．作る関数はnumpyの配列の連想配列を返す．
+#
+# rootを与えると，作った表を root/<名前>.v<版>/<配列の名前>.npy に保存し，以後は読み取り専用でmmapする．
+# 同じrootを使うプロセスは同じファイルを共有するので，ワーカーを起動するたびに表を作り直さずに済み，メモリも1つ分で済む．
+# 表の作り方を変えた場合は版を上げる．古い版のディレクトリは使われなくなる．
+# rootの既定値は環境変数SUBMARINE_TABLESで，与えなければプロセスのメモリの中で作るだけになる(従来と同じ)．
+#
+
+# 表の作り方である．作る時の規則(フィールドの大きさと艦隊)で作るので，名前を作った時と同じ規則のまま使う．
+def build_space(ship_types):
+    from lib.tracker import build_space
+    return build_space(ship_types)
+
+
+def build_stencils():
+    from lib.belief import NumpyBelief
+    near_stencils, around_stencils = NumpyBelief.build_tables()
+    return {'near_stencils': near_stencils, 'around_stencils': around_stencils}
+
+
+def build_endgame():
+    from lib.endgame import solve
+    return {'data': np.frombuffer(solve(), dtype=np.uint8)}
+
+
+#
+# 表の名前を今の規則から作り，まだ登録していなければ登録して返す．
+# 名前には規則を含めるので，lib/player_base.pyのconfigureで規則を変えた後は別の表になり，取り違えない．
+# 艦種の名前は区切って並べる．連結すると'w1'と'w12'，['w1', '2']と['w12']のような組を区別できない．
+#
+def space_name(ship_types):
+    ship_types = tuple(ship_types)
+    name = 'space-%s-%d' % (','.join(ship_types) or 'none', Player.FIELD_SIZE)
+    return register(name, 1, lambda: build_space(ship_types))
+
+
+def stencils_name():
+    return register('stencils-%d' % Player.FIELD_SIZE, 2, build_stencils)
+
+
+def endgame_name():
+    max_hp = max(PlayerShip.MAX_HPS.values())
+    return register('endgame-%d-%d' % (Player.FIELD_SIZE, max_hp), 1, build_endgame)
+
+
+class Registry:
+
+    def __init__(self, root=None):
+        self.root = root
+        self.tables = {}
+        self.loaded = {}
+        self.stats = {}
+
+    def register(self, name, version, build):
+        self.tables[name] = (version, build)
+
+    def path(self, name):
+        version, _ = self.tables[name]
+        return os.path.join(self.root, '%s.v%d' % (name, version))
+
+    # 表を返す．まだなければ，ファイルをmmapするか，作って(rootがあれば保存してから)返す．
+    def get(self, name):
+        arrays = self.loaded.get(name)
+        if arrays is None:
+            if name not in self.tables:
+                raise ValueError('unknown table: ' + name)
+            start = time.perf_counter()
+            arrays, source = self.load(name)
+            self.loaded[name] = arrays
+            self.stats[name] = {
+                "source": source,
+                "seconds": time.perf_counter() - start,
+                "nbytes": sum(a.nbytes for a in arrays.values()),
+            }
+        return arrays
+
+    def load(self, name):
+        _, build = self.tables[name]
+        if self.root is None:
+            return build(), 'built'
+        path = self.path(name)
+        source = 'mapped'
+        if not os.path.isdir(path):
+            self.save(name, build())
+            source = 'built'
+        arrays = {}
+        for file in sorted(os.listdir(path)):
+            # memmapのままだと演算のたびに余計な処理が入るので，同じメモリを指すndarrayにする．
+            arrays[file[:-len('.npy')]] = np.asarray(np.load(os.path.join(path, file), mmap_mode='r'))
+        return arrays, source
+
+    #
+    # 一時ディレクトリに書いてから名前を変える．
+    # 他のプロセスが先に同じ表を保存していた場合は名前を変えられないので，自分の分を捨ててそちらを使う．
+    #
+    def save(self, name, arrays):
+        path = self.path(name)
+        os.makedirs(self.root, exist_ok=True)
+        tmp = '%s.tmp-%d' % (path, os.getpid())
+        os.makedirs(tmp)
+        for key, array in arrays.items():
+            np.save(os.path.join(tmp, key + '.npy'), array)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            shutil.rmtree(tmp)
+
+    # 登録されたすべての表を読み込む．
+    def load_all(self):
+        for name in self.tables:
+            self.get(name)
+
+    # 読み込んだ表ごとに，作ったかmmapしたか，かかった時間，大きさを返す．
+    def report(self):
+        return {name: dict(stats) for name, stats in self.stats.items()}
+
+
+REGISTRY = Registry(os.environ.get('SUBMARINE_TABLES'))
+
+
+def register(name, version, build):
+    if name not in REGISTRY.tables:
+        REGISTRY.register(name, version, build)
+    return name
+
+
+#
+# 今の規則で使うすべての表を登録し，名前のリストを返す．
+# lib/tracker.pyは残っている艦種をSHIP_TYPESの順に並べて空間を引くので，その部分列をすべて(空の列も)登録する．
+#
+def register_all():
+    names = []
+    for mask in range(1 << len(SHIP_TYPES)):
+        names.append(space_name([ship_type for j, ship_type in enumerate(SHIP_TYPES) if mask >> j & 1]))
+    names.append(stencils_name())
+    names.append(endgame_name())
+    return names
+
+
+def get(name):
+    return REGISTRY.get(name)
+
+
+#
+# 新しいプロセスで，プレイヤーのモジュールを読み込む時間と最初の行動を決めるまでの時間を測る．
+# 計測するプロセスは環境変数SUBMARINE_TABLESにrootを与えて起動する．
+#
+PROBE = '''
+import json, os, sys, time
+start = time.perf_counter()
+sys.path.append(os.getcwd())
+from lib.tournament import load_player
+cls = load_player(sys.argv[1])
+imported = time.perf_counter()
+cls(0).decide()
+decided = time.perf_counter()
+from lib import tables
+tables.register_all()
+tables.REGISTRY.load_all()
+loaded = time.perf_counter()
+print(json.dumps({"import": imported - start, "first_move": decided - imported,
+                  "load_all": loaded - decided, "tables": tables.REGISTRY.report()}))
+'''
+
+
+def probe(spec, root):
+    env = dict(os.environ)
+    if root is None:
+        env.pop('SUBMARINE_TABLES', None)
+    else:
+        env['SUBMARINE_TABLES'] = root
+    output = subprocess.run([sys.executable, '-c', PROBE, spec], env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'test':
+        import tempfile
+        import unittest
+
+        class RegistryTest(unittest.TestCase):
+
+            def test_memory(self):
+                registry = Registry()
+                calls = []
+                registry.register('t', 1, lambda: calls.append(1) or {'a': np.arange(3)})
+                self.assertEqual([0, 1, 2], registry.get('t')['a'].tolist())
+                registry.get('t')
+                self.assertEqual([1], calls)
+                self.assertEqual('built', registry.report()['t']['source'])
+                with self.assertRaises(ValueError):
+                    registry.get('u')
+
+            def test_files(self):
+                with tempfile.TemporaryDirectory() as root:
+                    first = Registry(root)
+                    first.register('t', 1, lambda: {'a': np.arange(3)})
+                    first.get('t')
+                    self.assertEqual(['t.v1'], os.listdir(root))
+
+                    second = Registry(root)
+                    second.register('t', 1, lambda: self.fail('built again'))
+                    a = second.get('t')['a']
+                    self.assertEqual([0, 1, 2], a.tolist())
+                    self.assertEqual('mapped', second.report()['t']['source'])
+                    self.assertFalse(a.flags.writeable)
+                    with self.assertRaises(ValueError):
+                        a[0] = 1
+
+                    # 版を上げると作り直す．
+                    third = Registry(root)
+                    third.register('t', 2, lambda: {'a': np.arange(4)})
+                    self.assertEqual(4, len(third.get('t')['a']))
+                    self.assertEqual(['t.v1', 't.v2'], sorted(os.listdir(root)))
+
+            def test_tables(self):
+                # ファイルから読んだ表でも，作った表と同じになる．
+                names = register_all()
+                with tempfile.TemporaryDirectory() as root:
+                    for _ in range(2):
+                        registry = Registry(root)
+                        registry.tables = REGISTRY.tables
+                        registry.load_all()
+                    for name in names:
+                        self.assertEqual('mapped', registry.report()[name]['source'])
+                        for key, array in registry.get(name).items():
+                            self.assertTrue(np.array_equal(REGISTRY.get(name)[key], array))
+
+            def test_rules(self):
+                # 規則を変えると，その規則の名前で表を登録する．
+                from lib.player_base import configure
+
+                self.assertEqual('stencils-5', stencils_name())
+                configure(6, {'w1': 1, 'w12': 2})
+                try:
+                    self.assertEqual('stencils-6', stencils_name())
+                    self.assertEqual((36, 6, 6), get(stencils_name())['near_stencils'].shape)
+                    self.assertEqual('endgame-6-2', endgame_name())
+                    self.assertNotEqual(space_name(['w1', '2']), space_name(['w12']))
+                    self.assertEqual(4 + 2, len(register_all()))
+                finally:
+                    configure()
+
+        unittest.main(argv=sys.argv[:1])
+    else:
+        import argparse
+        import tempfile
+
+        parser = argparse.ArgumentParser(description="Build the precomputed tables and measure worker startup")
+        parser.add_argument("root", metavar="DIR", type=str, help="Directory of the tables")
+        parser.add_argument(
+            "--players",
+            nargs="+",
+            default=['players.random_player:RandomPlayer', 'players.ai_player:AIPlayer',
+                     'players.search_player:SearchPlayer'],
+            help="Player classes to measure. E.g., players.ai_player:AIPlayer",
+        )
+        args = parser.parse_args()
+
+        register_all()
+        registry = Registry(args.root)
+        registry.tables = REGISTRY.tables
+        registry.load_all()
+        for name, stats in registry.report().items():
+            print(f"{name}: {stats['source']} in {stats['seconds'] * 1000:.1f} ms, {stats['nbytes']} bytes")
+
+        # 表のないディレクトリ，作った表のディレクトリで，それぞれ新しいプロセスを起動して測る．
+        for spec in args.players:
+            with tempfile.TemporaryDirectory() as empty:
+                for label, root in [('cold', empty), ('warm', args.root)]:
+                    result = probe(spec, root)
+                    print(f"{spec} {label}: import {result['import'] * 1000:.1f} ms, "
+                          f"first move {result['first_move'] * 1000:.1f} ms, "
+                          f"all tables {result['load_all'] * 1000:.1f} ms")
@@ -0,0 +1,252 @@
+import collections
+import importlib
+import itertools
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.getcwd())
+
+from lib.engine import MAX_TURNS, play
+from lib.player_base import configure
+
+
+#
+# 複数のプレイヤーを総当たりで大量に対戦させるためのモジュールである．
+# (シード, プレイヤーの組, 先攻)の空間をチャンクに分け，プロセスプールで並列に処理する．
+# ワーカーは集計した結果だけを返すので，ワーカー数によらず同じ結果になる．
+#
+
+# ターン数のヒストグラムの幅である．
+BUCKET = 10
+
+
+# "players.ai_player:AIPlayer"のような文字列からクラスを読み込む．
+def load_player(spec):
+    module_name, class_name = spec.split(':')
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+#
+# ゲームごとのシードから各プレイヤーのシードを決める．
+# 先攻後攻を入れ替えても同じシードになるので，先攻後攻だけが異なる対戦の組ができる．
+#
+def player_seeds(seed):
+    return seed * 2, seed * 2 + 1
+
+
+# プレイヤーの組ごとの集計結果である．勝敗は組の先のプレイヤーから見たものである．
+class Stats:
+
+    def __init__(self):
+        # 先攻のプレイヤー(0か1)ごとに[勝ち，負け，引き分け]を数える．
+        self.counts = [[0, 0, 0], [0, 0, 0]]
+        # ターン数をBUCKETごとに数える．
+        self.turns = collections.Counter()
+        # ターン数の合計である．平均はヒストグラムではなくこの値から求める．
+        self.sum_turns = 0
+        # 同じシードで先攻後攻を入れ替えた2ゲームの組ごとの得点(勝ち2，引き分け1，負け0の和)を数える．lib/sprt.pyが使う．
+        self.pairs = [0, 0, 0, 0, 0]
+
+    # 1ゲームの結果を加える．winnerは組の中でのインデックスで，引き分けは-1である．
+    def add(self, first, winner, turns):
+        if winner == -1:
+            self.counts[first][2] += 1
+        elif winner == 0:
+            self.counts[first][0] += 1
+        else:
+            self.counts[first][1] += 1
+        self.turns[turns // BUCKET * BUCKET] += 1
+        self.sum_turns += turns
+
+    # 組の2ゲームの勝者から，組の得点を加える．
+    def add_pair(self, winners):
+        self.pairs[sum(2 if winner == 0 else 1 if winner == -1 else 0 for winner in winners)] += 1
+
+    # 他の集計結果を足し合わせる．
+    def merge(self, other):
+        for mine, theirs in zip(self.counts, other.counts):
+            for i in range(3):
+                mine[i] += theirs[i]
+        self.turns.update(other.turns)
+        self.sum_turns += other.sum_turns
+        for i in range(5):
+            self.pairs[i] += other.pairs[i]
+
+    # 先攻後攻を合わせた[勝ち，負け，引き分け]を返す．
+    def total(self):
+        return [a + b for a, b in zip(*self.counts)]
+
+    def games(self):
+        return sum(self.total())
+
+    def mean_turns(self):
+        games = self.games()
+        if games == 0:
+            return 0
+        return self.sum_turns / games
+
+    def __eq__(self, other):
+        return self.counts == other.counts and self.turns == other.turns and self.sum_turns == other.sum_turns \
+            and self.pairs == other.pairs
+
+
+#
+# ワーカーで実行する処理．組pairについてseedsの範囲のシードで先攻後攻を入れ替えて対戦させる．
+# 組のインデックスと集計結果だけを返す．
+# rulesを与えた場合は，lib/player_base.pyのconfigureに渡す規則で対戦させ，終わったら既定の規則に戻す．
+#
+def run_chunk(task):
+    pair_index, specs, seeds, max_turns, rules = task
+    if rules is None:
+        return pair_index, play_chunk(specs, seeds, max_turns)
+    configure(**rules)
+    try:
+        return pair_index, play_chunk(specs, seeds, max_turns)
+    finally:
+        configure()
+
+
+def play_chunk(specs, seeds, max_turns):
+    classes = [load_player(spec) for spec in specs]
+    stats = Stats()
+    for seed in range(*seeds):
+        seed_a, seed_b = player_seeds(seed)
+        winners = []
+        for first in (0, 1):
+            players = [classes[0](seed_a), classes[1](seed_b)]
+            if first == 0:
+                winner, turns = play(players[0], players[1], max_turns)
+            else:
+                winner, turns = play(players[1], players[0], max_turns)
+                if winner != -1:
+                    winner = 1 - winner
+            stats.add(first, winner, turns)
+            winners.append(winner)
+        stats.add_pair(winners)
+    return stats
+
+
+# 組ごと，シードの範囲ごとにチャンクに分ける．チャンクの分け方はワーカー数によらない．
+def make_tasks(pairs, games, seed, chunk_size, max_turns, rules=None):
+    for pair_index, pair in enumerate(pairs):
+        for start in range(seed, seed + games, chunk_size):
+            stop = min(start + chunk_size, seed + games)
+            yield pair_index, pair, (start, stop), max_turns, rules
+
+
+#
+# specsで与えたプレイヤーを総当たりで対戦させる．各組についてgames個のシードで先攻後攻を入れ替えて2回ずつ対戦する．
+# 組のタプルをkey，Statsをvalueとする連想配列を返す．
+# rulesは{'size': 20, 'max_hps': {...}}のような規則で，与えなければ既定の規則で対戦させる．
+# self_playが真なら，同じプレイヤーどうしの組も対戦させる．
+#
+def run(specs, games, seed=0, workers=None, chunk_size=50, max_turns=MAX_TURNS, rules=None, self_play=False):
+    combine = itertools.combinations_with_replacement if self_play else itertools.combinations
+    pairs = list(combine(specs, 2))
+    results = {pair: Stats() for pair in pairs}
+    tasks = make_tasks(pairs, games, seed, chunk_size, max_turns, rules)
+
+    if workers == 1:
+        chunks = map(run_chunk, tasks)
+        for pair_index, stats in chunks:
+            results[pairs[pair_index]].merge(stats)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for pair_index, stats in executor.map(run_chunk, tasks):
+                results[pairs[pair_index]].merge(stats)
+    return results
+
+
+# 集計結果を表示する．
+def report(results):
+    for (spec_a, spec_b), stats in results.items():
+        win, lose, even = stats.total()
+        print(f"{spec_a} vs {spec_b}: {stats.games()} games")
+        print(f"  win {win}  lose {lose}  even {even}  mean turns {stats.mean_turns():.1f}")
+        for first in (0, 1):
+            win, lose, even = stats.counts[first]
+            name = spec_a if first == 0 else spec_b
+            print(f"  {name} first: win {win}  lose {lose}  even {even}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'test':
+        import unittest
+
+        class TournamentTest(unittest.TestCase):
+
+            def test_reproducible(self):
+                specs = ['players.random_player:RandomPlayer', 'players.ai_player:AIPlayer']
+                one = run(specs, 6, workers=1, chunk_size=2, max_turns=300)
+                many = run(specs, 6, workers=3, chunk_size=4, max_turns=300)
+                self.assertEqual(one, many)
+                self.assertEqual(12, one[tuple(specs)].games())
+
+            def test_self_play(self):
+                specs = ['players.random_player:RandomPlayer', 'players.ai_player:AIPlayer']
+                results = run(specs, 2, workers=1, max_turns=300, self_play=True)
+                self.assertEqual([tuple(specs[:1] * 2), tuple(specs), tuple(specs[1:] * 2)], list(results))
+                self.assertEqual(4, results[tuple(specs[1:] * 2)].games())
+
+            def test_stats(self):
+                s = Stats()
+                s.add(0, 0, 12)
+                s.add(1, -1, 10000)
+                t = Stats()
+                t.add(1, 1, 15)
+                s.merge(t)
+                self.assertEqual([[1, 0, 0], [0, 1, 1]], s.counts)
+                self.assertEqual({10: 2, 10000: 1}, dict(s.turns))
+                self.assertEqual((12 + 10000 + 15) / 3, s.mean_turns())
+                s.add_pair([0, -1])
+                t.add_pair([1, 1])
+                s.merge(t)
+                self.assertEqual([1, 0, 0, 1, 0], s.pairs)
+
+            def test_rules(self):
+                from lib.player_base import Player, default_rules
+
+                specs = ['players.random_player:RandomPlayer', 'players.ai_player:AIPlayer']
+                rules = {'size': 12, 'max_hps': {'w': 3, 'c': 2, 's': 1, 'x': 2}}
+                one = run(specs, 2, workers=1, max_turns=300, rules=rules)
+                many = run(specs, 2, workers=2, chunk_size=1, max_turns=300, rules=rules)
+                self.assertEqual(one, many)
+                self.assertTrue(default_rules())
+                self.assertEqual(5, Player.FIELD_SIZE)
+
+        unittest.main(argv=sys.argv[:1])
+    else:
+        import argparse
+        import time
+
+        parser = argparse.ArgumentParser(description="Round-robin tournament for Submaline Game")
+        parser.add_argument(
+            "players",
+            metavar="SPEC",
+            nargs="+",
+            help="Player classes. E.g., players.ai_player:AIPlayer",
+        )
+        parser.add_argument("--games", type=int, default=1000, help="Number of seeds per pair")
+        parser.add_argument("--seed", type=int, default=0, help="First seed")
+        parser.add_argument("--workers", type=int, default=None, help="Number of processes")
+        parser.add_argument("--chunk", type=int, default=50, help="Seeds per chunk")
+        parser.add_argument("--max-turns", type=int, default=MAX_TURNS, help="Turn limit")
+        parser.add_argument("--size", type=int, default=None, help="Field size")
+        parser.add_argument("--fleet", type=str, default=None, help="Ship types and hps. E.g., w3,c2,s1,x2")
+        parser.add_argument("--self-play", action="store_true", help="Also play each player against itself")
+        args = parser.parse_args()
+
+        rules = None
+        if args.size is not None or args.fleet is not None:
+            rules = {'size': args.size or 5}
+            if args.fleet is not None:
+                rules['max_hps'] = {item[0]: int(item[1:]) for item in args.fleet.split(',')}
+
+        start = time.perf_counter()
+        results = run(args.players, args.games, seed=args.seed, workers=args.workers,
+                      chunk_size=args.chunk, max_turns=args.max_turns, rules=rules, self_play=args.self_play)
+        elapsed = time.perf_counter() - start
+        report(results)
+        games = sum(stats.games() for stats in results.values())
+        print(f"{games} games in {elapsed:.1f}s ({games / elapsed:.1f} games/s)")
@@ -0,0 +1,394 @@
+import copy
+import itertools
+import os
+import sys
+
+sys.path.append(os.getcwd())
+
+import numpy as np
+
+from lib import tables
+from lib.belief import SHIP_TYPES
+from lib.player_base import ATTACK_MASKS, Player, cells, default_rules
+
+
+#
+# 相手の艦の配置をすべて列挙し，それぞれの重みを持つことで厳密にベイズ更新を行うモジュールである．numpyが必要．
+# 3隻が残っている場合の配置は25・24・23 = 13800通りである．撃沈された艦は列から外し，残りの艦の配置の空間に射影する．
+# 観測(攻撃の結果，相手の攻撃，相手の移動)は配置ごとに起こるかどうかが決まっているので，
+# 事前に作った表を引いて，起こり得ない配置の重みを0にするだけでよい．
+#
+
+# 攻撃した座標から見た艦の位置の分類である．その座標にいる，周囲1マスにいる，それ以外．
+AT, NEAR, FAR = 0, 1, 2
+
+
+# 攻撃した座標ごとに，各マスの分類を表にする．
+def build_categories(size):
+    n = size * size
+    categories = np.full((n, n), FAR, dtype=np.uint8)
+    for position in range(n):
+        for cell in cells(ATTACK_MASKS[position]):
+            categories[position, cell] = NEAR
+        categories[position, position] = AT
+    return categories
+
+
+CATEGORIES = build_categories(Player.FIELD_SIZE)
+# 攻撃できるマスのビットマスクからマスごとの真偽を取り出すための，各マスのビットである．
+CELL_BITS = 1 << np.arange(Player.FIELD_SIZE * Player.FIELD_SIZE, dtype=np.int64)
+
+
+#
+# 残っている艦種ship_typesについて，配置の空間と表を持つクラスである．
+# configsは配置ごとの各艦のマスのインデックスで，observationsは攻撃した座標ごとの観測の符号である．
+# 観測の符号はj番目の艦の分類を3のj乗の桁に並べたものである．
+#
+class Space:
+
+    # arraysはbuild_spaceが作る表である．lib/tables.pyから読み込んだものを与える．
+    def __init__(self, ship_types, arrays=None):
+        self.ship_types = ship_types
+        if arrays is None:
+            arrays = build_space(ship_types)
+        self.configs = arrays['configs']
+        self.lookup = arrays['lookup']
+        self.observations = arrays['observations']
+        # 配置ごとの各艦のマスに艦の番号 * マスの数を足したものである．各艦の周辺分布を1回のbincountで数えるのに使う．
+        n = Player.FIELD_SIZE * Player.FIELD_SIZE
+        self.cells = self.configs.astype(np.intp) + np.arange(len(ship_types)) * n
+        self.powers = 3 ** np.arange(len(ship_types))
+        # すべての艦が攻撃された座標から遠い場合の符号である．
+        self.far_code = int(FAR * self.powers.sum())
+        self.transitions = {}
+        self.projections = {}
+
+    @staticmethod
+    def flat_index(configs):
+        n = Player.FIELD_SIZE * Player.FIELD_SIZE
+        index = np.zeros(len(configs), dtype=np.int64)
+        for j in range(configs.shape[1]):
+            index = index * n + configs[:, j]
+        return index
+
+    # 自分の攻撃の結果を符号にする．
+    def code(self, hit, near):
+        code = 0
+        for j, ship_type in enumerate(self.ship_types):
+            if hit == ship_type:
+                category = AT
+            elif ship_type in near:
+                category = NEAR
+            else:
+                category = FAR
+            code += category * int(self.powers[j])
+        return code
+
+    #
+    # j番目の艦が(dx, dy)だけ移動した場合の移動先の配置のインデックスを返す．
+    # フィールド外に出る配置や，他の艦と重なる配置は起こり得ないので-1になる．必要になった時に作る．
+    #
+    def transition(self, j, dx, dy):
+        key = (j, dx, dy)
+        if key not in self.transitions:
+            size = Player.FIELD_SIZE
+            x, y = np.divmod(self.configs[:, j].astype(np.int64), size)
+            x, y = x + dx, y + dy
+            valid = (x >= 0) & (x < size) & (y >= 0) & (y < size)
+            moved = self.configs.astype(np.int64)
+            moved[:, j] = np.where(valid, x * size + y, 0)
+            destination = np.where(valid, self.lookup[self.flat_index(moved)], -1)
+            self.transitions[key] = destination.astype(np.int32)
+        return self.transitions[key]
+
+    # j番目の艦を外した空間と，各配置の移る先のインデックスを返す．
+    def projection(self, j):
+        if j not in self.projections:
+            rest = self.ship_types[:j] + self.ship_types[j + 1:]
+            space = get_space(rest)
+            others = np.delete(self.configs, j, axis=1)
+            self.projections[j] = (space, space.lookup[space.flat_index(others)])
+        return self.projections[j]
+
+    # 表の大きさをバイト数で返す．
+    def nbytes(self):
+        arrays = [self.configs, self.lookup, self.observations, self.cells]
+        arrays += list(self.transitions.values())
+        arrays += [index for _, index in self.projections.values()]
+        return sum(a.nbytes for a in arrays)
+
+
+# 配置の空間の表を作る．configsは配置ごとの各艦のマス，lookupは各艦のマスから配置のインデックスを引く表(重複した配置は-1)．
+def build_space(ship_types):
+    n = Player.FIELD_SIZE * Player.FIELD_SIZE
+    m = len(ship_types)
+    configs = np.array(list(itertools.permutations(range(n), m)), dtype=np.int16)
+    lookup = np.full(n ** m, -1, dtype=np.int32)
+    lookup[Space.flat_index(configs)] = np.arange(len(configs))
+    observations = (CATEGORIES[:, configs] * 3 ** np.arange(m)).sum(axis=2).astype(np.uint8)
+    return {'configs': configs, 'lookup': lookup, 'observations': observations}
+
+
+# 艦種の組ごとの空間は一度だけ作ってプロセス内で共有する．表はlib/tables.pyで管理する．
+SPACES = {}
+
+
+def get_space(ship_types):
+    ship_types = tuple(ship_types)
+    name = tables.space_name(ship_types)
+    if name not in SPACES:
+        SPACES[name] = Space(ship_types, tables.get(name))
+    return SPACES[name]
+
+
+#
+# 相手の艦の配置の確率分布を厳密に保持するクラスである．lib/belief.pyのクラスと同じメソッドを持つ．
+# 攻撃先は，艦がいる確率(各艦の周辺分布の和)が最も大きいマスである．
+#
+# 重みが正の配置だけを持つ．aliveはそのインデックス，weightsは同じ順の重みである．
+# 観測は起こり得ない配置を消し，移動は配置を移すだけなので，重みは正規化せずに整数のまま持つ(射影で足し合わせても整数である)．
+# 各艦のマスごとの重みの和をcountsに持ち，観測では消した配置の分だけ引く．そのため更新も周辺分布も，残っている配置の数に比例する時間で済む．
+# 整数なので引いても誤差が出ず，確率が0のマスは正確に0になる．
+#
+class ExactBelief:
+
+    # 配置の数はマスの数の艦の数乗になるので，既定の規則でだけ使える．
+    def __init__(self):
+        if not default_rules():
+            raise ValueError('ExactBelief supports only the default field and fleet')
+        self.space = get_space(SHIP_TYPES)
+        self.uniform()
+        # 射影を待っている撃沈された艦である．
+        self.sunk = []
+
+    # 空間は共有し，重みだけを複製する．配列は置き換えるだけで書き換えないが，countsは書き換えるので複製する．
+    def copy(self):
+        new = copy.copy(self)
+        new.counts = self.counts.copy()
+        new.sunk = list(self.sunk)
+        return new
+
+    # 今の空間で一様にする．観測と矛盾した場合(相手の違反など)にも使う．
+    def uniform(self):
+        self.alive = np.arange(len(self.space.configs))
+        self.weights = np.ones(len(self.alive))
+        self.counts = self.count(self.alive, self.weights)
+
+    #
+    # 配置のインデックスaliveと重みweightsについて，各艦のマスごとの重みの和を返す．
+    # 配列の添字ではなくnp.takで取り出すのは，その方が数倍速いためである．
+    #
+    def count(self, alive, weights):
+        n = Player.FIELD_SIZE * Player.FIELD_SIZE
+        m = len(self.space.ship_types)
+        return np.bincount(np.take(self.space.cells, alive, axis=0).ravel(), weights=np.repeat(weights, m),
+                           minlength=m * n).reshape(m, n)
+
+    #
+    # 残っている配置のうちkeepが偽のものを消す．
+    # 消す配置が残る配置より少なければその分をcountsから引き，多ければ残る配置から数え直す．
+    # 真偽の配列の添字よりnp.compressの方が速い．
+    #
+    def remove(self, keep):
+        kept = np.count_nonzero(keep)
+        if kept == len(keep):
+            return
+        if kept == 0:
+            self.uniform()
+            return
+        if len(keep) - kept < kept:
+            drop = ~keep
+            self.counts -= self.count(np.compress(drop, self.alive), np.compress(drop, self.weights))
+            self.alive = np.compress(keep, self.alive)
+            self.weights = np.compress(keep, self.weights)
+        else:
+            self.alive = np.compress(keep, self.alive)
+            self.weights = np.compress(keep, self.weights)
+            self.counts = self.count(self.alive, self.weights)
+
+    # 配置ごとの表arrayから，残っている配置の分を取り出す．配置がすべて残っていれば(aliveは0からの連番である)そのまま返す．
+    def gather(self, array):
+        if len(self.alive) == len(array):
+            return array
+        return np.take(array, self.alive)
+
+    #
+    # 撃沈された艦を外した空間に射影する．
+    # AIPlayer.updateは撃沈を攻撃の結果より先に通知するが，艦を沈めた攻撃の結果(周囲にいた艦)はその艦を含む空間で反映する必要がある．
+    # そのため，ここでは艦を記録するだけにして，次の自分の攻撃の結果を反映した後か，他の観測や分布を読む前に射影する．
+    #
+    def reset(self, ship_type):
+        if ship_type in self.space.ship_types and ship_type not in self.sunk:
+            self.sunk.append(ship_type)
+
+    def project(self):
+        for ship_type in self.sunk:
+            space, index = self.space.projection(self.space.ship_types.index(ship_type))
+            weights = np.bincount(np.take(index, self.alive), weights=self.weights, minlength=len(space.configs))
+            self.space = space
+            self.alive = np.flatnonzero(weights)
+            self.weights = np.take(weights, self.alive)
+            self.counts = self.count(self.alive, self.weights)
+        self.sunk = []
+
+    #
+    # j番目の艦が(dx, dy)だけ移動すると，移動できない配置は消え，残りはその艦のマスだけがずれる．
+    # countsは消えた配置の分を引いてから，その艦の行をずらす．
+    #
+    def moved(self, ship_type, dx, dy):
+        self.project()
+        if ship_type not in self.space.ship_types:
+            return
+        j = self.space.ship_types.index(ship_type)
+        destination = self.gather(self.space.transition(j, dx, dy))
+        valid = destination >= 0
+        if not valid.any():
+            self.uniform()
+            return
+        self.remove(valid)
+        size = Player.FIELD_SIZE
+        row = self.counts[j].reshape(size, size)
+        shifted = np.zeros_like(row)
+        shifted[max(dx, 0):size + min(dx, 0), max(dy, 0):size + min(dy, 0)] = \
+            row[max(-dx, 0):size - max(dx, 0), max(-dy, 0):size - max(dy, 0)]
+        self.counts[j] = shifted.ravel()
+        self.alive = np.compress(valid, destination)
+
+    def attacked(self, position, hit, near):
+        cell = position[0] * Player.FIELD_SIZE + position[1]
+        self.remove(self.gather(self.space.observations[cell]) == self.space.code(hit, near))
+        self.project()
+
+    # 相手が攻撃できた，つまり相手の艦のどれかが周囲1マスにいた配置だけが残る．
+    def enemy_attacked(self, position, alive):
+        cell = position[0] * Player.FIELD_SIZE + position[1]
+        self.project()
+        self.remove(self.gather(self.space.observations[cell]) != self.space.far_code)
+
+    # 各艦の周辺分布を(艦の数, 25)の配列で返す．
+    def marginal(self):
+        self.project()
+        return self.counts / self.counts[0].sum()
+
+    def target(self, mask):
+        if not mask:
+            return None
+        self.project()
+        total = self.counts.sum(axis=0)
+        return int(np.where(mask & CELL_BITS, total, -1).argmax())
+
+    def prediction(self, ship_type):
+        self.project()
+        if ship_type not in self.space.ship_types:
+            return [[0] * Player.FIELD_SIZE for _ in range(Player.FIELD_SIZE)]
+        j = self.space.ship_types.index(ship_type)
+        return (self.counts[j] / self.counts[j].sum()).reshape(Player.FIELD_SIZE, Player.FIELD_SIZE).tolist()
+
+    # 重みと，作成済みのすべての表の大きさをバイト数で返す．
+    def nbytes(self):
+        return self.weights.nbytes + self.alive.nbytes + self.counts.nbytes + \
+            sum(space.nbytes() for space in SPACES.values())
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'test':
+        import unittest
+
+        class ExactBeliefTest(unittest.TestCase):
+
+            def test_space(self):
+                b = ExactBelief()
+                self.assertEqual(13800, len(b.space.configs))
+                self.assertAlmostEqual(1 / 25, b.marginal()[0][0])
+
+            def test_attacked(self):
+                b = ExactBelief()
+                b.attacked([0, 0], 'w', ['c'])
+                m = b.marginal()
+                self.assertAlmostEqual(1, m[0][0])
+                self.assertAlmostEqual(1 / 3, m[1][1])
+                self.assertAlmostEqual(0, m[2][1] + m[2][5] + m[2][6])
+                b.moved('w', 0, 3)
+                self.assertAlmostEqual(1, b.marginal()[0][3])
+                # cは(0,3)の位置には動けないので，移動後もcの位置の確率は変わらない．
+                self.assertAlmostEqual(1 / 3, b.marginal()[1][5])
+
+            def test_reset(self):
+                b = ExactBelief()
+                b.reset('s')
+                b.attacked([2, 2], 's', [])
+                self.assertEqual(('w', 'c'), b.space.ship_types)
+                self.assertEqual(600, len(b.space.configs))
+                self.assertAlmostEqual(1, b.marginal()[0].sum())
+                self.assertEqual(0, b.marginal()[0][12])
+                self.assertEqual([[0] * 5] * 5, b.prediction('s'))
+
+            def test_sunk_after_observation(self):
+                # AIPlayer.updateと同じく，撃沈を先に，艦を沈めた攻撃の結果を後に通知する．
+                # sは(4,4)にいたので，相手が(0,0)の周囲を攻撃できたのは残りの艦のどちらかが周囲にいたからである．
+                b = ExactBelief()
+                b.enemy_attacked([0, 0], ['w', 'c', 's'])
+                b.reset('s')
+                b.attacked([4, 4], 's', [])
+                self.assertEqual(('w', 'c'), b.space.ship_types)
+                near = np.array([cell in cells(ATTACK_MASKS[0]) for cell in range(25)])
+                configs = b.space.configs[b.alive]
+                self.assertTrue(np.all(near[configs[:, 0]] | near[configs[:, 1]]))
+
+            def test_enemy_attacked(self):
+                b = ExactBelief()
+                b.reset('w')
+                b.reset('c')
+                b.enemy_attacked([0, 0], ['s'])
+                self.assertAlmostEqual(0.25, b.marginal()[0][6])
+                self.assertEqual(0, b.marginal()[0][12])
+
+            def test_player(self):
+                from lib.engine import play
+                from players.ai_player import AIPlayer
+                from players.random_player import RandomPlayer
+
+                for seed in range(5):
+                    winner, _ = play(AIPlayer(seed, belief='exact'), RandomPlayer(seed + 100))
+                    self.assertEqual(0, winner)
+
+        unittest.main(argv=sys.argv[:1])
+    else:
+        import argparse
+        import time
+
+        from lib.engine import play
+        from players.ai_player import AIPlayer
+        from players.random_player import RandomPlayer
+
+        parser = argparse.ArgumentParser(description="Measure the exact tracker")
+        parser.add_argument("--games", type=int, default=200, help="Number of games per belief")
+        args = parser.parse_args()
+
+        start = time.perf_counter()
+        b = ExactBelief()
+        print(f"build: {(time.perf_counter() - start) * 1e3:.1f} ms")
+        # 最も時間のかかる，配置がすべて残っている状態からの1回の更新の時間を測る．複製は配列を共有するので速い．
+        for name, step in [('attacked', lambda b: b.attacked([2, 2], None, [])),
+                           ('enemy_attacked', lambda b: b.enemy_attacked([2, 2], SHIP_TYPES)),
+                           ('moved', lambda b: b.moved('w', 0, 1)),
+                           ('target', lambda b: b.target((1 << 25) - 1))]:
+            beliefs = [b.copy() for _ in range(1000)]
+            start = time.perf_counter()
+            for belief in beliefs:
+                step(belief)
+            print(f"{name}: {(time.perf_counter() - start) * 1e3:.1f} us")
+        b = ExactBelief()
+        for seed in range(25):
+            play(AIPlayer(seed, belief='exact'), RandomPlayer(seed))
+        print(f"memory: {b.nbytes() / 1024:.0f} KiB")
+
+        for belief in ['list', 'exact']:
+            start = time.perf_counter()
+            results = [play(AIPlayer(seed, belief=belief), RandomPlayer(seed + args.games))
+                       for seed in range(args.games)]
+            elapsed = time.perf_counter() - start
+            wins = sum(1 for winner, _ in results if winner == 0)
+            turns = sum(t for _, t in results) / len(results)
+            print(f"{belief}: win {wins}/{len(results)}, mean turns {turns:.1f}, "
+                  f"{len(results) / elapsed:.1f} games/s")
@@ -1,173 +1,161 @@
-import json
 import os
 import random
-import socket
 import sys
 
 sys.path.append(os.getcwd())
 
-from lib.player_base import Player, PlayerShip
+from lib.belief import BELIEFS
+from lib import client, deadline, instrument
+from lib.codec import JSON, decode
+from lib.instrument import NULL
+from lib.player_base import POSITIONS, SHIP_TYPES, Player, PlayerShip, cell_index
+from lib.speculate import NULL as NO_SPECULATION
 
 
 class AIPlayer(Player):
 
-    def __init__(self, seed=0):
-        random.seed(seed)
-
-        # フィールドを5x5の配列として持っている．
-        self.field = [[i, j] for i in range(Player.FIELD_SIZE)
-                      for j in range(Player.FIELD_SIZE)]
-
-        # 初期配置を非復元抽出でランダムに決める．
-        ps = random.sample(self.field, 3)
-        positions = {'w': ps[0], 'c': ps[1], 's': ps[2]}
+    #
+    # verboseは表示の量である．1以上なら攻撃や撃沈を，2以上なら予測も表示する．大量に対戦させる場合は0のままにしておく．
+    # beliefは予測を保持する実装である．lib/belief.pyのBELIEFSの名前かクラスを与える．
+    #
+    def __init__(self, seed=0, verbose=0, belief='list'):
+        # 他のプレイヤーと乱数の状態を共有しないように，自分専用の乱数生成器を持つ．
+        self.random = random.Random(seed)
+        self.verbose = verbose
+
+        # 初期配置を，マスのインデックスから非復元抽出でランダムに決める．
+        # 座標のリストから選んでいた時と同じ乱数の使い方なので，同じシードなら同じ配置になる．
+        n = Player.FIELD_SIZE * Player.FIELD_SIZE
+        ps = self.random.sample(range(n), len(SHIP_TYPES))
+        positions = {ship_type: POSITIONS[c][:] for ship_type, c in zip(SHIP_TYPES, ps)}
         super().__init__(positions)
 
         # 攻撃された艦を保持する．
         self.attacked_ship = None
-        
+
         # 相手のそれぞれの艦がいる場所の確率を保持する．
-        self.pred_w = [[0] * Player.FIELD_SIZE for _ in range(Player.FIELD_SIZE)]
-        self.pred_c = [[0] * Player.FIELD_SIZE for _ in range(Player.FIELD_SIZE)]
-        self.pred_s = [[0] * Player.FIELD_SIZE for _ in range(Player.FIELD_SIZE)]
-        
+        self.belief = BELIEFS[belief]() if isinstance(belief, str) else belief()
+
         # 以前の状態を保持する．
-        self.previous_enemy_ships = {'w': True, 'c': True, 's': True}
+        self.previous_enemy_ships = {ship_type: True for ship_type in SHIP_TYPES}
 
+        # 相手の艦のHPと，座標が確実に分かっている相手の艦のマスを保持する．
+        # 攻撃が命中したマスに艦がいることが分かり，その後は通知される移動の距離で追える．
+        self.enemy_hps = dict(PlayerShip.MAX_HPS)
+        self.known = {}
 
-    def action(self):
-        # 攻撃を受けた場合，攻撃された艦がランダムな場所へ移動する．
+    # 予測を5x5のリストで返す．
+    @property
+    def pred_w(self):
+        return self.belief.prediction('w')
+
+    @property
+    def pred_c(self):
+        return self.belief.prediction('c')
+
+    @property
+    def pred_s(self):
+        return self.belief.prediction('s')
+
+    def decide(self):
+        # 攻撃を受けた場合，攻撃された艦がランダムな場所へ移動する．移動先がなければ代わりに攻撃する．
+        if self.attacked_ship and not self.moves[self.attacked_ship]:
+            self.attacked_ship = None
         if self.attacked_ship:
-            print(" **************** " + self.attacked_ship + " is attacked! Move! ****************")
+            if self.verbose:
+                print(" **************** " + self.attacked_ship + " is attacked! Move! ****************")
             ship = self.ships[self.attacked_ship]
-            to = random.choice(self.field)
-            while not ship.can_reach(to) or not self.overlap(to) is None:
-                to = random.choice(self.field)
+            to = self.moves[ship.type].sample(self.random.random)
             self.attacked_ship = None
-            return json.dumps(self.move(ship.type, to))
+            return self.move(ship.type, POSITIONS[to][:])
 
         # 攻撃
         else:
-            # 3つの確率を合計して，最も値が大きいマスを攻撃する
-            max = -1
-            to = None
-            pred = self.pred_w + self.pred_c + self.pred_s
-            
-            for i in range(Player.FIELD_SIZE):
-                for j in range(Player.FIELD_SIZE):
-                    if self.can_attack([i, j]) and pred[i][j] > max:
-                        max = pred[i][j]
-                        to = [i, j]
-
-            # 初回で攻撃先が決められない場合はランダムな位置を攻撃する．
-            if to is None:
-                to = random.choice(self.field)
-                while not self.can_attack(to):
-                    to = random.choice(self.field)
-
-            return json.dumps(self.attack(to))
-
-
-    # メソッドをオーバーライド. 通知された情報で艦の状態を更新する. 
+            # 3つの確率を合計して，攻撃できるマスのうち最も値が大きいマスを攻撃する
+            cell = self.belief.target(self.attack_mask())
+
+            # 攻撃先が決められない場合はランダムな位置を攻撃する．
+            if cell is None:
+                cell = self.attacks.sample(self.random.random)
+            to = list(divmod(cell, Player.FIELD_SIZE))
+
+            return self.attack(to)
+
+    # 予測，乱数の状態，相手の艦の情報も複製する．複製は元のプレイヤーと同じ行動を選ぶ．
+    def clone(self):
+        new = super().clone()
+        new.random = random.Random()
+        new.random.setstate(self.random.getstate())
+        new.belief = self.belief.copy()
+        new.previous_enemy_ships = dict(self.previous_enemy_ships)
+        new.enemy_hps = dict(self.enemy_hps)
+        new.known = dict(self.known)
+        return new
+
+    # 時間切れの場合に送る行動である．攻撃を受けていれば，その艦を移動できるマスのどれかへ逃がす．
+    def fallback(self):
+        if self.attacked_ship in self.ships:
+            moves = self.moves[self.attacked_ship]
+            if len(moves):
+                n = Player.FIELD_SIZE * Player.FIELD_SIZE
+                return n + SHIP_TYPES.index(self.attacked_ship) * n + moves.items[0]
+        return super().fallback()
+
+    # 行動の文字列は事前に作ったものを使う．json.dumpsした場合と同じ文字列である．
+    def action(self):
+        return JSON.encode_action(self.decide())
+
+    # メソッドをオーバーライド. 通知された情報で艦の状態を更新する. 通知はlib/codec.pyで1回だけ復号する.
     def update(self, json_, is_my_turn):
-        data = json.loads(json_)
-        cond = data['condition']['me']
+        message = decode(json_)
+        me = message.me
         for ship_type in list(self.ships):
-            if ship_type not in cond:
-                self.ships.pop(ship_type)
+            if ship_type not in me:
+                self.lose(ship_type)
             else:
+                ship = self.ships[ship_type]
+                hp, ship.position = me[ship_type]
                 # 攻撃された艦を取得
-                if self.ships[ship_type].hp > cond[ship_type]['hp']:
+                if ship.hp > hp:
                     self.attacked_ship = ship_type
-                self.ships[ship_type].hp = cond[ship_type]['hp']
-                self.ships[ship_type].position = cond[ship_type]['position']
+                ship.hp = hp
 
         # 相手の艦のHPが0になった場合に，一度だけ初期化する．
-        enemy_cond = data['condition']['enemy']
-        for ship_type in ['w', 'c', 's']:
-            if ship_type not in enemy_cond and self.previous_enemy_ships[ship_type]:
-                if ship_type == 'w':
-                    self.pred_w = [[0] * Player.FIELD_SIZE for _ in range(Player.FIELD_SIZE)]
-                elif ship_type == 'c':
-                    self.pred_c = [[0] * Player.FIELD_SIZE for _ in range(Player.FIELD_SIZE)]
-                elif ship_type == 's':
-                    self.pred_s = [[0] * Player.FIELD_SIZE for _ in range(Player.FIELD_SIZE)]
-                print(" **************** Enemy " + ship_type + " destroyed! ****************")
+        enemy = message.enemy
+        self.enemy_hps = enemy
+        for ship_type in SHIP_TYPES:
+            if ship_type not in enemy and self.previous_enemy_ships[ship_type]:
+                self.belief.reset(ship_type)
+                self.known.pop(ship_type, None)
+                if self.verbose:
+                    print(" **************** Enemy " + ship_type + " destroyed! ****************")
                 self.previous_enemy_ships[ship_type] = False
 
         # 相手の移動結果を反映する．
-        if 'result' in data and 'moved' in data['result']:
-            move_result = data['result']['moved']
-            ship = move_result['ship']
-            distance = move_result['distance']
-            dx, dy = distance
-
-            if ship == 'w':
-                self.pred_w = self.move_predictions(self.pred_w, dx, dy)
-            elif ship == 'c':
-                self.pred_c = self.move_predictions(self.pred_c, dx, dy)
-            elif ship == 's':
-                self.pred_s = self.move_predictions(self.pred_s, dx, dy)
-
-        # resultとattackedが存在すれば下に進む
-        if 'result' in data and 'attacked' in data['result']:
+        if message.moved:
+            self.belief.moved(*message.moved)
+            ship_type, dx, dy = message.moved
+            if ship_type in self.known:
+                self.known[ship_type] += dx * Player.FIELD_SIZE + dy
+
+        # 攻撃の結果があれば下に進む
+        if message.attacked:
             # 自分もしくは相手の攻撃結果を受け取る
-            result = data['result']['attacked']
-            position = result['position']
-            hit = result.get('hit')
-            near = result.get('near', [])
-            
+            position, hit, near = message.attacked
+
             # 自分のターンの終わりなら，自分の攻撃結果を基にスコアを更新する．
             if is_my_turn:
-                # hitした場合は，hitした場所を1にして，それ以外を0にする．
-                if hit == 'w':
-                    self.pred_w = [[0] * Player.FIELD_SIZE for _ in range(Player.FIELD_SIZE)]
-                    self.pred_w[position[0]][position[1]] = 1
-                elif hit == 'c':
-                    self.pred_c = [[0] * Player.FIELD_SIZE for _ in range(Player.FIELD_SIZE)]
-                    self.pred_c[position[0]][position[1]] = 1
-                # sに攻撃が命中した場合は撃沈するので，上で初期化する．
-
-                # hitしなかったら，そのマスは0にする．
-                else:
-                    self.pred_w[position[0]][position[1]] = 0
-                    self.pred_c[position[0]][position[1]] = 0
-                    self.pred_s[position[0]][position[1]] = 0
-                    # 正規化を行い，合計が1になるように値を修正する．
-                    self.normalize(self.pred_w)
-                    self.normalize(self.pred_c)
-                    self.normalize(self.pred_s)
-                    
-                # nearの場合，周囲1マスに足して，中心は0にする．
-                for n in near:
-                    if n == 'w':
-                        self.update_near_predictions(self.pred_w, position)
-                    elif n == 'c':
-                        self.update_near_predictions(self.pred_c, position)
-                    elif n == 's':
-                        self.update_near_predictions(self.pred_s, position)
-
-                # nearとhitに含まれない場合，周囲のマスを0にする
-                if 'w' not in near and hit != 'w':
-                    self.clear_around_predictions(self.pred_w, position)
-                    self.normalize(self.pred_w)
-                if 'c' not in near and hit != 'c':
-                    self.clear_around_predictions(self.pred_c, position)
-                    self.normalize(self.pred_c)
-                if 's' not in near and hit != 's':
-                    self.clear_around_predictions(self.pred_s, position)
-                    self.normalize(self.pred_s)
-                    
+                self.belief.attacked(position, hit, near)
+                if hit in enemy:
+                    self.known[hit] = cell_index(position)
+
             # 相手のターンの終わりなら，相手の攻撃結果を基にスコアを更新する．
-            # すべての艦の予測マップについて，相手が攻撃した場所の周囲1マス（中心も含む）に足す．
+            # 残っている艦の予測マップについて，相手が攻撃した場所の周囲1マス（中心も含む）に足す．
             else:
-                for ship_type in ['w', 'c', 's']:
-                    if self.previous_enemy_ships[ship_type]:
-                        self.update_around_predictions(self.pred_w if ship_type == 'w' else self.pred_c if ship_type == 'c' else self.pred_s, position)
-
-            self.display_predictions()
+                alive = [ship_type for ship_type in SHIP_TYPES
+                         if self.previous_enemy_ships[ship_type]]
+                self.belief.enemy_attacked(position, alive)
 
-    
     # 確率分布をアスキーアートで表示する
     def display_predictions(self):
         print("Prediction for 'w':")
@@ -188,102 +176,18 @@ class AIPlayer(Player):
             for j in range(Player.FIELD_SIZE):
                 print(f" {pred[j][i]:.2f} |", end="")
             print("\n" + "--------" * Player.FIELD_SIZE)
-            
-    # 移動を反映させる
-    def move_predictions(self, pred, dx, dy):
-        new_pred = [[0] * Player.FIELD_SIZE for _ in range(Player.FIELD_SIZE)]
-        for i in range(Player.FIELD_SIZE):
-            for j in range(Player.FIELD_SIZE):
-                ni, nj = i + dx, j + dy
-                if Player.in_field([ni, nj]):
-                    new_pred[ni][nj] = pred[i][j]
-        return new_pred
-    
-    # 周囲のマスの数に基づいて，加算する値を決める．
-    # nearの場合，中心の1マスは計算しない．
-    def update_near_predictions(self, pred, position):
-        neighbors = [(dx, dy) for dx in [-1, 0, 1] for dy in [-1, 0, 1] if (dx != 0 or dy != 0)]
-        valid_neighbors = [n for n in neighbors if Player.in_field([position[0] + n[0], position[1] + n[1]])]
-        factor = 1 / len(valid_neighbors)
-        for dx, dy in valid_neighbors:
-            x, y = position[0] + dx, position[1] + dy
-            pred[x][y] += factor
-        pred[position[0]][position[1]] = 0
-        self.divide_two(pred)
-
-    # 攻撃の場合，中心も含めて計算する．
-    def update_around_predictions(self, pred, position):
-        neighbors = [(dx, dy) for dx in [-1, 0, 1] for dy in [-1, 0, 1]]
-        valid_neighbors = [n for n in neighbors if Player.in_field([position[0] + n[0], position[1] + n[1]])]
-        factor = 1 / len(valid_neighbors)
-        for dx, dy in valid_neighbors:
-            x, y = position[0] + dx, position[1] + dy
-            pred[x][y] += factor
-        self.divide_two(pred)
-        
-    # 周囲9マスを0にする．
-    def clear_around_predictions(self, pred, position):
-        # 値が1のマスがあれば更新を行わない．
-        if any(pred[i][j] == 1 for i in range(Player.FIELD_SIZE) for j in range(Player.FIELD_SIZE)):
-            return
-        neighbors = [(dx, dy) for dx in [-1, 0, 1] for dy in [-1, 0, 1]]
-        valid_neighbors = [n for n in neighbors if Player.in_field([position[0] + n[0], position[1] + n[1]])]
-        for dx, dy in valid_neighbors:
-            x, y = position[0] + dx, position[1] + dy
-            pred[x][y] = 0
-                
-    # 確率分布を2で割るメソッド
-    def divide_two(self, pred):
-        # 初回は割る必要がないため，合計が約1であり，約2ではない場合は割らないようにする．
-        total = sum(sum(row) for row in pred)
-        # 1に近い値の場合は割らない．つまり，1との差が0.1よりも大きいならば割る．
-        if abs(total - 1) > 0.1:
-            for i in range(Player.FIELD_SIZE):
-                for j in range(Player.FIELD_SIZE):
-                    if pred[i][j] != 0:
-                        pred[i][j] /= 2
-
-    # 正規化を行う．ヒットしなかった場合に使用する．
-    def normalize(self, pred):
-        total = sum(sum(row) for row in pred)
-        if total > 0:
-            for i in range(Player.FIELD_SIZE):
-                for j in range(Player.FIELD_SIZE):
-                    pred[i][j] /= total
-
-
-# 仕様に従ってサーバとソケット通信を行う．
-def main(host, port, seed=0):
-    assert isinstance(host, str) and isinstance(port, int)
-
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-        sock.connect((host, port))
-        with sock.makefile(mode='rw', buffering=1) as sockfile:
-            get_msg = sockfile.readline()
-            print(get_msg)
-            player = AIPlayer(seed)
-            sockfile.write(player.initial_condition()+'\n')
-
-            while True:
-                info = sockfile.readline().rstrip()
-                print(info)
-                if info == "your turn":
-                    sockfile.write(player.action()+'\n')
-                    get_msg = sockfile.readline()
-                    player.update(get_msg, is_my_turn=True)
-                elif info == "waiting":
-                    get_msg = sockfile.readline()
-                    player.update(get_msg, is_my_turn=False)
-                elif info == "you win":
-                    break
-                elif info == "you lose":
-                    break
-                elif info == "even":
-                    break
-                else:
-                    raise RuntimeError("unknown information")
 
 
+#
+# 仕様に従ってサーバとソケット通信を行う(lib/client.py)．
+# verboseが0なら何も表示せず，1ならサーバからのメッセージ，2なら予測も表示する．
+# instruments，deadline，speculatorはlib/client.pyのrunに渡す．
+#
+def main(host, port, seed=0, belief='list', verbose=1, instruments=NULL, deadline=None,
+         speculator=NO_SPECULATION):
+    return client.run(host, port, lambda: AIPlayer(seed, verbose=verbose, belief=belief), verbose=verbose,
+                      instruments=instruments, deadline=deadline, speculator=speculator)
+
 if __name__ == '__main__':
     import argparse
 
@@ -307,6 +211,18 @@ if __name__ == '__main__':
         required=False,
         default=0,
     )
+    parser.add_argument(
+        "--belief",
+        type=str,
+        help="Implementation of the prediction. E.g., list, numpy",
+        required=False,
+        default="list",
+    )
+    instrument.add_arguments(parser)
+    deadline.add_arguments(parser)
     args = parser.parse_args()
 
-    main(args.host, args.port, seed=args.seed)
+    instruments = instrument.from_args(args)
+    main(args.host, args.port, seed=args.seed, belief=args.belief, verbose=args.verbose,
+         instruments=instruments, deadline=deadline.from_args(args))
+    instrument.finish(instruments, args)
@@ -1,81 +1,58 @@
-import json
 import os
 import random
-import socket
 import sys
 
 sys.path.append(os.getcwd())
 
-from lib.player_base import Player, PlayerShip
+from lib import client, deadline, instrument
+from lib.codec import JSON
+from lib.instrument import NULL
+from lib.player_base import POSITIONS, SHIP_TYPES, Player
 
 
 class RandomPlayer(Player):
 
     def __init__(self, seed=0):
-        random.seed(seed)
-
-        # フィールドを2x2の配列として持っている．
-        self.field = [[i, j] for i in range(Player.FIELD_SIZE)
-                      for j in range(Player.FIELD_SIZE)]
-
-        # 初期配置を非復元抽出でランダムに決める．
-        ps = random.sample(self.field, 3)
-        positions = {'w': ps[0], 'c': ps[1], 's': ps[2]}
+        # 他のプレイヤーと乱数の状態を共有しないように，自分専用の乱数生成器を持つ．
+        self.random = random.Random(seed)
+
+        # 初期配置を，マスのインデックスから非復元抽出でランダムに決める．
+        # 座標のリストから選んでいた時と同じ乱数の使い方なので，同じシードなら同じ配置になる．
+        n = Player.FIELD_SIZE * Player.FIELD_SIZE
+        ps = self.random.sample(range(n), len(SHIP_TYPES))
+        positions = {ship_type: POSITIONS[c][:] for ship_type, c in zip(SHIP_TYPES, ps)}
         super().__init__(positions)
 
     #
     # 移動か攻撃かランダムに決める．
     # どれがどこへ移動するか，あるいはどこに攻撃するかもランダム．
+    # 移動先と攻撃先はPlayerが持つ規則に合うマスの集合から一様に選ぶ．選んだ艦に移動先がなければ攻撃する．
     #
-    def action(self):
-        act = random.choice(["move", "attack"])
+    def decide(self):
+        act = self.random.choice(["move", "attack"])
 
         if act == "move":
-            ship = random.choice(list(self.ships.values()))
-            to = random.choice(self.field)
-            while not ship.can_reach(to) or not self.overlap(to) is None:
-                to = random.choice(self.field)
-
-            return json.dumps(self.move(ship.type, to))
-        elif act == "attack":
-            to = random.choice(self.field)
-            while not self.can_attack(to):
-                to = random.choice(self.field)
-
-            return json.dumps(self.attack(to))
-
-
-# 仕様に従ってサーバとソケット通信を行う．
-def main(host, port, seed=0):
-    assert isinstance(host, str) and isinstance(port, int)
-
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-        sock.connect((host, port))
-        with sock.makefile(mode='rw', buffering=1) as sockfile:
-            get_msg = sockfile.readline()
-            print(get_msg)
-            player = RandomPlayer(seed)
-            sockfile.write(player.initial_condition()+'\n')
+            ship = self.random.choice(list(self.ships.values()))
+            if self.moves[ship.type]:
+                to = self.moves[ship.type].sample(self.random.random)
+                return self.move(ship.type, POSITIONS[to][:])
+            act = "attack"
+        if act == "attack":
+            to = self.attacks.sample(self.random.random)
+            return self.attack(POSITIONS[to][:])
+
+    # 行動の文字列は事前に作ったものを使う．json.dumpsした場合と同じ文字列である．
+    def action(self):
+        return JSON.encode_action(self.decide())
 
-            while True:
-                info = sockfile.readline().rstrip()
-                print(info)
-                if info == "your turn":
-                    sockfile.write(player.action()+'\n')
-                    get_msg = sockfile.readline()
-                    player.update(get_msg)
-                elif info == "waiting":
-                    get_msg = sockfile.readline()
-                    player.update(get_msg)
-                elif info == "you win":
-                    break
-                elif info == "you lose":
-                    break
-                elif info == "even":
-                    break
-                else:
-                    raise RuntimeError("unknown information")
 
+#
+# 仕様に従ってサーバとソケット通信を行う(lib/client.py)．
+# verboseが0なら何も表示しない．instrumentsとdeadlineはlib/client.pyのrunに渡す．
+#
+def main(host, port, seed=0, verbose=1, instruments=NULL, deadline=None):
+    return client.run(host, port, lambda: RandomPlayer(seed), verbose=verbose, instruments=instruments,
+                      deadline=deadline)
 
 if __name__ == '__main__':
     import argparse
@@ -100,6 +77,11 @@ if __name__ == '__main__':
         required=False,
         default=0,
     )
+    instrument.add_arguments(parser)
+    deadline.add_arguments(parser)
     args = parser.parse_args()
 
-    main(args.host, args.port, seed=args.seed)
+    instruments = instrument.from_args(args)
+    main(args.host, args.port, seed=args.seed, verbose=args.verbose, instruments=instruments,
+         deadline=deadline.from_args(args))
+    instrument.finish(instruments, args)
@@ -0,0 +1,397 @@
+import copy
+import math
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+
+from lib import client, deadline, instrument
+from lib.belief import SHIP_TYPES, np
+from lib.histogram import Histogram
+from lib.instrument import NULL
+from lib.player_base import ATTACK_MASKS, REACH_MASKS, Player, default_rules
+from lib.speculate import NULL as NO_SPECULATION
+from players.ai_player import AIPlayer
+
+if np is not None:
+    from lib.tracker import ExactBelief
+else:
+    ExactBelief = None
+
+
+#
+# 探索で行動を決めるプレイヤーである．
+# 予測から相手の艦の配置を標本として取り出し，配置を1つ決めた(完全情報の)対戦を短く模擬して行動を評価する．
+# 根の行動をUCB1で選びながら模擬を繰り返し，時間の予算を使い切ったら最も多く試した行動を返す．
+#
+# 模擬の中では，艦の状態を艦種の順に並べたマスのリスト(沈んだ艦は-1)とHPのリストで持ち，
+# 行動は整数で表す．マスの数をnとすると，n未満はそのマスへの攻撃，n + k * n + マスはk番目の艦の移動である．
+# 模擬の1回ごとに作るのはこのリストのコピーだけである．
+#
+
+N = Player.FIELD_SIZE * Player.FIELD_SIZE
+
+# 1手あたりの時間の予算(秒)の既定値である．
+BUDGET = 0.02
+# 模擬するプライ数である．
+HORIZON = 10
+# 1手ごとに取り出す配置の標本の数である．
+SAMPLES = 64
+# UCB1の探索の強さである．
+EXPLORATION = 0.7
+# 模擬の中で，攻撃できる相手の艦がいればそれを攻撃する確率である．
+GREEDY = 0.5
+# 時間を確かめる間隔(模擬の回数)である．
+CHECK = 16
+# HPの合計である．評価値を-1から1の間にするのに使う．
+TOTAL_HP = 6
+
+
+#
+# 行動を適用する．攻撃で相手の艦をすべて沈めた場合はTrueを返す．
+# 行動が規則に合っているかは確かめないので，正しい行動だけを与える．
+#
+def apply(action, mine, enemy, enemy_hps):
+    if action < N:
+        for k in range(3):
+            if enemy[k] == action:
+                enemy_hps[k] -= 1
+                if enemy_hps[k] == 0:
+                    enemy[k] = -1
+                    return enemy[0] < 0 and enemy[1] < 0 and enemy[2] < 0
+        return False
+    k, to = divmod(action - N, N)
+    mine[k] = to
+    return False
+
+
+#
+# 模擬の中の行動の方策である．確率greedyで攻撃できる相手の艦を攻撃し，
+# それ以外はRandomPlayerと同じく，半々で範囲内のマスへの攻撃か艦の移動を選ぶ．
+#
+def rollout_action(random, mine, enemy, greedy):
+    attack = 0
+    occupied = 0
+    for c in mine:
+        if c >= 0:
+            attack |= ATTACK_MASKS[c]
+            occupied |= 1 << c
+    if random() < greedy:
+        for c in enemy:
+            if c >= 0 and attack >> c & 1:
+                return c
+    if random() < 0.5:
+        k = int(random() * 3)
+        while mine[k] < 0:
+            k = int(random() * 3)
+        mask = REACH_MASKS[mine[k]] & ~occupied
+        if mask:
+            while True:
+                to = int(random() * N)
+                if mask >> to & 1:
+                    return N + k * N + to
+    while True:
+        to = int(random() * N)
+        if attack >> to & 1:
+            return to
+
+
+#
+# 自分の行動actionの後，相手の手番から最大horizonプライを模擬し，(評価値, プライ数)を返す．
+# 評価値は，勝ちなら1，負けなら-1，決着しなければ与えたダメージと受けたダメージの差をHPの合計で割ったもの．
+#
+def simulate(random, action, mine, my_hps, enemy, enemy_hps, horizon, greedy):
+    my_total = sum(my_hps)
+    enemy_total = sum(enemy_hps)
+    if apply(action, mine, enemy, enemy_hps):
+        return 1.0, 1
+    for ply in range(horizon):
+        if ply % 2 == 0:
+            if apply(rollout_action(random, enemy, mine, greedy), enemy, mine, my_hps):
+                return -1.0, ply + 2
+        else:
+            if apply(rollout_action(random, mine, enemy, greedy), mine, enemy, enemy_hps):
+                return 1.0, ply + 2
+    return ((enemy_total - sum(enemy_hps)) - (my_total - sum(my_hps))) / TOTAL_HP, horizon + 1
+
+
+class SearchPlayer(AIPlayer):
+
+    #
+    # 予測の更新や撃沈，移動の追跡はAIPlayerのものを使い，行動の決定だけを探索に置き換える．
+    # beliefの既定値は，numpyがあれば配置を厳密に持つexact，なければlistである．
+    # budgetは1手あたりの時間(秒)で，Noneなら時間で打ち切らない．max_playoutsは1手あたりの模擬の回数の上限である．
+    # policy_cacheにlib/policy_cache.pyのPolicyCacheを与えると，対称変換で同じになる状態では探索せずに記憶した行動を使う．
+    #
+    def __init__(self, seed=0, verbose=0, belief=None, budget=BUDGET, max_playouts=None,
+                 horizon=HORIZON, samples=SAMPLES, policy_cache=None):
+        # 模擬は艦が3隻の既定の規則を前提にしている．
+        if not default_rules():
+            raise ValueError('SearchPlayer supports only the default field and fleet')
+        if belief is None:
+            belief = 'exact' if np is not None else 'list'
+        super().__init__(seed, verbose=verbose, belief=belief)
+        if budget is None and max_playouts is None:
+            raise ValueError('budget or max_playouts is required')
+        self.budget = budget
+        self.max_playouts = max_playouts
+        self.horizon = horizon
+        self.samples = samples
+        self.policy_cache = policy_cache
+        # このゲームでpolicy_cacheを引いた状態(正規形)の集合である．
+        self.visited = set()
+        # 1手ごとの探索の統計である．
+        self.last_stats = None
+        self.rates = Histogram()
+        self.playouts = Histogram()
+        # is_setを持つオブジェクト(lib/speculate.pyのPoll)を与えると，真になった時点で探索を打ち切る．先読みをやめる時に使う．
+        self.interrupt = None
+
+    # 探索の統計も複製する．先読みで捨てた探索の分が元のプレイヤーの統計に入らないようにする．policy_cacheは表なので共有する．
+    def clone(self):
+        new = super().clone()
+        new.rates = copy.deepcopy(self.rates)
+        new.playouts = copy.deepcopy(self.playouts)
+        new.visited = set(self.visited)
+        return new
+
+    # 自分の艦のマスとHPを艦種の順に並べたリストで返す．
+    def fleet(self):
+        mine = [-1, -1, -1]
+        hps = [0, 0, 0]
+        for k, ship_type in enumerate(SHIP_TYPES):
+            ship = self.ships.get(ship_type)
+            if ship is not None:
+                mine[k] = ship.cell
+                hps[k] = ship.hp
+        return mine, hps
+
+    #
+    # 相手の艦の配置の標本をk個，艦種の順のマスのリストで返す．
+    # ExactBeliefなら配置の重みから取り出す．それ以外は艦ごとの予測から独立に取り出し，重なった配置は取り直す．
+    # 座標が分かっている艦はそのマスに置く．
+    #
+    def sample_configurations(self, k):
+        alive = [ship_type for ship_type in SHIP_TYPES if ship_type in self.enemy_hps]
+        random = self.random.random
+        if ExactBelief is not None and isinstance(self.belief, ExactBelief) \
+                and list(self.belief.space.ship_types) == alive:
+            cumulative = np.cumsum(self.belief.weights)
+            index = np.searchsorted(cumulative, [random() * cumulative[-1] for _ in range(k)], side='right')
+            configs = self.belief.space.configs[self.belief.alive[np.minimum(index, len(cumulative) - 1)]].tolist()
+            positions = [SHIP_TYPES.index(ship_type) for ship_type in alive]
+            samples = []
+            for config in configs:
+                sample = [-1, -1, -1]
+                for j, cell in zip(positions, config):
+                    sample[j] = cell
+                samples.append(sample)
+            return samples
+
+        weights = {}
+        for ship_type in alive:
+            if ship_type in self.known:
+                weights[ship_type] = [1 if cell == self.known[ship_type] else 0 for cell in range(N)]
+            else:
+                # 予測が0のマスにも少しだけ重みを与え，予測が外れていても配置を取り出せるようにする．
+                weights[ship_type] = [p + 1e-3 for row in self.belief.prediction(ship_type) for p in row]
+        samples = []
+        while len(samples) < k:
+            sample = [-1, -1, -1]
+            for ship_type in alive:
+                sample[SHIP_TYPES.index(ship_type)] = self.random.choices(range(N), weights[ship_type])[0]
+            placed = [cell for cell in sample if cell >= 0]
+            if len(set(placed)) == len(placed):
+                samples.append(sample)
+        return samples
+
+    #
+    # 根の行動をUCB1で選んで模擬を繰り返し，最も多く試した行動を返す．同じ回数なら評価値の平均が大きいものを選ぶ．
+    # 統計はlast_statsに残す．
+    #
+    def search(self):
+        start = time.perf_counter()
+        deadline = start + self.budget if self.budget is not None else None
+        # 根の行動はPlayerが持つ規則に合う行動の集合である．行動の整数の表し方も同じである．
+        actions = self.legal_actions()
+        samples = self.sample_configurations(self.samples)
+        mine, my_hps = self.fleet()
+        enemy_hps = [self.enemy_hps.get(ship_type, 0) for ship_type in SHIP_TYPES]
+        random = self.random.random
+        horizon = self.horizon
+        m = len(actions)
+        visits = [0] * m
+        totals = [0.0] * m
+        playouts = plies = 0
+        log, sqrt = math.log, math.sqrt
+        while True:
+            if playouts < m:
+                i = playouts
+            else:
+                c = EXPLORATION * sqrt(log(playouts))
+                best = -math.inf
+                for j in range(m):
+                    u = totals[j] / visits[j] + c / sqrt(visits[j])
+                    if u > best:
+                        best = u
+                        i = j
+            value, depth = simulate(random, actions[i], mine[:], my_hps[:], samples[playouts % len(samples)][:],
+                                    enemy_hps[:], horizon, GREEDY)
+            visits[i] += 1
+            totals[i] += value
+            playouts += 1
+            plies += depth
+            if playouts % CHECK == 0:
+                if self.max_playouts is not None and playouts >= self.max_playouts:
+                    break
+                if deadline is not None and time.perf_counter() >= deadline:
+                    break
+                if self.interrupt is not None and self.interrupt.is_set():
+                    break
+
+        # 打ち切られて一度も試していない行動があれば，試した行動だけから選ぶ．
+        i = max(range(min(m, playouts)), key=lambda j: (visits[j], totals[j] / visits[j]))
+        elapsed = time.perf_counter() - start
+        self.last_stats = {
+            "playouts": playouts,
+            "elapsed_ms": elapsed * 1e3,
+            "playouts_per_s": playouts / elapsed,
+            "actions": m,
+            "best_visits": visits[i],
+            "best_value": totals[i] / visits[i],
+            "mean_depth": plies / playouts,
+        }
+        self.rates.record(playouts / elapsed)
+        self.playouts.record(playouts)
+        return actions[i]
+
+    # policy_cacheに記憶した行動を使った場合は探索しないので，last_statsはNoneになる．
+    def decide(self):
+        self.last_stats = None
+        action = self.search() if self.policy_cache is None else self.policy_cache.action(self)
+        self.attacked_ship = None
+        if self.verbose and self.last_stats is not None:
+            s = self.last_stats
+            print(f" search: {s['playouts']} playouts in {s['elapsed_ms']:.1f} ms "
+                  f"({s['playouts_per_s']:.0f}/s), {s['actions']} actions, "
+                  f"best {s['best_visits']} visits, value {s['best_value']:+.3f}, depth {s['mean_depth']:.1f}")
+        return self.act(action)
+
+    # 対戦全体の探索の統計を連想配列で返す．
+    def summary(self):
+        return {"moves": self.playouts.count,
+                "playouts": self.playouts.summary(),
+                "playouts_per_s": self.rates.summary()}
+
+
+#
+# 仕様に従ってサーバとソケット通信を行う(lib/client.py)．最後のプレイヤーを返す．
+# verboseが0なら何も表示せず，1ならサーバからのメッセージと探索の統計を表示する．
+# instruments，deadline，speculatorはlib/client.pyのrunに渡す．
+#
+def main(host, port, seed=0, belief=None, budget=BUDGET, verbose=1, instruments=NULL, deadline=None,
+         speculator=NO_SPECULATION):
+    return client.run(host, port, lambda: SearchPlayer(seed, verbose=verbose, belief=belief, budget=budget),
+                      verbose=verbose, instruments=instruments, deadline=deadline, speculator=speculator)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'test':
+        import unittest
+
+        from lib.engine import play
+        from players.random_player import RandomPlayer
+
+        class SearchPlayerTest(unittest.TestCase):
+
+            def test_apply(self):
+                mine, enemy, enemy_hps = [0, 1, 2], [5, -1, 7], [1, 0, 1]
+                self.assertEqual(False, apply(5, mine, enemy, enemy_hps))
+                self.assertEqual([-1, -1, 7], enemy)
+                self.assertEqual(False, apply(N + 2 * N + 12, mine, enemy, enemy_hps))
+                self.assertEqual([0, 1, 12], mine)
+                self.assertEqual(True, apply(7, mine, enemy, enemy_hps))
+
+            def test_legal(self):
+                # 探索の選ぶ行動は，いつも規則に合っている．
+                class CheckedPlayer(SearchPlayer):
+                    def decide(self):
+                        act = super().decide()
+                        if "attack" in act:
+                            test.assertTrue(self.can_attack(act["attack"]["to"]))
+                        return act
+
+                test = self
+                for seed in range(3):
+                    for belief in ['list', 'exact'] if np is not None else ['list']:
+                        player = CheckedPlayer(seed, belief=belief, budget=None, max_playouts=64)
+                        play(player, RandomPlayer(seed + 100), max_turns=200)
+                        self.assertTrue(player.summary()["moves"] > 0)
+
+            def test_kill(self):
+                # 座標の分かっている最後の艦が範囲内にいれば，それを攻撃する．
+                p = SearchPlayer(0, belief='list', budget=None, max_playouts=256)
+                p.update({"condition": {"me": {"w": {"hp": 3, "position": [2, 2]}},
+                                        "enemy": {"s": {"hp": 1}}}}, False)
+                p.known = {'s': 13}
+                self.assertEqual({"attack": {"to": [2, 3]}}, p.decide())
+                self.assertEqual(1.0, p.last_stats["best_value"])
+
+            def test_deadline(self):
+                p = SearchPlayer(0, budget=0.01)
+                start = time.perf_counter()
+                p.decide()
+                self.assertLess(time.perf_counter() - start, 0.1)
+                self.assertTrue(p.last_stats["playouts"] >= CHECK)
+
+        unittest.main(argv=sys.argv[:1])
+    else:
+        import argparse
+
+        parser = argparse.ArgumentParser(description="Search Player for Submaline Game")
+        parser.add_argument(
+            "host",
+            metavar="H",
+            type=str,
+            help="Hostname of the server. E.g., localhost",
+        )
+        parser.add_argument(
+            "port",
+            metavar="P",
+            type=int,
+            help="Port of the server. E.g., 2000",
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            help="Random seed of the player",
+            required=False,
+            default=0,
+        )
+        parser.add_argument(
+            "--belief",
+            type=str,
+            help="Implementation of the prediction. E.g., exact, list",
+            required=False,
+            default=None,
+        )
+        parser.add_argument(
+            "--budget",
+            type=float,
+            help="Seconds to search per move",
+            required=False,
+            default=BUDGET,
+        )
+        instrument.add_arguments(parser)
+        deadline.add_arguments(parser)
+        args = parser.parse_args()
+
+        instruments = instrument.from_args(args)
+        player = main(args.host, args.port, seed=args.seed, belief=args.belief, budget=args.budget,
+                      verbose=args.verbose, instruments=instruments, deadline=deadline.from_args(args))
+        summary = player.summary()
+        if summary["moves"]:
+            print(f"search: {summary['moves']} moves, "
+                  f"playouts/move p50 {summary['playouts']['p50']:.0f}, "
+                  f"playouts/s mean {summary['playouts_per_s']['mean']:.0f}", file=sys.stderr)
+        instrument.finish(instruments, args)
@@ -0,0 +1,350 @@
+import asyncio
+import collections
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+
+from lib.codec import accept, offer
+from lib.engine import MAX_TURNS, Server
+from lib.histogram import Histogram
+from lib.records import RecordWriter
+
+
+#
+# server.rbと同じ通信の手順と規則で対戦を処理するサーバである．
+# server.rbは2人のプレイヤーで1回対戦すると終了するが，こちらは接続を待合室(Lobby)で2つずつ組にして，
+# 1つのポートで多数の対戦を同時に処理する．既存のクライアントはそのまま使える．
+# 挨拶の行でlib/codec.pyの簡潔な形式を提示し，応じたクライアントとはその形式で通信する．
+#
+
+GREETING = "you are connected. please send me initial state."
+
+# 1行を待つ時間(秒)の既定値である．行動が届かなければ，そのクライアントの負けにする．
+TURN_TIMEOUT = 30.0
+
+
+# 対戦の数，ターンの待ち時間，接続数を数えるクラスである．
+class Stats:
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.started = 0
+        self.finished = 0
+        self.errors = 0
+        self.sessions = 0
+        self.outcomes = collections.Counter()
+        # "your turn"を送ってから行動を処理し終えるまでの時間(ミリ秒)である．
+        self.turn_latency = Histogram()
+
+    # 今の状態を連想配列で返す．
+    def snapshot(self):
+        elapsed = time.perf_counter() - self.start
+        latency = self.turn_latency.summary()
+        return {
+            "active_sessions": self.sessions,
+            "active_matches": self.started - self.finished - self.errors,
+            "finished_matches": self.finished,
+            "failed_matches": self.errors,
+            "matches_per_second": self.finished / elapsed if elapsed > 0 else 0.0,
+            "turns": latency["count"],
+            "turn_latency_ms": {key: latency[key] for key in ["p50", "p90", "p99", "max"]},
+        }
+
+
+#
+# 接続を受け付けて2つずつ組にし，対戦を処理するクラスである．
+# max_matchesを与えると，その数の対戦が終わった時点でfinishedがセットされる．
+# recorderにlib/records.pyのRecordWriterを与えると，最後まで終わった対戦を記録する．
+# timeoutはクライアントから1行を待つ秒数で，Noneなら待ち続ける．
+#
+class Lobby:
+
+    def __init__(self, max_turns=MAX_TURNS, max_matches=None, verbose=False, recorder=None,
+                 timeout=TURN_TIMEOUT):
+        self.recorder = recorder
+        self.timeout = timeout
+        self.max_turns = max_turns
+        self.max_matches = max_matches
+        self.verbose = verbose
+        self.waiting = None
+        self.stats = Stats()
+        self.finished = asyncio.Event()
+
+    # asyncio.start_serverに渡す．相手を待っている接続があれば組にして対戦を始める．
+    # 待っている接続が既に切れていれば，その接続は閉じて，新しい接続を代わりに待たせる．
+    async def accept(self, reader, writer):
+        self.stats.sessions += 1
+        if self.waiting is not None and (self.waiting[0].at_eof() or self.waiting[1].is_closing()):
+            self.waiting[1].close()
+            self.stats.sessions -= 1
+            self.waiting = None
+        if self.waiting is None:
+            self.waiting = (reader, writer)
+            return
+        streams = [self.waiting, (reader, writer)]
+        self.waiting = None
+        await self.match(streams)
+
+    #
+    # 1回の対戦を処理する．接続が切れたり，初期配置が読めなかったりした場合は，その対戦を失敗として数える．
+    # 対戦の途中の行動の誤りはLobby.playで負けにするので，ここに届くのはそれ以外の例外である．
+    # どの例外でも数えてから閉じるので，max_matchesを与えた場合に終わらなくなることはない．
+    #
+    async def match(self, streams):
+        self.stats.started += 1
+        try:
+            winner = await self.play(streams)
+        except Exception:
+            self.stats.errors += 1
+        else:
+            self.stats.finished += 1
+            self.stats.outcomes["even" if winner == -1 else "player%d" % (winner + 1)] += 1
+        finally:
+            for _, writer in streams:
+                writer.close()
+            self.stats.sessions -= 2
+            done = self.stats.finished + self.stats.errors
+            if self.max_matches is not None and done >= self.max_matches:
+                self.finished.set()
+
+    # 1行読む．接続が切れていればConnectionErrorを，timeoutの間に届かなければTimeoutErrorを送出する．
+    async def readline(self, reader):
+        line = await asyncio.wait_for(reader.readline(), self.timeout)
+        if not line:
+            raise ConnectionError("connection closed")
+        return line
+
+    #
+    # 行動プレイヤーcの行動を読んで処理し，(行動, 通知)を返す．
+    # 行動が時間内に届かない場合や，読めない，処理できない場合は，空の行動としてcの負けの通知を作る．
+    # 接続が切れた場合だけは例外をそのまま送出する．
+    #
+    async def action(self, server, codec, reader, c):
+        try:
+            act = codec.decode_action((await self.readline(reader)).decode())
+            return act, server.action(c, act)
+        except ConnectionError:
+            raise
+        except Exception:
+            return {}, server.action(c, {})
+
+    # server.rbのmainと同じ手順で対戦させる．勝利したプレイヤーのインデックスを返す．引き分けは-1である．
+    async def play(self, streams):
+        for _, writer in streams:
+            writer.write((GREETING + offer() + '\n').encode())
+        # プレイヤーごとに初期配置と通信の形式を受け取る．
+        positions, codecs = zip(*[accept(await self.readline(reader)) for reader, _ in streams])
+        server = Server(*positions)
+        record = self.recorder.start(*positions) if self.recorder is not None else None
+
+        # バトル回数を保持する変数．
+        i = 0
+        # 行動プレイヤーを保持する変数．
+        c = 0
+        winner = -1
+        while winner == -1 and i < self.max_turns:
+            start = time.perf_counter()
+            streams[c][1].write(b"your turn\n")
+            streams[1 - c][1].write(b"waiting\n")
+            act, results = await self.action(server, codecs[c], streams[c][0], c)
+            if record is not None:
+                record.turn(c, act, results)
+            streams[c][1].write((codecs[c].encode(results[0]) + '\n').encode())
+            streams[1 - c][1].write((codecs[1 - c].encode(results[1]) + '\n').encode())
+            self.stats.turn_latency.record((time.perf_counter() - start) * 1e3)
+
+            if "outcome" in results[0]:
+                winner = c if results[0]["outcome"] else 1 - c
+            c = 1 - c
+            i += 1
+
+        if winner == -1:
+            for _, writer in streams:
+                writer.write(b"even\n")
+        else:
+            streams[winner][1].write(b"you win\n")
+            streams[1 - winner][1].write(b"you lose\n")
+        for _, writer in streams:
+            await writer.drain()
+        if record is not None:
+            record.finish(winner)
+        if self.verbose:
+            print("even" if winner == -1 else "player" + str(1 + winner) + " win")
+        return winner
+
+
+# 一定の間隔で統計を標準エラー出力に表示する．
+async def report(lobby, interval):
+    while True:
+        await asyncio.sleep(interval)
+        print(json.dumps(lobby.stats.snapshot()), file=sys.stderr)
+
+
+async def main(opts):
+    recorder = RecordWriter(opts.record) if opts.record else None
+    lobby = Lobby(max_turns=opts.max_turns, max_matches=opts.matches, verbose=not opts.quiet,
+                  recorder=recorder, timeout=opts.turn_timeout if opts.turn_timeout > 0 else None)
+    # 同時に多数の接続を受けるので，接続待ちの数を大きくしておく．
+    server = await asyncio.start_server(lobby.accept, opts.ipaddr, opts.port, backlog=opts.backlog)
+    print("listening %s %s" % (opts.ipaddr, opts.port), file=sys.stderr)
+    reporter = asyncio.create_task(report(lobby, opts.stats_interval))
+    async with server:
+        await lobby.finished.wait()
+    reporter.cancel()
+    if recorder is not None:
+        recorder.close()
+    print(json.dumps(lobby.stats.snapshot()), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'test':
+        import contextlib
+        import functools
+        import io
+        import tempfile
+        import threading
+        import unittest
+
+        from lib.async_client import run_sessions
+        from lib.records import RecordReader, replay
+        from players import ai_player, random_player, search_player
+
+        class LobbyTest(unittest.TestCase):
+
+            def serve(self, client, matches, recorder=None, timeout=TURN_TIMEOUT):
+                async def run():
+                    lobby = Lobby(max_matches=matches, recorder=recorder, timeout=timeout)
+                    server = await asyncio.start_server(lobby.accept, '127.0.0.1', 0)
+                    port = server.sockets[0].getsockname()[1]
+                    async with server:
+                        results = await client(port)
+                        await lobby.finished.wait()
+                    return lobby, results
+                return asyncio.run(run())
+
+            # 既存のクライアントのmain(どれもlib/client.pyのrunを使う)をそのまま使って対戦できることを確かめる．
+            def test_unmodified_clients(self):
+                async def client(port):
+                    def run(main, seed):
+                        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                            main('127.0.0.1', port, seed=seed)
+                    search = functools.partial(search_player.main, budget=0.001)
+                    threads = [threading.Thread(target=run, args=(random_player.main, 1)),
+                               threading.Thread(target=run, args=(ai_player.main, 2)),
+                               threading.Thread(target=run, args=(search, 3)),
+                               threading.Thread(target=run, args=(ai_player.main, 4))]
+                    for t in threads:
+                        t.start()
+                    while any(t.is_alive() for t in threads):
+                        await asyncio.sleep(0.01)
+
+                lobby, _ = self.serve(client, 2)
+                self.assertEqual(2, lobby.stats.finished)
+                self.assertEqual(0, lobby.stats.sessions)
+
+            def test_many_matches(self):
+                async def client(port):
+                    return await run_sessions('127.0.0.1', port, random_player.RandomPlayer,
+                                              range(200), 200)
+
+                lobby, results = self.serve(client, 100)
+                stats = lobby.stats.snapshot()
+                self.assertEqual(100, stats["finished_matches"])
+                self.assertEqual(results["you win"], results["you lose"])
+                self.assertEqual(0, stats["active_sessions"])
+                self.assertTrue(stats["turn_latency_ms"]["p50"] > 0)
+
+            #
+            # 初期配置を送った後，自分の番にactionsの行を順に送り，最後の行("you win"など)を返すクライアントである．
+            # 送る行がなくなったら何も送らずに待つ．
+            #
+            async def raw_client(self, port, actions, delay=0.0):
+                await asyncio.sleep(delay)
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                await reader.readline()
+                writer.write(b'{"w": [0, 0], "c": [0, 1], "s": [0, 2]}\n')
+                actions = list(actions)
+                while True:
+                    line = (await reader.readline()).decode().strip()
+                    if line in ("you win", "you lose", "even", ""):
+                        writer.close()
+                        return line
+                    if line == "your turn" and actions:
+                        writer.write((actions.pop(0) + '\n').encode())
+
+            # 形式の正しくない行動は，例外にならずにその行動をしたクライアントの負けになる．
+            def test_invalid_action(self):
+                async def client(port):
+                    bad = ['{"attack": {"to": [1]}}']
+                    return await asyncio.gather(self.raw_client(port, bad), self.raw_client(port, bad, 0.05))
+
+                lobby, results = self.serve(client, 1)
+                self.assertEqual(["you lose", "you win"], results)
+                self.assertEqual((1, 0), (lobby.stats.finished, lobby.stats.errors))
+
+            # 時間内に行動を送らないクライアントは負けになる．
+            def test_timeout(self):
+                async def client(port):
+                    move = ['{"move": {"ship": "w", "to": [1, 0]}}']
+                    return await asyncio.gather(self.raw_client(port, move), self.raw_client(port, [], 0.05))
+
+                lobby, results = self.serve(client, 1, timeout=0.2)
+                self.assertEqual(["you win", "you lose"], results)
+                self.assertEqual(1, lobby.stats.finished)
+
+            # 相手を待っている間に切れた接続は，組にしない．
+            def test_closed_waiting(self):
+                async def client(port):
+                    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                    writer.close()
+                    await asyncio.sleep(0.05)
+                    bad = ['{"attack": {"to": [1]}}']
+                    return await asyncio.gather(self.raw_client(port, bad), self.raw_client(port, bad, 0.05))
+
+                lobby, results = self.serve(client, 1)
+                self.assertEqual(["you lose", "you win"], results)
+                self.assertEqual((1, 0, 0), (lobby.stats.finished, lobby.stats.errors, lobby.stats.sessions))
+
+            # 簡潔な形式に応じるクライアントとJSONのままのクライアントが対戦でき，対戦が記録されることを確かめる．
+            def test_codecs(self):
+                async def client(port):
+                    return await asyncio.gather(
+                        run_sessions('127.0.0.1', port, random_player.RandomPlayer, range(0, 20, 2), 10),
+                        run_sessions('127.0.0.1', port, random_player.RandomPlayer, range(1, 20, 2), 10,
+                                     codecs=()))
+
+                with tempfile.TemporaryDirectory() as path:
+                    with RecordWriter(path) as recorder:
+                        lobby, results = self.serve(client, 10, recorder)
+                    with RecordReader(path) as reader:
+                        self.assertEqual(10, len(reader))
+                        for game in reader:
+                            replay(game)
+                self.assertEqual(10, lobby.stats.finished)
+                self.assertEqual(10, sum(results[0].values()))
+                self.assertEqual(10, sum(results[1].values()))
+
+        unittest.main(argv=sys.argv[:1])
+    else:
+        import argparse
+
+        parser = argparse.ArgumentParser(description="Server for Submaline Game with a matchmaking lobby")
+        parser.add_argument("--ipaddr", type=str, default="127.0.0.1", help="Address to listen on")
+        parser.add_argument("--port", type=int, default=2000, help="Port to listen on")
+        parser.add_argument("--quiet", action="store_true", help="Do not print each result")
+        parser.add_argument("--matches", type=int, default=None,
+                            help="Stop after this number of matches")
+        parser.add_argument("--max-turns", type=int, default=MAX_TURNS, help="Turn limit")
+        parser.add_argument("--record", type=str, default=None,
+                            help="Directory to append game records to")
+        parser.add_argument("--turn-timeout", type=float, default=TURN_TIMEOUT,
+                            help="Seconds to wait for a line from a client before it loses. 0 waits forever")
+        parser.add_argument("--backlog", type=int, default=4096, help="Listen backlog")
+        parser.add_argument("--stats-interval", type=float, default=10.0,
+                            help="Seconds between statistics reports")
+        opts = parser.parse_args()
+
+        asyncio.run(main(opts))